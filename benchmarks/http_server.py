@@ -0,0 +1,102 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Local stand-in of an object storage gateway: serves the files of a
+directory over HTTP/1.1 (keep-alive), with single range requests, an ETag,
+and an optional latency per request.
+
+    python -m benchmarks.http_server benchmarks/images --port 8080 --latency 20
+    python ls.py http://localhost:8080/small.ext4 -l /
+"""
+
+import http.server
+import os
+import re
+import sys
+import time
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0  # Seconds
+    requests = 0
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        type(self).requests += 1
+        time.sleep(self.latency)
+        path = self.translate_path(self.path)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            start, end = 0, st.st_size
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                start = int(match[1])
+                end = min(int(match[2]) + 1, st.st_size) if match[2] else st.st_size
+                if start >= end:
+                    self.send_error(416)
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{st.st_size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end - start))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", f'"{st.st_mtime_ns:x}-{st.st_size:x}"')
+            self.end_headers()
+            if send_body:
+                self.wfile.write(os.pread(f.fileno(), end - start, start))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.http_server",
+                                     description="serve images with HTTP range requests")
+    parser.add_argument("directory", help="directory to serve")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="latency added to each request, in ms")
+    return parser
+
+
+def main(directory, port=8080, latency=0):
+    RangeRequestHandler.latency = latency / 1000
+    handler = lambda *args: RangeRequestHandler(*args, directory=directory)
+    with http.server.ThreadingHTTPServer(("127.0.0.1", port), handler) as server:
+        print(f"Serving {directory} on http://127.0.0.1:{port}/", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    opts = _args_parser().parse_args()
+    main(**vars(opts))
@@ -0,0 +1,671 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Synthetic ext4 image generator.
+
+Images are built from scratch, without mkfs nor root rights, with a
+controllable shape: a tree of `depth` levels of `fanout` directories, with
+`files` regular files spread over the deepest directories.  Directories
+that do not fit in one block are hash-tree indexed; a big file made of
+`big_file_fragments` extents controls the extent tree depth.
+
+File contents are deterministic, see `expected_content()`.
+
+    python -m benchmarks.image image.ext4 --files 100000 --fanout 16 --depth 2
+"""
+
+import ctypes
+import random
+import struct
+
+from ext4.data_structures import \
+    Superblock, BlockGroupDescriptor, BlockGroupDescriptor64, Inode, _Inode_Linux2
+from ext4.tools import crc32c
+
+TIMESTAMP = 1600000000
+ROOT_INODE = 2
+LOST_FOUND_INODE = 11
+EXT4_INLINE_DATA_SIZE = 60
+EXT_INIT_MAX_LEN = 32768
+
+_FT_REGULAR_FILE = 1
+_FT_DIRECTORY = 2
+
+
+def expected_content(inode_no, size):
+    """Content of regular file `inode_no` in generated images"""
+    pattern = b"%015d\n" % inode_no
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+def _content_range(inode_no, start, end):
+    pattern = b"%015d\n" % inode_no
+    skip = start % len(pattern)
+    return (pattern * ((end - start + skip) // len(pattern) + 1))[skip:skip + end - start]
+
+
+def dx_hack_hash(name):
+    """Legacy (unsigned) hash of the ext4 hash-tree directories"""
+    hash0, hash1 = 0x12A3FE2D, 0x37ABE8F9
+    for c in name:
+        h = (hash1 + (hash0 ^ (c * 7152373))) & 0xFFFFFFFF
+        if h & 0x80000000:
+            h = (h - 0x7FFFFFFF) & 0xFFFFFFFF
+        hash1, hash0 = hash0, h
+    h = (hash0 << 1) & 0xFFFFFFFF
+    if h == 0x7FFFFFFF << 1:
+        h = (0x7FFFFFFF - 1) << 1
+    return h
+
+
+def _has_superblock_backup(bg_no):
+    if bg_no <= 1:
+        return True
+    for base in (3, 5, 7):
+        n = bg_no
+        while n % base == 0:
+            n //= base
+        if n == 1:
+            return True
+    return False
+
+
+def _rec_len(name):
+    return 8 + (len(name) + 3) // 4 * 4
+
+
+def _dirent(inode_no, rec_len, name, file_type):
+    return struct.pack("<IHBB", inode_no, rec_len, len(name), file_type) \
+        + name + b"\x00" * (rec_len - 8 - len(name))
+
+
+class _Inode:
+    __slots__ = ("no", "parent", "name", "is_dir", "size", "fragments", "children", "subdirs",
+                 "inline", "blocks", "extents", "extent_root", "tree_blocks", "data", "extra_flags")
+
+    def __init__(self, no, parent, name, is_dir, size=0, fragments=1):
+        self.no = no
+        self.parent = parent
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.fragments = fragments
+        self.children = [] if is_dir else None  # (name, inode number, file type)
+        self.subdirs = 0
+        self.inline = False
+        self.blocks = 0  # Number of data blocks
+        self.extents = None
+        self.tree_blocks = []  # (block number, content) of extent tree nodes
+        self.data = None  # Directory blocks content
+
+
+class _Allocator:
+    """Bump allocator over the blocks, skipping reserved ranges"""
+
+    def __init__(self, reserved, start):
+        self.reserved = sorted(reserved)  # (start, end) ranges
+        self.pos = start
+        self.runs = []  # Allocated (start, length)
+
+    def alloc(self, n):
+        runs = []
+        while n > 0:
+            for r_start, r_end in self.reserved:
+                if r_start <= self.pos < r_end:
+                    self.pos = r_end
+            next_reserved = min((r_start for r_start, _ in self.reserved if r_start > self.pos), default=None)
+            run = n if next_reserved is None else min(n, next_reserved - self.pos)
+            runs.append((self.pos, run))
+            self.pos += run
+            n -= run
+        self.runs.extend(runs)
+        return runs
+
+    def alloc_contiguous(self, n):
+        for r_start, r_end in self.reserved:
+            if self.pos < r_end and r_start < self.pos + n:
+                self.pos = max(self.pos, r_end)
+        return self.alloc(n)[0][0]
+
+    def skip(self, n):
+        self.pos += n
+
+
+class ImageBuilder:
+    def __init__(self, files=1000, fanout=8, depth=1, file_size=4096, fragments=1,
+                 big_file_size=0, big_file_fragments=1, htree_levels=0, inline_data=False,
+                 bit64=False, metadata_csum=True, block_size=4096, inode_size=256, seed=0):
+        self.files = files
+        self.fanout = fanout
+        self.depth = depth
+        self.file_size = file_size
+        self.fragments = fragments
+        self.big_file_size = big_file_size
+        self.big_file_fragments = big_file_fragments
+        self.htree_levels = htree_levels
+        self.inline_data = inline_data
+        self.bit64 = bit64
+        self.metadata_csum = metadata_csum
+        self.block_size = block_size
+        self.inode_size = inode_size
+        self.random = random.Random(seed)
+        self.uuid = bytes(self.random.getrandbits(8) for _ in range(16))
+        self.csum_seed = crc32c(self.uuid)
+        self.inodes = {}
+        self.desc_size = 64 if bit64 else 32
+        self.first_data_block = 1 if block_size == 1024 else 0
+        self.blocks_per_group = 8 * block_size
+
+    # Tree
+
+    def _add(self, parent, name, is_dir, **kwargs):
+        no = len(self.inodes) + LOST_FOUND_INODE + 1
+        inode = _Inode(no, parent.no, name, is_dir, **kwargs)
+        self.inodes[no] = inode
+        parent.children.append((name, no, _FT_DIRECTORY if is_dir else _FT_REGULAR_FILE))
+        if is_dir:
+            parent.subdirs += 1
+        return inode
+
+    def _build_tree(self):
+        root = _Inode(ROOT_INODE, ROOT_INODE, b"", True)
+        lost_found = _Inode(LOST_FOUND_INODE, ROOT_INODE, b"lost+found", True)
+        root.children.append((b"lost+found", LOST_FOUND_INODE, _FT_DIRECTORY))
+        root.subdirs += 1
+        self.root, self.lost_found = root, lost_found
+        level = [root]
+        for d in range(self.depth):
+            level = [self._add(parent, b"dir%04d" % i, True) for parent in level for i in range(self.fanout)]
+        for i in range(self.files):
+            size = self.file_size if isinstance(self.file_size, int) else self.random.randint(*self.file_size)
+            self._add(level[i % len(level)], b"file%07d" % i, False, size=size, fragments=self.fragments)
+        if self.big_file_size:
+            self._add(root, b"big.bin", False, size=self.big_file_size, fragments=self.big_file_fragments)
+        self.all_inodes = [root, lost_found] + list(self.inodes.values())
+
+    # Directory blocks
+
+    def _leaf_capacity(self):
+        return self.block_size - (12 if self.metadata_csum else 0)
+
+    def _pack_leaves(self, entries, first=b""):
+        """Pack (name, inode, type) entries into directory blocks"""
+        capacity = self._leaf_capacity()
+        blocks, current, used = [], [], len(first)
+        for entry in entries:
+            if used + _rec_len(entry[0]) > capacity:
+                blocks.append((first if not blocks else b"", current))
+                current, used = [], 0
+            current.append(entry)
+            used += _rec_len(entry[0])
+        blocks.append((first if not blocks else b"", current))
+        return blocks
+
+    def _leaf_block(self, inode, head, entries):
+        capacity = self._leaf_capacity()
+        data = bytearray(head)
+        for i, (name, no, ftype) in enumerate(entries):
+            rec_len = capacity - len(data) if i == len(entries) - 1 else _rec_len(name)
+            data += _dirent(no, rec_len, name, ftype)
+        if not entries:
+            data += _dirent(0, capacity - len(data), b"", 0)
+        return self._seal_leaf(inode, data)
+
+    def _seal_leaf(self, inode, data):
+        if self.metadata_csum:
+            csum = crc32c(bytes(data), self._inode_csum_seed(inode.no))
+            data += struct.pack("<IHBBI", 0, 12, 0, 0xDE, csum)
+        return bytes(data)
+
+    def _dots(self, inode, dotdot_rec_len=12):
+        dotdot = struct.pack("<IHBB4s", inode.parent, dotdot_rec_len, 2, _FT_DIRECTORY, b"..")
+        return _dirent(inode.no, 12, b".", _FT_DIRECTORY) + dotdot
+
+    def _dx_block(self, inode, head, count_offset, limit, entries):
+        """Hash-tree root or node: `entries` are (hash, logical block)"""
+        data = bytearray(head)
+        data += struct.pack("<HHI", limit, len(entries), entries[0][1])
+        for h, block in entries[1:]:
+            data += struct.pack("<II", h, block)
+        data += b"\x00" * (count_offset + limit * 8 - len(data))
+        if self.metadata_csum:
+            csum = crc32c(bytes(data[:count_offset + len(entries) * 8]), self._inode_csum_seed(inode.no))
+            csum = crc32c(b"\x00" * 8, csum)
+            data += struct.pack("<II", 0, csum)
+        data += b"\x00" * (self.block_size - len(data))
+        return bytes(data)
+
+    def _layout_directory(self, inode):
+        entries = inode.children
+        if self.inline_data and inode.no not in (ROOT_INODE, LOST_FOUND_INODE) \
+                and sum(_rec_len(name) for name, _, _ in entries) <= EXT4_INLINE_DATA_SIZE - 4:
+            data = bytearray(struct.pack("<I", inode.parent))
+            for i, (name, no, ftype) in enumerate(entries):
+                rec_len = EXT4_INLINE_DATA_SIZE - len(data) if i == len(entries) - 1 else _rec_len(name)
+                data += _dirent(no, rec_len, name, ftype)
+            if not entries:
+                data += _dirent(0, EXT4_INLINE_DATA_SIZE - len(data), b"", 0)
+            inode.inline, inode.data, inode.size = True, bytes(data), EXT4_INLINE_DATA_SIZE
+            return
+        leaves = self._pack_leaves(entries, self._dots(inode))
+        if len(leaves) == 1 and self.htree_levels == 0:
+            inode.data = [self._leaf_block(inode, *leaves[0])]
+        else:
+            inode.data = self._layout_htree(inode, entries)
+        inode.blocks = len(inode.data)
+        inode.size = inode.blocks * self.block_size
+
+    def _layout_htree(self, inode, entries):
+        tail = 1 if self.metadata_csum else 0
+        root_limit = (self.block_size - 0x20) // 8 - tail
+        node_limit = (self.block_size - 0x8) // 8 - tail
+        hashed = sorted((dx_hack_hash(name), name, no, ftype) for name, no, ftype in entries)
+        leaves, leaf_hashes, current, used, previous = [], [], [], 0, None
+        for h, name, no, ftype in hashed:
+            if current and used + _rec_len(name) > self._leaf_capacity():
+                leaves.append(current)
+                # Low bit: the hash continues from the previous block
+                leaf_hashes.append(h | (1 if h == previous else 0))
+                current, used = [], 0
+            current.append((name, no, ftype))
+            used += _rec_len(name)
+            previous = h
+        leaves.append(current)
+        leaf_hashes.insert(0, 0)
+        levels = self.htree_levels if len(leaves) <= root_limit else max(self.htree_levels, 1)
+        if levels > 1 or len(leaves) > root_limit * node_limit:
+            raise ValueError("Directory too large for the supported hash-tree depth")
+        info = struct.pack("<IBBBB", 0, 0, 8, levels, 0)  # Legacy hash
+        head = self._dots(inode, self.block_size - 12) + info
+        if levels == 0:
+            first_leaf = 1
+            root = self._dx_block(inode, head, 0x20, root_limit,
+                                  [(h, first_leaf + i) for i, h in enumerate(leaf_hashes)])
+            blocks = [root]
+        else:
+            n_nodes = max(-(-len(leaves) // node_limit), 1)
+            per_node = -(-len(leaves) // n_nodes)
+            first_leaf = 1 + n_nodes
+            nodes, root_entries = [], []
+            for n in range(n_nodes):
+                children = range(n * per_node, min((n + 1) * per_node, len(leaves)))
+                root_entries.append((leaf_hashes[children[0]], 1 + n))
+                node_head = struct.pack("<IHBB", 0, self.block_size, 0, 0)
+                nodes.append(self._dx_block(inode, node_head, 0x8, node_limit,
+                                            [(leaf_hashes[c], first_leaf + c) for c in children]))
+            blocks = [self._dx_block(inode, head, 0x20, root_limit, root_entries)] + nodes
+        blocks.extend(self._leaf_block(inode, b"", leaf) for leaf in leaves)
+        inode.extra_flags = Inode.Flags.INDEX
+        return blocks
+
+    # Layout
+
+    def _gdt_blocks(self, n_groups):
+        return -(-n_groups * self.desc_size // self.block_size)
+
+    def _reserved_ranges(self, n_groups):
+        gdt_blocks = self._gdt_blocks(n_groups)
+        ranges = []
+        for g in range(n_groups):
+            if _has_superblock_backup(g):
+                start = self.first_data_block + g * self.blocks_per_group
+                ranges.append((start if g else 0, start + 1 + gdt_blocks))
+        return ranges
+
+    def _layout(self):
+        bs = self.block_size
+        for inode in self.all_inodes:
+            inode.extra_flags = 0
+            if inode.is_dir:
+                self._layout_directory(inode)
+            elif self.inline_data and inode.size <= EXT4_INLINE_DATA_SIZE:
+                inode.inline = True
+            else:
+                inode.blocks = -(-inode.size // bs)
+        # Size the file system: enough for data, extent trees and metadata
+        data_blocks = sum(inode.blocks + 2 * inode.fragments for inode in self.all_inodes)
+        n_inodes = len(self.all_inodes) + LOST_FOUND_INODE
+        inodes_per_block = bs // self.inode_size
+        n_groups = 1
+        while True:
+            ipg = -(-n_inodes // n_groups)
+            unit = max(inodes_per_block, 8)
+            ipg = max(-(-ipg // unit) * unit, 16)
+            itable_blocks = ipg * self.inode_size // bs
+            meta = sum(e - s for s, e in self._reserved_ranges(n_groups)) + n_groups * (2 + itable_blocks)
+            total = self.first_data_block + (meta + data_blocks) * 21 // 20 + 64
+            needed = -(-(total - self.first_data_block) // self.blocks_per_group)
+            if needed <= n_groups and ipg <= 8 * bs:
+                break
+            n_groups = max(needed, n_groups + 1)
+        # Groups may be required by inodes rather than blocks; do not leave a tiny last group
+        total = max(total, self.first_data_block + (n_groups - 1) * self.blocks_per_group + 256)
+        last = (total - self.first_data_block) % self.blocks_per_group
+        if 0 < last < 256:
+            total += 256 - last
+        self.n_groups, self.inodes_per_group, self.itable_blocks = n_groups, ipg, itable_blocks
+        self.blocks_count = total
+        self.allocator = _Allocator(self._reserved_ranges(n_groups), 0)
+        self.bitmaps_loc = [(self.allocator.alloc(1)[0][0], None) for _ in range(n_groups)]
+        self.bitmaps_loc = [(b, self.allocator.alloc(1)[0][0]) for b, _ in self.bitmaps_loc]
+        self.itable_loc = []
+        for g in range(n_groups):
+            self.itable_loc.append(self.allocator.alloc_contiguous(itable_blocks))
+        for inode in self.all_inodes:
+            if inode.blocks:
+                self._allocate(inode)
+        if self.allocator.pos > self.blocks_count:
+            raise RuntimeError("Image size underestimated")
+
+    def _allocate(self, inode):
+        fragments = max(1, min(inode.fragments, inode.blocks))
+        logical, extents = 0, []
+        for f in range(fragments):
+            n = inode.blocks // fragments + (1 if f < inode.blocks % fragments else 0)
+            for start, length in self.allocator.alloc(n):
+                while length > 0:
+                    ee_len = min(length, EXT_INIT_MAX_LEN)
+                    extents.append((logical, start, ee_len))
+                    logical, start, length = logical + ee_len, start + ee_len, length - ee_len
+            if fragments > 1:
+                self.allocator.skip(1)
+        inode.extents = extents
+        inode.extent_root = self._build_extent_tree(inode, extents)
+
+    def _extent_node(self, inode, depth, entries, max_entries):
+        data = struct.pack("<HHHHI", 0xF30A, len(entries), max_entries, depth, 0)
+        for entry in entries:
+            if depth == 0:
+                logical, physical, length = entry
+                data += struct.pack("<IHHI", logical, length, physical >> 32, physical & 0xFFFFFFFF)
+            else:
+                logical, physical = entry
+                data += struct.pack("<IIHH", logical, physical & 0xFFFFFFFF, physical >> 32, 0)
+        return data
+
+    def _build_extent_tree(self, inode, extents):
+        """Return the i_block content, allocating tree blocks as needed"""
+        node_max = (self.block_size - 12) // 12
+        depth, entries = 0, extents
+        while len(entries) > 4:
+            upper = []
+            for i in range(0, len(entries), node_max):
+                chunk = entries[i:i + node_max]
+                block_no = self.allocator.alloc(1)[0][0]
+                data = self._extent_node(inode, depth, chunk, node_max)
+                data += b"\x00" * (12 + node_max * 12 - len(data))
+                if self.metadata_csum:
+                    data += struct.pack("<I", crc32c(data, self._inode_csum_seed(inode.no)))
+                inode.tree_blocks.append((block_no, data))
+                upper.append((chunk[0][0], block_no))
+            depth, entries = depth + 1, upper
+        return self._extent_node(inode, depth, entries, 4)
+
+    # Checksums and structures
+
+    def _inode_csum_seed(self, inode_no, generation=0):
+        crc = crc32c(inode_no.to_bytes(4, 'little'), self.csum_seed)
+        return crc32c(generation.to_bytes(4, 'little'), crc)
+
+    def _inode_bytes(self, inode):
+        raw = Inode(None, inode.no, 0)
+        raw.i_mode = (Inode.Mode.IFDIR | 0o755) if inode.is_dir else (Inode.Mode.IFREG | 0o644)
+        raw.i_size_lo = inode.size & 0xFFFFFFFF
+        raw.i_size_high = inode.size >> 32
+        raw.i_atime = raw.i_ctime = raw.i_mtime = raw.i_crtime = TIMESTAMP
+        raw.i_links_count = 1 if not inode.is_dir or inode.subdirs >= 65000 - 2 else 2 + inode.subdirs
+        sectors = (inode.blocks + len(inode.tree_blocks)) * self.block_size // 512
+        raw.i_blocks_lo = sectors
+        raw.i_extra_isize = ctypes.sizeof(Inode) - Inode.EXT2_GOOD_OLD_INODE_SIZE
+        extra = bytearray(self.inode_size - ctypes.sizeof(Inode))
+        if inode.inline:
+            raw.i_flags = Inode.Flags.INLINE_DATA
+            content = inode.data if inode.is_dir else expected_content(inode.no, inode.size)
+            ctypes.memmove(ctypes.addressof(raw) + Inode.i_block.offset, content, len(content))
+            # Empty "system.data" extended attribute, required along inline data
+            extra[:24] = struct.pack("<IBBHIII4s", 0xEA020000, 4, 7, 0, 0, 0, 0, b"data")
+        elif inode.blocks:
+            raw.i_flags = Inode.Flags.EXTENTS | inode.extra_flags
+            root = inode.extent_root
+            ctypes.memmove(ctypes.addressof(raw) + Inode.i_block.offset, root, len(root))
+        else:
+            raw.i_flags = Inode.Flags.EXTENTS
+            root = self._extent_node(inode, 0, [], 4)
+            ctypes.memmove(ctypes.addressof(raw) + Inode.i_block.offset, root, len(root))
+        data = bytearray(bytes(raw) + extra)
+        if self.metadata_csum:
+            csum = crc32c(bytes(data), self._inode_csum_seed(inode.no))
+            lo = Inode.i_osd2.offset + _Inode_Linux2.l_i_checksum_lo.offset
+            data[lo:lo + 2] = (csum & 0xFFFF).to_bytes(2, 'little')
+            data[Inode.i_checksum_hi.offset:Inode.i_checksum_hi.offset + 2] = (csum >> 16).to_bytes(2, 'little')
+        return bytes(data)
+
+    def _superblock(self, free_blocks, free_inodes, bg_no=0):
+        sb = Superblock(None)
+        sb.s_inodes_count = self.n_groups * self.inodes_per_group
+        sb.s_blocks_count_lo = self.blocks_count & 0xFFFFFFFF
+        sb.s_blocks_count_hi = self.blocks_count >> 32
+        sb.s_free_blocks_count_lo = free_blocks & 0xFFFFFFFF
+        sb.s_free_blocks_count_hi = free_blocks >> 32
+        sb.s_free_inodes_count = free_inodes
+        sb.s_first_data_block = self.first_data_block
+        sb.s_log_block_size = sb.s_log_cluster_size = self.block_size.bit_length() - 11
+        sb.s_blocks_per_group = sb.s_clusters_per_group = self.blocks_per_group
+        sb.s_inodes_per_group = self.inodes_per_group
+        sb.s_wtime = sb.s_mkfs_time = sb.s_lastcheck = TIMESTAMP
+        sb.s_max_mnt_count = 0xFFFF
+        sb.s_magic = 0xEF53
+        sb.s_state = 1  # Cleanly unmounted
+        sb.s_errors = 1  # Continue
+        sb.s_rev_level = 1
+        sb.s_first_ino = LOST_FOUND_INODE
+        sb.s_inode_size = self.inode_size
+        sb.s_block_group_nr = bg_no
+        sb.s_feature_compat = Superblock.FeatureCompat.COMPAT_DIR_INDEX
+        sb.s_feature_incompat = Superblock.FeatureIncompat.INCOMPAT_FILETYPE \
+            | Superblock.FeatureIncompat.INCOMPAT_EXTENTS | Superblock.FeatureIncompat.INCOMPAT_FLEX_BG
+        sb.s_feature_ro_compat = Superblock.FeatureRoCompat.RO_COMPAT_SPARSE_SUPER \
+            | Superblock.FeatureRoCompat.RO_COMPAT_LARGE_FILE | Superblock.FeatureRoCompat.RO_COMPAT_DIR_NLINK \
+            | Superblock.FeatureRoCompat.RO_COMPAT_EXTRA_ISIZE
+        if self.inline_data:
+            sb.s_feature_compat |= Superblock.FeatureCompat.COMPAT_EXT_ATTR
+            sb.s_feature_incompat |= Superblock.FeatureIncompat.INCOMPAT_INLINE_DATA
+        if self.bit64:
+            sb.s_feature_incompat |= Superblock.FeatureIncompat.INCOMPAT_64BIT
+            sb.s_desc_size = self.desc_size
+        if self.metadata_csum:
+            sb.s_feature_ro_compat |= Superblock.FeatureRoCompat.RO_COMPAT_METADATA_CSUM
+            sb.s_checksum_type = 1  # crc32c
+        ctypes.memmove(sb.s_uuid, self.uuid, 16)
+        ctypes.memmove(sb.s_volume_name, b"synthetic", 9)
+        sb.s_def_hash_version = 0  # Legacy
+        sb.s_flags = 0x2  # Unsigned directory hash
+        sb.s_min_extra_isize = sb.s_want_extra_isize = ctypes.sizeof(Inode) - Inode.EXT2_GOOD_OLD_INODE_SIZE
+        sb.s_log_groups_per_flex = 4
+        data = bytes(sb)
+        if self.metadata_csum:
+            sb.s_checksum = crc32c(data[:Superblock.s_checksum.offset])
+            data = bytes(sb)
+        return data
+
+    def _group_desc(self, g, block_bitmap, inode_bitmap, free_blocks, free_inodes, used_dirs):
+        desc = BlockGroupDescriptor64(None, g, 0) if self.bit64 else BlockGroupDescriptor(None, g, 0)
+        b_bitmap, i_bitmap = self.bitmaps_loc[g]
+        desc.bg_block_bitmap_lo, desc.bg_inode_bitmap_lo = b_bitmap & 0xFFFFFFFF, i_bitmap & 0xFFFFFFFF
+        desc.bg_inode_table_lo = self.itable_loc[g] & 0xFFFFFFFF
+        desc.bg_free_blocks_count_lo = free_blocks & 0xFFFF
+        desc.bg_free_inodes_count_lo = free_inodes & 0xFFFF
+        desc.bg_used_dirs_count_lo = used_dirs & 0xFFFF
+        if self.metadata_csum:
+            b_csum = crc32c(bytes(block_bitmap), self.csum_seed)
+            i_csum = crc32c(bytes(inode_bitmap[:self.inodes_per_group // 8]), self.csum_seed)
+            desc.bg_block_bitmap_csum_lo, desc.bg_inode_bitmap_csum_lo = b_csum & 0xFFFF, i_csum & 0xFFFF
+        if self.bit64:
+            desc.bg_block_bitmap_hi, desc.bg_inode_bitmap_hi = b_bitmap >> 32, i_bitmap >> 32
+            desc.bg_inode_table_hi = self.itable_loc[g] >> 32
+            desc.bg_free_blocks_count_hi = free_blocks >> 16
+            desc.bg_free_inodes_count_hi = free_inodes >> 16
+            desc.bg_used_dirs_count_hi = used_dirs >> 16
+            if self.metadata_csum:
+                desc.bg_block_bitmap_csum_hi, desc.bg_inode_bitmap_csum_hi = b_csum >> 16, i_csum >> 16
+        if self.metadata_csum:
+            data = bytearray(bytes(desc))
+            data[0x1E:0x20] = b"\x00\x00"
+            desc.bg_checksum = crc32c(self.uuid + g.to_bytes(4, 'little') + bytes(data)) & 0xFFFF
+        return bytes(desc)
+
+    # Output
+
+    def write(self, path):
+        self._build_tree()
+        self._layout()
+        bs = self.block_size
+        with open(path, "wb") as f:
+            f.truncate(self.blocks_count * bs)
+
+            def pwrite(block_no, data, offset=0):
+                f.seek(block_no * bs + offset)
+                f.write(data)
+
+            # Contents
+            for inode in self.all_inodes:
+                if inode.blocks:
+                    for logical, physical, length in inode.extents:
+                        if inode.is_dir:
+                            pwrite(physical, b"".join(inode.data[logical:logical + length]))
+                        else:
+                            end = min((logical + length) * bs, inode.size)
+                            pwrite(physical, _content_range(inode.no, logical * bs, end))
+                    for block_no, data in inode.tree_blocks:
+                        pwrite(block_no, data)
+            # Inode tables
+            ipg = self.inodes_per_group
+            used_inodes = {inode.no: inode for inode in self.all_inodes}
+            for g in range(self.n_groups):
+                table = bytearray()
+                for no in range(g * ipg + 1, min((g + 1) * ipg, max(used_inodes)) + 1):
+                    inode = used_inodes.get(no)
+                    if inode is not None:
+                        table += self._inode_bytes(inode)
+                    else:
+                        table += bytes(self.inode_size)
+                if table:
+                    pwrite(self.itable_loc[g], table)
+            # Bitmaps and group descriptors
+            used = [bytearray(bs) for _ in range(self.n_groups)]
+            for start, end in self.allocator.reserved:
+                self._mark(used, start, end - start)
+            for start, length in self.allocator.runs:
+                self._mark(used, start, length)
+            self._mark(used, self.blocks_count, self.n_groups * self.blocks_per_group
+                       + self.first_data_block - self.blocks_count)
+            descriptors, free_blocks_total, free_inodes_total = b"", 0, 0
+            for g in range(self.n_groups):
+                group_blocks = min(self.blocks_per_group,
+                                   self.blocks_count - self.first_data_block - g * self.blocks_per_group)
+                free_blocks = group_blocks - self._count_bits(used[g], group_blocks)
+                inode_bitmap = bytearray(bs)
+                group_inodes = [no for no in range(g * ipg + 1, (g + 1) * ipg + 1)
+                                if no in used_inodes or no < LOST_FOUND_INODE]
+                for no in group_inodes:
+                    i = no - g * ipg - 1
+                    inode_bitmap[i // 8] |= 1 << (i % 8)
+                for i in range(ipg, 8 * bs):  # Padding
+                    inode_bitmap[i // 8] |= 1 << (i % 8)
+                used_dirs = sum(1 for no in group_inodes if no in used_inodes and used_inodes[no].is_dir)
+                free_inodes = ipg - len(group_inodes)
+                free_blocks_total += free_blocks
+                free_inodes_total += free_inodes
+                pwrite(self.bitmaps_loc[g][0], used[g])
+                pwrite(self.bitmaps_loc[g][1], inode_bitmap)
+                descriptors += self._group_desc(g, used[g], inode_bitmap, free_blocks, free_inodes, used_dirs)
+            # Superblocks
+            for g in range(self.n_groups):
+                if not _has_superblock_backup(g):
+                    continue
+                start = self.first_data_block + g * self.blocks_per_group
+                sb = self._superblock(free_blocks_total, free_inodes_total, g)
+                if g == 0:
+                    f.seek(1024)
+                    f.write(sb)
+                else:
+                    pwrite(start, sb)
+                pwrite(start + 1, descriptors)
+        return self
+
+    def _mark(self, bitmaps, start, length):
+        """Set the bits of blocks [start, start + length) in per-group bitmaps"""
+        pos = start - self.first_data_block
+        end = pos + length
+        if start < self.first_data_block:  # Boot block of 1 KiB block file systems
+            pos = 0
+        while pos < end:
+            g, i = divmod(pos, self.blocks_per_group)
+            n = min(end - pos, self.blocks_per_group - i)
+            bitmap = bitmaps[g]
+            j = i
+            while j < i + n and j % 8:
+                bitmap[j // 8] |= 1 << (j % 8)
+                j += 1
+            full = (i + n - j) // 8
+            bitmap[j // 8:j // 8 + full] = b"\xFF" * full
+            j += full * 8
+            while j < i + n:
+                bitmap[j // 8] |= 1 << (j % 8)
+                j += 1
+            pos += n
+
+    @staticmethod
+    def _count_bits(bitmap, n_bits):
+        full = n_bits // 8
+        count = bin(int.from_bytes(bitmap[:full], 'little')).count("1")
+        for i in range(full * 8, n_bits):
+            count += (bitmap[i // 8] >> (i % 8)) & 1
+        return count
+
+
+def make_image(path, **shape):
+    """Write an image to `path`.  See `ImageBuilder` for the shape parameters."""
+    return ImageBuilder(**shape).write(path)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.image", description="generate an ext4 image")
+    parser.add_argument("path", help="image file to write")
+    parser.add_argument("--files", type=int, default=1000, help="number of regular files")
+    parser.add_argument("--fanout", type=int, default=8, help="subdirectories per directory")
+    parser.add_argument("--depth", type=int, default=1, help="levels of subdirectories")
+    parser.add_argument("--file-size", type=int, default=4096, help="size of regular files")
+    parser.add_argument("--fragments", type=int, default=1, help="extents per regular file")
+    parser.add_argument("--big-file-size", type=int, default=0, help="size of /big.bin (0: no such file)")
+    parser.add_argument("--big-file-fragments", type=int, default=1, help="extents of /big.bin")
+    parser.add_argument("--htree-levels", type=int, default=0, choices=(0, 1),
+                        help="minimal indirect levels of indexed directories")
+    parser.add_argument("--inline-data", action='store_true', help="store small files and directories in inodes")
+    parser.add_argument("--64bit", action='store_true', dest="bit64", help="enable the 64bit feature")
+    parser.add_argument("--no-metadata-csum", action='store_false', dest="metadata_csum",
+                        help="disable metadata checksums")
+    parser.add_argument("--block-size", type=int, default=4096, choices=(1024, 2048, 4096))
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+if __name__ == '__main__':
+    opts = _args_parser().parse_args()
+    make_image(**vars(opts))
@@ -0,0 +1,269 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Benchmark harness.
+
+Each profile is a synthetic image shape (see `benchmarks.image`).  Images
+are generated once, then cached in `benchmarks/images/`.  Each case is run
+`--repeat` times on a freshly opened `Filesystem` (so with cold in-process
+caches, but a warm page cache); the minimum and the median are reported.
+
+    python -m benchmarks.run small wide --save
+    python -m benchmarks.run small --compare benchmarks/results/small-1a2b3c4.json
+"""
+
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from ext4 import Filesystem
+from ext4.files import Directory, RegularFile
+from .image import make_image
+
+MiB = 1024 * 1024
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGES_DIR = os.path.join(BENCHMARKS_DIR, "images")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+
+PROFILES = {
+    "small": dict(files=1000, fanout=8, depth=1),
+    "wide": dict(files=200000, fanout=1, depth=1, file_size=0),  # Two-level hash tree
+    "deep": dict(files=20000, fanout=4, depth=6, file_size=1024),
+    "fragmented": dict(files=1000, fragments=4, file_size=64 * 1024,
+                       big_file_size=256 * MiB, big_file_fragments=20000),  # Extent tree of depth 2
+    "inline": dict(files=20000, fanout=32, depth=2, file_size=48, inline_data=True),
+    "nocsum": dict(files=20000, fanout=16, depth=2, metadata_csum=False),
+    "64bit": dict(files=20000, fanout=16, depth=2, bit64=True, block_size=1024),
+    "huge": dict(files=1000000, fanout=32, depth=2, file_size=512),
+}
+
+# Number of operations of the random cases
+N_INODES = 20000
+N_PATHS = 2000
+N_READS = 2000
+READ_SIZE = 4096
+SEQUENTIAL_READ_SIZE = 16 * MiB
+
+
+class Context:
+    """What the cases need to know about an image: collected once, untimed"""
+
+    def __init__(self, image, seed=0):
+        self.image = image
+        self.random = random.Random(seed)
+        with Filesystem(image) as fs:
+            self.inodes, self.paths, self.files = [], [], []
+            entries = {"/": 0}
+            for file in fs.get_root_dir().walk():
+                self.inodes.append(file.inode_no)
+                self.paths.append(file.path)
+                entries[os.path.dirname(file.path)] += 1
+                if isinstance(file, Directory):
+                    entries[file.path] = 0
+                elif isinstance(file, RegularFile):
+                    self.files.append((file.path, file.inode.get_size()))
+        self.largest_directory = max(entries, key=entries.get)
+        self.biggest_file = max(self.files, key=lambda f: f[1], default=(None, 0))
+
+
+def bench_get_inode(fs, ctx):
+    for inode_no in ctx.random.choices(ctx.inodes, k=N_INODES):
+        fs.get_inode(inode_no)
+    return N_INODES
+
+
+def bench_listdir(fs, ctx):
+    return sum(1 for _ in fs.get_file(ctx.largest_directory).get_files())
+
+
+def bench_stat_all(fs, ctx):
+    return len(fs.get_file(ctx.largest_directory).stat_all())
+
+
+def bench_walk(fs, ctx):
+    return sum(1 for _ in fs.get_root_dir().walk())
+
+
+def bench_resolve(fs, ctx):
+    for path in ctx.random.choices(ctx.paths, k=N_PATHS):
+        fs.get_file(path)
+    return N_PATHS
+
+
+def bench_sequential_read(fs, ctx):
+    """Read the biggest file, or the small files in walk order if there is no big one"""
+    path, size = ctx.biggest_file
+    if size >= SEQUENTIAL_READ_SIZE:
+        files = [fs.get_file(path)]
+    else:
+        files = (file for file in fs.get_root_dir().walk() if isinstance(file, RegularFile))
+    total = 0
+    for file in files:
+        total += sum(len(chunk) for chunk in file.content.iter_bytes())
+        if total >= SEQUENTIAL_READ_SIZE:
+            break
+    return total / MiB
+
+
+def bench_random_read(fs, ctx):
+    """Read ranges at random offsets of the biggest file, or in random files
+    if there is no big one"""
+    path, size = ctx.biggest_file
+    if size >= SEQUENTIAL_READ_SIZE:
+        content = fs.get_file(path).content
+        for _ in range(N_READS):
+            start = ctx.random.randrange(size - READ_SIZE + 1)
+            content.get_bytes(start, start + READ_SIZE)
+    else:
+        for path, size in ctx.random.choices(ctx.files, k=N_READS) if ctx.files else ():
+            start = ctx.random.randrange(max(size - READ_SIZE, 0) + 1)
+            fs.get_file(path).content.get_bytes(start, min(start + READ_SIZE, size))
+    return N_READS if ctx.files else 0
+
+
+def bench_checksums(fs, ctx):
+    """Checksum verification only: structures are parsed beforehand"""
+    inodes = [fs.get_inode(inode_no) for inode_no in ctx.inodes[:N_INODES]]
+    groups = range(-(-fs.conf.s_inodes_count // fs.conf.s_inodes_per_group))
+    descriptors = [fs.get_block_group_desc(bg_no) for bg_no in groups]
+    start = time.perf_counter()
+    for inode in inodes:
+        inode.verify_checksums()
+    for descriptor in descriptors:
+        descriptor.verify_checksums()
+    return len(inodes) + len(descriptors), time.perf_counter() - start
+
+
+CASES = {
+    "get_inode": (bench_get_inode, "inodes"),
+    "listdir": (bench_listdir, "entries"),
+    "stat_all": (bench_stat_all, "entries"),
+    "walk": (bench_walk, "files"),
+    "resolve": (bench_resolve, "paths"),
+    "sequential_read": (bench_sequential_read, "MiB"),
+    "random_read": (bench_random_read, "reads"),
+    "checksums": (bench_checksums, "structures"),
+}
+
+
+def get_image(profile):
+    shape = PROFILES[profile]
+    digest = hashlib.sha1(json.dumps(shape, sort_keys=True).encode()).hexdigest()[:8]
+    path = os.path.join(IMAGES_DIR, f"{profile}-{digest}.ext4")
+    if not os.path.exists(path):
+        os.makedirs(IMAGES_DIR, exist_ok=True)
+        print(f"Generating {path}...", file=sys.stderr)
+        make_image(path + ".tmp", **shape)
+        os.rename(path + ".tmp", path)
+    return path
+
+
+def run_case(func, ctx, repeat):
+    durations, ops = [], 0
+    for _ in range(repeat):
+        ctx.random.seed(0)  # Same operations on each run
+        with Filesystem(ctx.image) as fs:
+            start = time.perf_counter()
+            result = func(fs, ctx)
+            duration = time.perf_counter() - start
+        if isinstance(result, tuple):
+            ops, duration = result
+        else:
+            ops = result
+        durations.append(duration)
+    return {"ops": ops, "min_s": min(durations), "median_s": statistics.median(durations)}
+
+
+def run_profile(profile, cases, repeat):
+    image = get_image(profile)
+    ctx = Context(image)
+    results = {}
+    for name in cases:
+        func, unit = CASES[name]
+        results[name] = run_case(func, ctx, repeat)
+        results[name]["unit"] = unit
+    return {"meta": _metadata(profile, repeat), "cases": results}
+
+
+def _metadata(profile, repeat):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=BENCHMARKS_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = "unknown"
+    return {"profile": profile, "shape": PROFILES[profile], "commit": commit, "repeat": repeat,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def print_results(results, baseline=None):
+    meta = results["meta"]
+    print(f"# {meta['profile']} @ {meta['commit']}"
+          + (f" (vs {baseline['meta']['commit']})" if baseline else ""))
+    for name, case in results["cases"].items():
+        per_op = case["min_s"] / case["ops"] * 1e6 if case["ops"] else float("nan")
+        line = f"{name:16} {case['min_s'] * 1000:10.1f} ms (median {case['median_s'] * 1000:.1f} ms)" \
+               f"  {case['ops']:>8.6g} {case['unit']:10} {per_op:10.2f} µs/op"
+        if baseline is not None and name in baseline["cases"]:
+            before = baseline["cases"][name]["min_s"]
+            line += f"  {(case['min_s'] - before) / before * 100:+6.1f}%"
+        print(line)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="run benchmarks")
+    parser.add_argument("profiles", nargs="*", default=["small"],
+                        help=f"image profiles, among: {', '.join(PROFILES)} (default: small)")
+    parser.add_argument("-c", "--case", action='append', choices=list(CASES), dest="cases",
+                        help="case to run (repeatable, default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs per case")
+    parser.add_argument("--save", action='store_true', help=f"store results in {RESULTS_DIR}")
+    parser.add_argument("--compare", metavar="RESULTS", action='append', default=[],
+                        help="results file to compare with (repeatable, matched by profile)")
+    return parser
+
+
+def main(profiles, cases=None, repeat=5, save=False, compare=()):
+    baselines = {}
+    for path in compare:
+        with open(path) as f:
+            baseline = json.load(f)
+        baselines[baseline["meta"]["profile"]] = baseline
+    for profile in profiles:
+        if profile not in PROFILES:
+            raise SystemExit(f"Unknown profile {profile!r}")
+        results = run_profile(profile, cases or list(CASES), repeat)
+        print_results(results, baselines.get(profile))
+        if save:
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            path = os.path.join(RESULTS_DIR, f"{profile}-{results['meta']['commit']}.json")
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Saved to {path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    opts = _args_parser().parse_args()
+    main(**vars(opts))
@@ -0,0 +1,125 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Startup budget check, for short-lived CLI invocations.
+
+- importing the reader must not import the modules that are slow to
+  import and only needed on some paths (see `LAZY_MODULES`), and its
+  cumulative import time (from `python -X importtime`) must stay under
+  `--import-budget`;
+- `cat.py` must output its first byte within `--cat-budget`.
+
+Timings are the best of `--runs` runs.  Exit status is 1 if a budget is
+exceeded.
+
+    python -m benchmarks.startup
+"""
+
+import compileall
+import os
+import subprocess
+import sys
+import time
+
+from .run import get_image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_STATEMENT = "from ext4 import Filesystem"
+# Never imported by IMPORT_STATEMENT
+LAZY_MODULES = ("argparse", "crcmod", "enum", "logging", "typing", "ext4.aio", "ext4.extract")
+
+
+def _environment():
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # Measure with bytecode cached, as installed
+    env["PYTHONPATH"] = ROOT_DIR
+    return env
+
+
+def measure_import(runs):
+    """Return the best cumulative import time of the reader (in µs), and the
+    lazy modules imported anyway"""
+    best, imported = None, set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_STATEMENT], env=_environment(),
+                                capture_output=True, text=True, check=True).stderr
+        total = 0
+        for line in output.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if name.strip() in LAZY_MODULES:
+                imported.add(name.strip())
+            elif name.startswith(" ext4"):  # Top-level import of a module of the package
+                total += int(cumulative)
+        best = total if best is None else min(best, total)
+    return best, sorted(imported)
+
+
+def measure_first_byte(command, runs):
+    """Best time (in s) between the start of `command` and its first output byte"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        with subprocess.Popen(command, env=_environment(), stdout=subprocess.PIPE) as process:
+            process.stdout.read(1)
+            duration = time.perf_counter() - start
+            process.stdout.read()
+        if process.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed")
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup", description="check the startup budget")
+    parser.add_argument("--runs", type=int, default=40, help="runs per measure")
+    parser.add_argument("--import-budget", type=float, default=15, metavar="MS",
+                        help="maximal cumulative import time of the reader")
+    parser.add_argument("--cat-budget", type=float, default=30, metavar="MS",
+                        help="maximal time to the first byte output by cat.py")
+    return parser
+
+
+def main(runs=40, import_budget=15, cat_budget=30):
+    compileall.compile_dir(os.path.join(ROOT_DIR, "ext4"), quiet=1)
+    failed = False
+    import_us, imported = measure_import(runs)
+    print(f"{IMPORT_STATEMENT}: {import_us / 1000:.1f} ms (budget {import_budget} ms)")
+    if import_us / 1000 > import_budget:
+        failed = True
+    if imported:
+        print(f"{', '.join(imported)} imported, but should be imported lazily")
+        failed = True
+    image = get_image("small")
+    interpreter = measure_first_byte([sys.executable, "-c", "print()"], runs)
+    cat = measure_first_byte([sys.executable, os.path.join(ROOT_DIR, "cat.py"), image, "/dir0000/file0000000"],
+                             runs)
+    print(f"cat.py first byte: {cat * 1000:.1f} ms (budget {cat_budget} ms, "
+          f"of which {interpreter * 1000:.1f} ms of bare interpreter startup)")
+    if cat * 1000 > cat_budget:
+        failed = True
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    opts = _args_parser().parse_args()
+    sys.exit(main(**vars(opts)))
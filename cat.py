@@ -16,26 +16,61 @@
 # License along with ext4-reader.  If not, see
 # <https://www.gnu.org/licenses/>.
 
+import os
 import sys
 
-from ext4 import Filesystem, FileType
 
+def main(block_device, path, stats=False, socket_path=None):
+    socket_path = socket_path or os.environ.get("EXT4D_SOCKET")
+    if socket_path:
+        _cat_remote(socket_path, block_device, path)
+    else:
+        _cat_local(block_device, path, stats)
 
-def main(block_device, path):
+
+def _cat_local(block_device, path, stats):
+    from ext4 import Filesystem, FileType
     try:
-        with Filesystem(block_device) as filesystem:
+        filesystem = Filesystem(block_device)
+        if stats:
+            from ext4.stats import Stats
+            filesystem.stats = Stats()
+        with filesystem:
             # Obtaining list of files to display
             file = filesystem.get_file(path)
             if file.get_file_type() == FileType.IFREG:
-                print(file.content.get_bytes().decode('utf-8'), end="")
+                # Raw bytes, streamed: the content may be big, or binary
+                for chunk in file.content.iter_bytes():
+                    sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
             else:
                 print(f"{path}: is not a regular file", file=sys.stderr)
                 sys.exit(1)
+        if filesystem.stats is not None:
+            print(filesystem.stats.summary(), file=sys.stderr)
     except PermissionError:
         print(f"{block_device}: permission denied", file=sys.stderr)
         sys.exit(1)
 
 
+def _cat_remote(socket_path, block_device, path):
+    """Read through ext4d: only the client is imported, not the reader"""
+    from ext4.client import Client
+    try:
+        client = Client(socket_path)
+    except OSError as e:
+        print(f"{socket_path}: {e.strerror}", file=sys.stderr)
+        sys.exit(1)
+    with client:
+        try:
+            for chunk in client.iter_bytes(block_device, path):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        except OSError as e:
+            print(f"cat: {e.strerror}", file=sys.stderr)
+            sys.exit(1)
+
+
 def _args_parser():
     import argparse
     parser = argparse.ArgumentParser(prog="cat", description="print file on the standard output")
@@ -43,10 +78,20 @@ def _args_parser():
                         help="Path to the block device containing the ext4 file system")
     parser.add_argument("path", metavar="FILE",
                         help="Print FILE to standard output.")
+    parser.add_argument("--stats", action='store_true',
+                        help="Print I/O and parsing statistics on the standard error")
+    parser.add_argument("-s", "--socket", dest="socket_path",
+                        help="Read through the ext4d server listening on this socket "
+                             "(default: $EXT4D_SOCKET if set, else read the device directly)")
     return parser
 
 
 if __name__ == '__main__':
-    _parser = _args_parser()
-    opts = _parser.parse_args()
-    main(**vars(opts))
+    if len(sys.argv) == 3 and not any(arg.startswith("-") for arg in sys.argv[1:]):
+        # Plain invocation, the common case in scripts: skip argparse, whose
+        # import and parser construction cost more than reading the file
+        main(*sys.argv[1:])
+    else:
+        _parser = _args_parser()
+        opts = _parser.parse_args()
+        main(**vars(opts))
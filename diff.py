@@ -0,0 +1,83 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+from ext4 import Filesystem
+from ext4.diff import ChangeKind, DentryIndex
+
+
+def main(old_device, new_device, index=None, save_index=None, atime=False, stats=False):
+    old, new = Filesystem(old_device), Filesystem(new_device)
+    if stats:
+        from ext4.stats import Stats
+        old.stats, new.stats = Stats(), Stats()
+    with old, new:
+        if index is not None and os.path.exists(index):
+            dentry_index = DentryIndex.load(index, old)
+        else:
+            dentry_index = DentryIndex.build(old)
+            if index is not None:
+                dentry_index.save(index)
+        result = old.diff(new, dentry_index)
+    counts = {kind: 0 for kind in ChangeKind}
+    for change in result.changes:
+        if change.kind == ChangeKind.MODIFIED:
+            if change.fields == {"atime"} and not atime:
+                continue
+            fields = ", ".join(sorted(change.fields))
+            if sorted(change.paths) != sorted(change.old_paths):
+                print(f"R {' '.join(change.old_paths)} -> {' '.join(change.paths)} ({fields})")
+            else:
+                print(f"M {' '.join(change.paths)} ({fields})")
+        else:
+            print(f"{'A' if change.kind == ChangeKind.ADDED else 'D'} {' '.join(change.paths)}")
+        counts[change.kind] += 1
+    if save_index is not None:
+        result.index.save(save_index)
+    print(f"{counts[ChangeKind.ADDED]} added, {counts[ChangeKind.DELETED]} deleted, "
+          f"{counts[ChangeKind.MODIFIED]} modified; "
+          f"{result.blocks_allocated} blocks allocated, {result.blocks_freed} freed", file=sys.stderr)
+    for filesystem in (old, new):
+        if filesystem.stats is not None:
+            print(f"{filesystem.block_device}:\n{filesystem.stats.summary()}", file=sys.stderr)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="diff", description="list the changes between two snapshots")
+    parser.add_argument("old_device", metavar="OLD",
+                        help="Path to the block device (or image) of the old snapshot")
+    parser.add_argument("new_device", metavar="NEW",
+                        help="Path to the block device (or image) of the new snapshot")
+    parser.add_argument("--index", metavar="FILE",
+                        help="Dentry index of OLD, built (and saved to FILE) if FILE does not exist")
+    parser.add_argument("--save-index", metavar="FILE",
+                        help="Save the dentry index of NEW to FILE, for the next diff")
+    parser.add_argument("--atime", action='store_true',
+                        help="Also list the files whose access time only changed")
+    parser.add_argument("--stats", action='store_true',
+                        help="Print I/O and parsing statistics on the standard error")
+    return parser
+
+
+if __name__ == '__main__':
+    _parser = _args_parser()
+    opts = _parser.parse_args()
+    main(**vars(opts))
@@ -18,9 +18,14 @@
 
 import ctypes
 import string
+import sys
 
 from ext4 import Filesystem
+from ext4.block_map import BlockMap, OwnerKind
+from ext4.partitions import list_partitions, open_partition
+from ext4.stats import Stats
 from ext4.files import FileContent, Directory, DirectIndirectFileContent
+from ext4.journal import Journal
 
 
 def _raw_dump(filesystem, blob, offset=0):
@@ -102,7 +107,7 @@ def superblock_dump(filesystem):
 
 
 def block_group_descriptor_dump(filesystem, block_group_no):
-    bgd = filesystem.get_block_group_desc(block_group_no, strict=False)
+    bgd = filesystem.get_block_group_desc(block_group_no)
     print(f"Block group descriptor {bgd.no} of {filesystem.block_device} (@0x{bgd.pos:X}):")
     cksum = bgd.verify_checksums()
     flags = _collect_flags(bgd.bg_flags, bgd.Flags)
@@ -136,6 +141,9 @@ def inode_dump(filesystem, inode_no, action='metadata'):
               " organized content")
         print("Content block numbers: "
               "[" + ', '.join(f"0x{b_no:X}" for b_no in file_content.get_blocks_no()) + "]")
+        print("Extents (logical: physical+length): "
+              "[" + ', '.join(f"0x{logical:X}: 0x{physical:X}+{length}" + ("" if initialized else " unwritten")
+                              for logical, physical, length, initialized in file_content.get_extents()) + "]")
     elif action == 'content':
         if inode.get_file_type() == inode.Mode.IFDIR:
             print("Is a directory, with entries (names & inodes):")
@@ -144,18 +152,70 @@ def inode_dump(filesystem, inode_no, action='metadata'):
                 print(f"  {de.get_name():16}  {de.inode:> 8X}")
 
 
-def block_dump(filesystem, block_no):
+def block_dump(filesystem, block_no, block_map=None):
     block = filesystem.get_block(block_no)
     pos = block_no * filesystem.conf.get_block_size()
     print(f"Block number {block_no} of {filesystem.block_device} (@0x{pos:X}):")
+    block_map = BlockMap.load(block_map, filesystem) if block_map else filesystem.build_block_map()
+    owners = block_map.lookup(block_no)
+    for kind, inode_no, logical in owners:
+        if kind == OwnerKind.DATA:
+            print(f"Owned by inode {inode_no}: logical block {logical}")
+        elif kind in (OwnerKind.MAPPING, OwnerKind.XATTR):
+            print(f"Owned by inode {inode_no}: {'block mapping' if kind == OwnerKind.MAPPING else 'extended attributes'}")
+        elif kind == OwnerKind.INODE_TABLE:
+            print(f"Inode table: inodes {inode_no} to {inode_no + block_map.inodes_per_block - 1}")
+        else:
+            print(f"{kind.name.replace('_', ' ').capitalize()} of block group {logical}")
+    if not owners:
+        print("Not owned (free block)")
     _raw_dump(filesystem, block, offset=pos)
 
 
+def block_map_dump(filesystem, output):
+    block_map = filesystem.build_block_map()
+    block_map.save(output)
+    print(f"Block map of {filesystem.block_device} ({len(block_map)} intervals) saved to {output}")
+
+
+def journal_dump(filesystem):
+    journal = filesystem.journal
+    if journal is None:
+        # Clean file system, or opened with --no-journal: what would be replayed
+        journal = Journal.read(filesystem)
+    if journal.superblock is None:
+        print(f"No valid journal in {filesystem.block_device}")
+        return
+    print(f"Journal superblock of {filesystem.block_device}:")
+    _print_table(_dump_struct(
+        journal.superblock,
+        s_feature_incompat=_collect_flags(journal.superblock.s_feature_incompat,
+                                          journal.superblock.FeatureIncompat)))
+    if journal is not filesystem.journal:
+        print("Not replayed")
+    print(f"Committed transactions: {journal.transactions} (from sequence {journal.first_sequence})")
+    print("Journaled blocks: [" + ', '.join(f"0x{b_no:X}" for b_no in sorted(journal.blocks)) + "]")
+
+
+def partitions_dump(block_device):
+    print(f"{'Name':12}  {'Start':>14}  {'Size':>14}  {'ext4':4}  Type")
+    for partition in list_partitions(block_device):
+        is_ext4 = "yes" if partition.is_ext4() else "no"
+        label = f" ({partition.label})" if partition.label else ""
+        print(f"{partition.name:12}  {partition.offset:>14}  {partition.length:>14}  {is_ext4:4}  {partition.type}{label}")
+
+
 if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser()
     parser.add_argument("block_device")
+    parser.add_argument("--stats", action='store_true',
+                        help="Print I/O and parsing statistics on the standard error")
+    parser.add_argument("-p", "--partition", metavar="NAME",
+                        help="partition of the disk image holding the file system (see the partitions command)")
+    parser.add_argument("--no-journal", dest="replay_journal", action='store_false',
+                        help="read the on-disk blocks, without replaying the journal of an un-clean file system")
     subparsers = parser.add_subparsers()
 
     sb_parser = subparsers.add_parser("superblock")
@@ -173,15 +233,43 @@ if __name__ == '__main__':
 
     block_parser = subparsers.add_parser("block")
     block_parser.add_argument("block_no", metavar="block_number", type=lambda x: int(x, 0))
+    block_parser.add_argument("--map", dest="block_map", metavar="FILE",
+                              help="block map saved by the block_map command (default: build it)")
     block_parser.set_defaults(func=block_dump)
 
+    block_map_parser = subparsers.add_parser("block_map", help="build and save the map of block owners")
+    block_map_parser.add_argument("output", help="file to save the map to")
+    block_map_parser.set_defaults(func=block_map_dump)
+
+    journal_parser = subparsers.add_parser("journal", help="dump the journal and the blocks it replays")
+    journal_parser.set_defaults(func=journal_dump)
+
+    partitions_parser = subparsers.add_parser("partitions", help="list the partitions of a whole disk image")
+    partitions_parser.set_defaults(func=partitions_dump)
+
     args = parser.parse_args()
 
     func = args.func
     block_device = args.block_device
+    stats = args.stats
+    partition = args.partition
+    replay_journal = args.replay_journal
     del args.func
     del args.block_device
-    filesystem = Filesystem(block_device)
+    del args.stats
+    del args.partition
+    del args.replay_journal
+    if func is partitions_dump:
+        partitions_dump(block_device)
+        sys.exit()
+    if partition is not None:
+        filesystem = open_partition(block_device, partition, replay_journal=replay_journal)
+    else:
+        filesystem = Filesystem(block_device, replay_journal=replay_journal)
     filesystem.fail_on_wrong_checksum = False
+    if stats:
+        filesystem.stats = Stats()
     with filesystem:
         func(filesystem, **vars(args))
+    if filesystem.stats is not None:
+        print(filesystem.stats.summary(), file=sys.stderr)
@@ -0,0 +1,101 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+import logging
+import sys
+
+from ext4 import Filesystem
+from ext4.block_map import BlockMap, OwnerKind
+from ext4.diff import DentryIndex
+
+
+def _owner_name(kind, inode_no, logical, index):
+    if kind == OwnerKind.DATA:
+        paths = index.get_paths(inode_no)
+        return f"{' '.join(paths) if paths else f'inode {inode_no}'} (block {logical})"
+    if kind in (OwnerKind.MAPPING, OwnerKind.XATTR):
+        what = 'block mapping' if kind == OwnerKind.MAPPING else 'extended attributes'
+        return f"inode {inode_no} ({what})"
+    if kind == OwnerKind.INODE_TABLE:
+        return f"inode table (inode {inode_no})"
+    return f"{kind.name.replace('_', ' ').lower()} of block group {logical}"
+
+
+def shared_extents(filesystem, block_map=None):
+    block_map = BlockMap.load(block_map, filesystem) if block_map else filesystem.build_block_map()
+    index = DentryIndex.build(filesystem)
+    n_runs = n_blocks = 0
+    for start, length, owners in block_map.shared_runs():
+        print(f"Blocks {start}-{start + length - 1}: " + ", ".join(_owner_name(*owner, index) for owner in owners))
+        n_runs += 1
+        n_blocks += length
+    print(f"{n_runs} shared runs, {n_blocks} blocks", file=sys.stderr)
+
+
+def duplicates(filesystem, path, min_size, jobs):
+    wasted = 0
+    groups = filesystem.find_duplicates(path, min_size=min_size, workers=jobs)
+    for group in groups:
+        print(f"{group.wasted_bytes} bytes wasted: {len(group.copies)} copies of {group.size} bytes ({group.digest})")
+        for copy in group.copies:
+            # Reflinked files (sharing their extents) on one line
+            print("  " + " = ".join(file.path for file in copy))
+        wasted += group.wasted_bytes
+    print(f"{len(groups)} groups of duplicates, {wasted} bytes wasted", file=sys.stderr)
+
+
+def main(block_device, path="/", min_size=1, jobs=8, shared=False, block_map=None):
+    try:
+        with Filesystem(block_device) as filesystem:
+            if shared:
+                shared_extents(filesystem, block_map)
+            else:
+                duplicates(filesystem, path, min_size, jobs)
+    except PermissionError:
+        print(f"{block_device}: permission denied", file=sys.stderr)
+        sys.exit(1)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="duplicates", description="find files with identical content, or "
+                                                                    "blocks owned by several files")
+    parser.add_argument("block_device",
+                        help="Path to the block device containing the ext4 file system")
+    parser.add_argument("path", metavar="PATH", nargs='?', default="/",
+                        help="directory to search for duplicates (default: /)")
+    parser.add_argument("--min-size", type=int, default=1, metavar="BYTES",
+                        help="ignore smaller files (default: 1, i.e. skip empty files)")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="number of reading threads")
+    parser.add_argument("--shared", action='store_true',
+                        help="list the blocks owned several times (shared extents, or corruption) instead")
+    parser.add_argument("--map", dest="block_map", metavar="FILE",
+                        help="with --shared, block map saved by `dump.py block_map` (default: build it)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Show debug information")
+    return parser
+
+
+if __name__ == '__main__':
+    _parser = _args_parser()
+    opts = _parser.parse_args()
+    if hasattr(opts, 'verbose'):
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+        del opts.verbose
+    main(**vars(opts))
@@ -16,12 +16,45 @@
 # License along with ext4-reader.  If not, see
 # <https://www.gnu.org/licenses/>.
 
-import logging
+import sys
 
-logger = logging.getLogger(__name__)
 
-from .ext4 import Filesystem
-from .data_structures import Inode
-FileType = Inode.Mode
+class _Logger:
+    """Stand-in for `logging.getLogger("ext4")`, which only imports `logging`
+    (slow to import) when needed.  As long as the application did not import
+    `logging`, nobody could have enabled records below WARNING: drop them."""
+
+    def _get_logger(self):
+        import logging
+        return logging.getLogger(__name__)
+
+    def debug(self, *args, **kwargs):
+        if "logging" in sys.modules:
+            self._get_logger().debug(*args, **kwargs)
+
+    def info(self, *args, **kwargs):
+        if "logging" in sys.modules:
+            self._get_logger().info(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._get_logger(), name)
+
+
+logger = _Logger()
+
+
+def __getattr__(name):
+    # The reader is loaded on first use, so that the modules which do not
+    # need it (like the client of ext4d) are imported fast
+    if name == 'Filesystem':
+        from .ext4 import Filesystem as value
+    elif name == 'FileType':
+        from .data_structures import Inode
+        value = Inode.Mode
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
 
 __all__ = ['Filesystem', 'FileType']
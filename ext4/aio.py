@@ -0,0 +1,131 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""asyncio facade over `Filesystem`.
+
+Blocking work (reads and parsing) is dispatched to a bounded thread pool,
+so that the event loop is never blocked.  Concurrent reads of the same
+blocks share a single in-flight request.
+
+    async with AsyncFilesystem("/dev/sdXY") as fs:
+        file = await fs.get_file("/etc/hostname")
+        async for chunk in fs.iter_bytes(file):
+            ...
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+
+from .ext4 import Filesystem
+from .files import Directory, File, InlineFileContent
+
+
+class AsyncFilesystem:
+    def __init__(self, block_device, max_workers=16, direct_io=False):
+        self.filesystem = Filesystem(block_device, direct_io=direct_io)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._inflight = {}  # (first block, block count) -> Future
+
+    async def __aenter__(self):
+        await self._run(self.filesystem.__enter__)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._run(self.filesystem.__exit__, exc_type, exc_val, exc_tb)
+        self._executor.shutdown(wait=False)
+
+    def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def get_block(self, index, n=1):
+        """Read `n` blocks.  A read already in flight for the same blocks is
+        awaited instead of being issued again."""
+        key = (index, n)
+        try:
+            future = self._inflight[key]
+        except KeyError:
+            future = self._run(self.filesystem.get_block, index, n)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded, so that a cancelled reader does not cancel the others
+        return await asyncio.shield(future)
+
+    async def get_inode(self, inode_no):
+        return await self._run(self.filesystem.get_inode, inode_no)
+
+    async def get_file(self, path) -> File:
+        return await self._run(self.filesystem.get_file, path)
+
+    async def iterdir(self, directory, batch=256):
+        """Iterate over the files of `directory` (a `Directory` or a path).
+        Entries are decoded by batches in the thread pool."""
+        if not isinstance(directory, Directory):
+            directory = await self.get_file(directory)
+            if not isinstance(directory, Directory):
+                raise NotADirectoryError(directory.path)
+        files = directory.get_files()
+        while True:
+            chunk = await self._run(lambda: list(itertools.islice(files, batch)))
+            if not chunk:
+                return
+            for file in chunk:
+                yield file
+
+    async def iter_bytes(self, file, start=0, end=-1, chunk_blocks=256):
+        """Stream the content of `file` between offsets `start` and `end`.
+        Holes are synthesized as zeros, without any read."""
+        content = file.content
+        size = content.inode.get_size()
+        if end < 0:
+            end = size + end + 1
+        if not (0 <= start <= end <= size):
+            raise ValueError(f"Cannot get file range between {start} and {end}")
+        if isinstance(content, InlineFileContent):
+            if start < end:
+                yield content.get_bytes(start, end)
+            return
+        block_size = self.filesystem.conf.get_block_size()
+        # Decode the extent map once, out of the event loop
+        await self._run(content.get_extent_map)
+        for offset, length, physical in content._get_segments(start):
+            if offset >= end:
+                break
+            lo, hi = max(start, offset), min(end, offset + length)
+            if physical is None:
+                while lo < hi:
+                    n = min(hi - lo, chunk_blocks * block_size)
+                    yield bytes(n)
+                    lo += n
+                continue
+            # Chunks are aligned on the segment start, so that concurrent
+            # readers of the same file issue the same block requests
+            first_chunk = (lo - offset) // (chunk_blocks * block_size)
+            chunk_start = offset + first_chunk * chunk_blocks * block_size
+            block_no = physical + first_chunk * chunk_blocks
+            while chunk_start < hi:
+                n_blocks = min(chunk_blocks, -(-(offset + length - chunk_start) // block_size))
+                data = await self.get_block(block_no, n_blocks)
+                yield data[max(lo - chunk_start, 0):hi - chunk_start]
+                chunk_start += chunk_blocks * block_size
+                block_no += chunk_blocks
+
+    async def get_bytes(self, file, start=0, end=-1):
+        return b"".join([chunk async for chunk in self.iter_bytes(file, start, end)])
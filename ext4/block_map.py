@@ -0,0 +1,246 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Reverse block map: which inode (or file system structure) owns a block.
+
+The map is built by scanning the inodes marked as used in the inode
+bitmaps, and collecting their extents, their block mapping blocks and their
+extended attribute block.  File system structures (superblocks and group
+descriptors, bitmaps, inode tables) are added as well.
+
+    block_map = BlockMap.build(filesystem)
+    block_map.save("sdXY.bmap")
+    for kind, inode_no, logical in BlockMap.load("sdXY.bmap").lookup(block_no):
+        ...
+"""
+
+import array
+import bisect
+import heapq
+import itertools
+import struct
+import sys
+
+from . import logger
+from .data_structures import BlockGroupDescriptor, Superblock
+from .ext4 import SpecialInode
+from .tools import FSException, IntConstants
+
+
+class OwnerKind(IntConstants):
+    DATA = 0  # Content of the inode, `logical` being the logical block
+    MAPPING = 1  # Extent tree node or indirect block of the inode
+    XATTR = 2  # Extended attribute block, maybe shared by several inodes
+    INODE_TABLE = 3  # Inode table, `inode` being the first inode in the block
+    INODE_BITMAP = 4  # Of group `logical`
+    BLOCK_BITMAP = 5  # Of group `logical`
+    SUPERBLOCK = 6  # Superblock or group descriptors (or their backups) in group `logical`
+
+
+# Reserved inodes which may own blocks.  The resize inode is special: only
+# its double indirect block is its own, it maps the reserved group
+# descriptor blocks (see OwnerKind.SUPERBLOCK).
+_RESERVED_OWNERS = (SpecialInode.DEFECTIVE_BLOCKS, SpecialInode.ROOT_DIRECTORY, SpecialInode.USER_QUOTA,
+                    SpecialInode.GROUP_QUOTA, SpecialInode.BOOT_LOADER, SpecialInode.JOURNAL)
+
+_HEADER = struct.Struct("<8sH16sQI")  # Magic, version, UUID, intervals count, inodes per block
+_MAGIC = b"EXT4BMAP"
+_VERSION = 1
+
+
+class BlockMap:
+    """Sorted intervals of physical blocks, with their owner: parallel
+    arrays of start block, length, inode number, logical block (-1 if
+    irrelevant) and `OwnerKind`.  Lookups are O(log n)."""
+
+    _columns = (("start", 'Q'), ("length", 'Q'), ("inode", 'I'), ("logical", 'q'), ("kind", 'B'))
+
+    def __init__(self, uuid, inodes_per_block):
+        self.uuid = bytes(uuid)
+        self.inodes_per_block = inodes_per_block
+        for name, typecode in self._columns:
+            setattr(self, name, array.array(typecode))
+        self._max_end = array.array('Q')  # Highest end of intervals [0, i]
+
+    def __len__(self):
+        return len(self.start)
+
+    def _set_intervals(self, intervals):
+        """Fill the arrays with (start, length, inode, logical, kind) tuples"""
+        max_end = 0
+        for interval in sorted(intervals):
+            for (name, _), value in zip(self._columns, interval):
+                getattr(self, name).append(value)
+            max_end = max(max_end, interval[0] + interval[1])
+            self._max_end.append(max_end)
+
+    def lookup(self, block_no):
+        """Owners of block `block_no`, as (`OwnerKind`, inode number,
+        logical) tuples.  Blocks of files have one owner, except shared
+        extended attribute blocks (or a corrupted file system)."""
+        owners = []
+        i = bisect.bisect_right(self.start, block_no)
+        while i > 0 and self._max_end[i - 1] > block_no:
+            i -= 1
+            if block_no - self.start[i] >= self.length[i]:
+                continue
+            owners.append(self._owner(i, block_no))
+        owners.reverse()
+        return owners
+
+    def _owner(self, i, block_no):
+        kind, inode_no, logical = OwnerKind(self.kind[i]), self.inode[i], self.logical[i]
+        if kind == OwnerKind.DATA:
+            logical += block_no - self.start[i]
+        elif kind == OwnerKind.INODE_TABLE:
+            inode_no += (block_no - self.start[i]) * self.inodes_per_block
+        return kind, inode_no, logical
+
+    def shared_runs(self):
+        """Yield (start, length, owners) for the runs of blocks owned
+        several times: extents shared by files (reflinks), or overlapping
+        structures (corruption).  Owners are (`OwnerKind`, inode number,
+        logical) tuples, for the first block of the run.  Extended attribute
+        blocks shared by several inodes only are normal, thus skipped.
+
+        A sweep over the intervals (sorted by start): O(n log n)."""
+        active = []  # Heap of (end, interval index)
+        pos = 0
+        for i in itertools.chain(range(len(self)), [None]):
+            next_start = self.start[i] if i is not None else sys.maxsize
+            while active and active[0][0] <= next_start:
+                end = active[0][0]
+                yield from self._shared_run(pos, end, active)
+                pos = max(pos, end)
+                while active and active[0][0] == end:
+                    heapq.heappop(active)
+            if i is None:
+                break
+            if active:
+                yield from self._shared_run(pos, next_start, active)
+            pos = next_start
+            heapq.heappush(active, (self.start[i] + self.length[i], i))
+
+    def _shared_run(self, start, end, active):
+        if start >= end or len(active) < 2:
+            return
+        if all(self.kind[i] == OwnerKind.XATTR for _, i in active):
+            return
+        yield start, end - start, [self._owner(i, start) for _, i in sorted(active, key=lambda item: item[1])]
+
+    # Persistence
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self.uuid, len(self), self.inodes_per_block))
+            for name, _ in self._columns:
+                column = getattr(self, name)
+                if sys.byteorder != 'little':
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                f.write(column.tobytes())
+
+    @classmethod
+    def load(cls, path, filesystem=None):
+        """Load a map saved by `save()`.  If `filesystem` is given, check the
+        map was built from it."""
+        with open(path, "rb") as f:
+            magic, version, uuid, n, inodes_per_block = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"{path}: not a block map")
+            if filesystem is not None and uuid != bytes(filesystem.UUID):
+                raise ValueError(f"{path}: block map of another file system")
+            block_map = cls(uuid, inodes_per_block)
+            for name, typecode in cls._columns:
+                column = getattr(block_map, name)
+                column.frombytes(f.read(n * column.itemsize))
+                if sys.byteorder != 'little':
+                    column.byteswap()
+        max_end = 0
+        for start, length in zip(block_map.start, block_map.length):
+            max_end = max(max_end, start + length)
+            block_map._max_end.append(max_end)
+        return block_map
+
+    # Building
+
+    @classmethod
+    def build(cls, filesystem):
+        conf = filesystem.conf
+        block_map = cls(filesystem.UUID, conf.get_block_size() // conf.s_inode_size)
+        intervals = []
+        for bg_no in range(conf.get_groups_count()):
+            bgd = filesystem.get_block_group_desc(bg_no)
+            intervals.extend(_group_metadata(filesystem, bg_no, bgd))
+            if bgd.has_flag(BlockGroupDescriptor.Flags.INODE_UNINIT):
+                continue
+            for inode_no in _used_inodes(filesystem, bg_no, bgd):
+                try:
+                    if inode_no == SpecialInode.RESERVED_GROUP_DESCRIPTORS:
+                        intervals.extend(_resize_inode_blocks(filesystem, inode_no))
+                    elif inode_no >= conf.s_first_ino or inode_no in _RESERVED_OWNERS:
+                        intervals.extend(_inode_blocks(filesystem, inode_no))
+                except (FSException, NotImplementedError) as e:
+                    logger.warning("Skip inode %d: %s", inode_no, e)
+        block_map._set_intervals(intervals)
+        return block_map
+
+
+def _group_metadata(filesystem, bg_no, bgd):
+    conf = filesystem.conf
+    block_size = conf.get_block_size()
+    if filesystem.has_superblock(bg_no):
+        # Superblock, group descriptors and reserved group descriptors
+        desc_size = conf.s_desc_size if conf.has_flag(Superblock.FeatureIncompat.INCOMPAT_64BIT) else 32
+        gdt_blocks = -(-conf.get_groups_count() * desc_size // block_size)
+        start = bg_no * conf.s_blocks_per_group + conf.s_first_data_block
+        yield start, 1 + gdt_blocks + conf.s_reserved_gdt_blocks, 0, bg_no, OwnerKind.SUPERBLOCK
+    yield bgd.get_bg_block_bitmap_loc(), 1, 0, bg_no, OwnerKind.BLOCK_BITMAP
+    yield bgd.get_bg_inode_bitmap_loc(), 1, 0, bg_no, OwnerKind.INODE_BITMAP
+    table_blocks = -(-conf.s_inodes_per_group * conf.s_inode_size // block_size)
+    yield bgd.get_inode_table_loc(), table_blocks, bg_no * conf.s_inodes_per_group + 1, -1, OwnerKind.INODE_TABLE
+
+
+def _used_inodes(filesystem, bg_no, bgd):
+    inodes_per_group = filesystem.conf.s_inodes_per_group
+    bitmap = filesystem.get_block(bgd.get_bg_inode_bitmap_loc())
+    bits = int.from_bytes(bitmap[:inodes_per_group // 8], 'little')
+    first = bg_no * inodes_per_group + 1
+    while bits:
+        low = bits & -bits
+        yield first + low.bit_length() - 1
+        bits ^= low
+
+
+def _inode_blocks(filesystem, inode_no):
+    from .files import FileContent
+    inode = filesystem.get_inode(inode_no)
+    content = FileContent(filesystem, inode)
+    for logical, physical, length, initialized in content.get_extents():
+        yield physical, length, inode_no, logical, OwnerKind.DATA
+    for block_no in content.get_mapping_blocks_no():
+        yield block_no, 1, inode_no, -1, OwnerKind.MAPPING
+    file_acl = inode.get_file_acl()
+    if file_acl != 0:
+        yield file_acl, 1, inode_no, -1, OwnerKind.XATTR
+
+
+def _resize_inode_blocks(filesystem, inode_no):
+    double_indirect = filesystem.get_inode(inode_no).i_block[13]
+    if double_indirect != 0:
+        yield double_indirect, 1, inode_no, -1, OwnerKind.MAPPING
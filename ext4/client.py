@@ -0,0 +1,106 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Client of `ext4d` (see `ext4.daemon`).
+
+Entries are returned as (path, stat, symbolic link target) tuples, `stat`
+being an `os.stat_result` like the one of `File.get_stat()`.  Errors are
+raised as `OSError`.
+
+    with Client() as client:
+        for name, stat, target in client.list("/dev/sdXY", "/etc"):
+            ...
+"""
+
+import socket
+
+from . import protocol
+
+
+class Client:
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or protocol.default_socket_path()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(self.socket_path)
+        except OSError:
+            self._socket.close()
+            raise
+        self._stream = self._socket.makefile("rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._stream.close()
+        self._socket.close()
+
+    def _request(self, opcode, image, path, offset=0, length=-1):
+        self._socket.sendall(protocol.pack_request(opcode, image, path, offset, length))
+
+    def _read_frame(self):
+        opcode, payload = protocol.read_frame(self._stream)
+        if opcode is None:
+            raise protocol.ProtocolError("Connection closed by the server")
+        if opcode == protocol.ERROR:
+            protocol.raise_error(payload)
+        return opcode, payload
+
+    def _iter_stream(self, expected):
+        """Payloads of the `expected` frames, up to END.  The stream must be
+        consumed entirely before sending another request."""
+        while True:
+            opcode, payload = self._read_frame()
+            if opcode == protocol.END:
+                return
+            if opcode != expected:
+                raise protocol.ProtocolError(f"Unexpected frame {opcode}")
+            yield payload
+
+    def stat(self, image, path):
+        self._request(protocol.STAT, image, path)
+        opcode, payload = self._read_frame()
+        if opcode != protocol.ENTRIES:
+            raise protocol.ProtocolError(f"Unexpected frame {opcode}")
+        return protocol.unpack_entries(payload)[0]
+
+    def list(self, image, path):
+        """Entries of directory `path` (with `.` and `..`), or the entry of
+        the file at `path`.  Entry paths are file names."""
+        self._request(protocol.LIST, image, path)
+        return [entry for payload in self._iter_stream(protocol.ENTRIES) for entry in protocol.unpack_entries(payload)]
+
+    def walk(self, image, path="/"):
+        """Iterate over all files below directory `path`, in breadth-first
+        order.  Entry paths are absolute."""
+        self._request(protocol.WALK, image, path)
+        for payload in self._iter_stream(protocol.ENTRIES):
+            yield from protocol.unpack_entries(payload)
+
+    def iter_bytes(self, image, path, start=0, end=-1):
+        """Stream the content of file `path` from offset `start` up to `end`
+        (excluded, -1 for the end of the file)"""
+        self._request(protocol.READ, image, path, start, -1 if end < 0 else end - start)
+        for payload in self._iter_stream(protocol.DATA):
+            yield payload
+
+    def get_bytes(self, image, path, start=0, end=-1):
+        return b"".join(self.iter_bytes(image, path, start, end))
@@ -0,0 +1,370 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Compressed images, read in place.
+
+Random reads are served by decompressing only the frames covering them:
+
+- zstd images made of several frames, ideally with a seek table (the
+  "seekable" format, e.g. `t2sz` or `zstd --seekable`).  Decompression needs
+  the `zstandard` package (or `compression.zstd`, Python ≥ 3.14);
+- gzip images made of several members (e.g. `bgzip`), or, with the
+  `indexed_gzip` package, any gzip image.
+
+Without seek table, the frames are found by a scan of the whole image, done
+once: the index is saved next to the image (`<image>.ext4idx`, or
+`<image>.gzidx` for `indexed_gzip`), with the size and modification time
+of the image, and rebuilt if they changed.  `Filesystem` opens compressed images
+transparently (see `open_image()`)."""
+
+import array
+import bisect
+import os
+import shutil
+import struct
+import sys
+import threading
+import zlib
+
+from . import logger
+from .tools import LRUCache
+
+ZSTD_MAGIC = 0xFD2FB528
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50  # Up to 0x184D2A5F
+ZSTD_SEEK_TABLE_MAGIC = 0x8F92EAB1
+ZSTD_SEEK_TABLE_FRAME = 0x184D2A5E
+GZIP_MAGIC = b"\x1f\x8b"
+
+_INDEX_HEADER = struct.Struct("<8sHQQQ")  # Magic, version, image size, image mtime, frames count
+_INDEX_MAGIC = b"EXT4FIDX"
+_INDEX_VERSION = 1
+
+
+def _index_header(fd, count):
+    st = os.fstat(fd)
+    return _INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, st.st_size, st.st_mtime_ns, count)
+
+
+def _read_index_header(f, fd):
+    """Count of frames of the index file `f`, or None if it is not an index
+    of the image open as `fd` (stale or invalid)"""
+    header = f.read(_INDEX_HEADER.size)
+    if len(header) < _INDEX_HEADER.size:
+        return None
+    magic, version, size, mtime, count = _INDEX_HEADER.unpack(header)
+    st = os.fstat(fd)
+    if magic != _INDEX_MAGIC or version != _INDEX_VERSION or (size, mtime) != (st.st_size, st.st_mtime_ns):
+        return None
+    return count
+
+
+def open_image(path, fd):
+    """A compressed image reader for the image open as `fd`, or None if it
+    is not compressed"""
+    head = os.pread(fd, 4, 0)
+    if len(head) == 4:
+        magic = int.from_bytes(head, 'little')
+        if magic == ZSTD_MAGIC or magic & 0xFFFFFFF0 == ZSTD_SKIPPABLE_MAGIC:
+            return ZstdImage(path, fd)
+    if head[:2] == GZIP_MAGIC:
+        try:
+            import indexed_gzip
+        except ImportError:
+            return GzipImage(path, fd)
+        return IndexedGzipImage(path, fd, indexed_gzip)
+    return None
+
+
+class FrameImage:
+    """Image made of independently compressed frames.  Frame `i` holds bytes
+    `starts[i]` to `starts[i + 1]` of the image, compressed in
+    `compressed_sizes[i]` bytes at `positions[i]` of the file.  The
+    `frame_cache_size` last used frames are kept decompressed."""
+
+    frame_cache_size = 32  # Number of frames
+
+    def __init__(self, path, fd):
+        self.path = path
+        self.fd = fd
+        self.stats = None  # Set by Filesystem
+        self.frame_cache = LRUCache(self.frame_cache_size)
+        self.starts = array.array('Q')
+        self.positions = array.array('Q')
+        self.compressed_sizes = array.array('Q')
+        self.size = 0
+        if not self._load_index():
+            self._build_index()
+            self._save_index()
+
+    def _build_index(self):
+        raise NotImplementedError()
+
+    def _decompress(self, data):
+        raise NotImplementedError()
+
+    def _add_frame(self, position, compressed_size, size):
+        self.starts.append(self.size)
+        self.positions.append(position)
+        self.compressed_sizes.append(compressed_size)
+        self.size += size
+
+    def pread(self, length, offset):
+        chunks = []
+        i = bisect.bisect_right(self.starts, offset) - 1
+        end = min(offset + length, self.size)
+        while offset < end:
+            frame = self._get_frame(i)
+            start = offset - self.starts[i]
+            chunk = frame[start:start + end - offset]
+            chunks.append(chunk)
+            offset += len(chunk)
+            i += 1
+        return b"".join(chunks)
+
+    def _get_frame(self, i):
+        try:
+            frame = self.frame_cache.get(i)
+        except KeyError:
+            pass
+        else:
+            if self.stats is not None:
+                self.stats.count("frame_cache.hits")
+            return frame
+        if self.stats is not None:
+            self.stats.count("frame_cache.misses")
+        frame = self._decompress(os.pread(self.fd, self.compressed_sizes[i], self.positions[i]))
+        self.frame_cache.put(i, frame)
+        return frame
+
+    def close(self):
+        self.frame_cache.clear()
+
+    # Index file, for images without seek table
+
+    def _index_path(self):
+        return os.fspath(self.path) + ".ext4idx"
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "rb") as f:
+                n = _read_index_header(f, self.fd)
+                if n is None:
+                    logger.warning("%s: stale or invalid index, rebuild it", self._index_path())
+                    return False
+                for column in (self.starts, self.positions, self.compressed_sizes):
+                    column.frombytes(f.read(n * column.itemsize))
+                    if sys.byteorder != 'little':
+                        column.byteswap()
+                self.size = int.from_bytes(f.read(8), 'little')
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _save_index(self):
+        if len(self.starts) <= 1:
+            return  # Nothing worth saving
+        try:
+            with open(self._index_path(), "wb") as f:
+                f.write(_index_header(self.fd, len(self.starts)))
+                for column in (self.starts, self.positions, self.compressed_sizes):
+                    if sys.byteorder != 'little':
+                        column = array.array(column.typecode, column)
+                        column.byteswap()
+                    f.write(column.tobytes())
+                f.write(self.size.to_bytes(8, 'little'))
+        except OSError as e:
+            logger.warning("Cannot save the index of %s: %s", self.path, e)
+
+
+class ZstdImage(FrameImage):
+    """zstd image: frames are listed by the seek table, if any, else by a
+    scan of the frame and block headers"""
+
+    def __init__(self, path, fd):
+        self._decompressor = _zstd_decompressor()
+        super().__init__(path, fd)
+
+    def _load_index(self):
+        return self._read_seek_table() or super()._load_index()
+
+    def _read_seek_table(self):
+        file_size = os.fstat(self.fd).st_size
+        if file_size < 9:
+            return False
+        n, descriptor, magic = struct.unpack("<IBI", os.pread(self.fd, 9, file_size - 9))
+        if magic != ZSTD_SEEK_TABLE_MAGIC:
+            return False
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = n * entry_size
+        table = os.pread(self.fd, 8 + table_size, file_size - 9 - table_size - 8)
+        frame_magic, frame_size = struct.unpack_from("<II", table)
+        if frame_magic != ZSTD_SEEK_TABLE_FRAME or frame_size != table_size + 9:
+            logger.warning("%s: invalid seek table, scan the frames", self.path)
+            return False
+        position = 0
+        for i in range(n):
+            compressed_size, size = struct.unpack_from("<II", table, 8 + i * entry_size)
+            self._add_frame(position, compressed_size, size)
+            position += compressed_size
+        return True
+
+    def _build_index(self):
+        logger.warning("%s: no seek table, scan the frames", self.path)
+        position, file_size = 0, os.fstat(self.fd).st_size
+        while position < file_size:
+            magic, = struct.unpack("<I", os.pread(self.fd, 4, position))
+            if magic & 0xFFFFFFF0 == ZSTD_SKIPPABLE_MAGIC:
+                position += 8 + int.from_bytes(os.pread(self.fd, 4, position + 4), 'little')
+                continue
+            if magic != ZSTD_MAGIC:
+                raise ValueError(f"{self.path}: not a zstd frame at {position}")
+            compressed_size, size = self._scan_frame(position)
+            if size is None:
+                # No content size in the header
+                size = len(self._decompress(os.pread(self.fd, compressed_size, position)))
+            self._add_frame(position, compressed_size, size)
+            position += compressed_size
+        if len(self.starts) == 1:
+            logger.warning("%s: a single zstd frame, each read decompresses it all", self.path)
+
+    def _scan_frame(self, position):
+        """Compressed size (found by walking the block headers) and content
+        size (None if not given) of the frame at `position`"""
+        header = os.pread(self.fd, 18, position)
+        descriptor = header[4]
+        fcs_flag, single_segment, has_checksum = descriptor >> 6, descriptor >> 5 & 1, descriptor >> 2 & 1
+        fcs_size = (1 if single_segment else 0, 2, 4, 8)[fcs_flag]
+        pos = 5 + (not single_segment) + (0, 1, 2, 4)[descriptor & 3]
+        size = int.from_bytes(header[pos:pos + fcs_size], 'little') if fcs_size else None
+        if fcs_size == 2:
+            size += 256
+        pos = position + pos + fcs_size
+        while True:
+            block_header = int.from_bytes(os.pread(self.fd, 3, pos), 'little')
+            block_type, block_size = block_header >> 1 & 3, block_header >> 3
+            pos += 3 + (1 if block_type == 1 else block_size)  # RLE blocks store one byte
+            if block_header & 1:
+                break
+        return pos + 4 * has_checksum - position, size
+
+    def _decompress(self, data):
+        return self._decompressor(data)
+
+
+def _zstd_decompressor():
+    try:
+        from compression import zstd
+    except ImportError:
+        pass
+    else:
+        return zstd.decompress
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("Reading zstd images requires the zstandard package") from e
+    return lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+class GzipImage(FrameImage):
+    """gzip image made of several members, each of them being a frame.  The
+    members are found by a decompression of the whole image, done once."""
+
+    def _build_index(self):
+        logger.warning("%s: index the gzip members", self.path)
+        position, file_size = 0, os.fstat(self.fd).st_size
+        decompressor, start, size = zlib.decompressobj(31), 0, 0
+        while position < file_size:
+            data = os.pread(self.fd, 1 << 20, position)
+            position += len(data)
+            while data:
+                # Bounded output: zeroed areas of images compress very well
+                size += len(decompressor.decompress(data, 1 << 24))
+                if not decompressor.eof:
+                    data = decompressor.unconsumed_tail
+                    continue
+                data = decompressor.unused_data
+                end = position - len(data)
+                self._add_frame(start, end - start, size)
+                decompressor, start, size = zlib.decompressobj(31), end, 0
+                if data and data[0] != GZIP_MAGIC[0]:
+                    position = start = file_size  # Trailing padding
+                    break
+        if start != file_size:
+            raise ValueError(f"{self.path}: truncated gzip image")
+        if len(self.starts) == 1:
+            raise ImportError(f"{self.path} is a single gzip member: random reads require the indexed_gzip "
+                              "package (or recompress the image with bgzip)")
+
+    def _decompress(self, data):
+        return zlib.decompress(data, 31)
+
+
+class IndexedGzipImage:
+    """Any gzip image, through `indexed_gzip` and its checkpoints index"""
+
+    def __init__(self, path, fd, indexed_gzip):
+        self.path = path
+        self.fd = fd
+        self.stats = None
+        self._lock = threading.Lock()
+        self._file = indexed_gzip.IndexedGzipFile(fileobj=os.fdopen(os.dup(fd), "rb"), drop_handles=False)
+        if not self._load_index():
+            logger.warning("%s: index the gzip image", path)
+            self._file.build_full_index()
+            self._save_index()
+
+    def pread(self, length, offset):
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def close(self):
+        self._file.close()
+
+    # Index file: the header of `FrameImage` indexes, then the index of indexed_gzip
+
+    def _index_path(self):
+        return os.fspath(self.path) + ".gzidx"
+
+    def _load_index(self):
+        try:
+            # Unbuffered: indexed_gzip reads from the position of the file descriptor
+            with open(self._index_path(), "rb", buffering=0) as f:
+                if _read_index_header(f, self.fd) is None:
+                    logger.warning("%s: stale or invalid index, rebuild it", self._index_path())
+                    return False
+                self._file.import_index(fileobj=f)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _save_index(self):
+        # indexed_gzip writes from the start of the file: its index is copied after the header
+        tmp_path = self._index_path() + ".tmp"
+        try:
+            self._file.export_index(tmp_path)
+            with open(tmp_path, "rb") as index, open(self._index_path(), "wb") as f:
+                f.write(_index_header(self.fd, 0))
+                shutil.copyfileobj(index, f)
+        except OSError as e:
+            logger.warning("Cannot save the index of %s: %s", self.path, e)
+        finally:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,221 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""`ext4d`: serve a set of images over a Unix domain socket.
+
+Each image is opened once, and its `Filesystem` (with its block and extent
+map caches) is shared by all the requests; with a `cache_size`, the caches
+of all the images share one `ext4.pool.CachePool` (good for snapshots of one
+volume).  Resolved paths are kept in a dentry cache.  The protocol is described in `ext4.protocol`.
+
+    with Server("/run/ext4d.sock", ["/dev/sdXY"]) as server:
+        server.serve_forever()
+"""
+
+import errno
+import os
+import posixpath
+import socket
+import socketserver
+import threading
+
+from . import logger, protocol
+from .ext4 import Filesystem
+from .files import Directory, RegularFile, SymbolicLink
+from .tools import LRUCache
+
+
+class _Image:
+    """An open image, with its dentry cache (path -> `File`)"""
+
+    dentry_cache_size = 65536
+
+    def __init__(self, path, pool=None):
+        self.filesystem = Filesystem(path, pool=pool).__enter__()
+        self.dentries = LRUCache(self.dentry_cache_size)
+
+    def close(self):
+        self.filesystem.__exit__(None, None, None)
+
+    def get_file(self, path):
+        if not path.startswith("/"):
+            raise ValueError("Path must be absolute")
+        path = posixpath.normpath(path)
+        if path.startswith("//"):
+            path = path[1:]  # normpath() keeps a leading "//"
+        try:
+            return self.dentries.get(path)
+        except KeyError:
+            pass
+        if path == "/":
+            file = self.filesystem.get_root_dir()
+        else:
+            parent_path, name = path.rsplit("/", 1)
+            parent = self.get_file(parent_path or "/")
+            if not isinstance(parent, Directory):
+                raise NotADirectoryError(parent_path)
+            file = parent.get_file(name)
+        self.dentries.put(path, file)
+        return file
+
+    def cache_files(self, files):
+        for file in files:
+            if file.filename not in (".", ".."):
+                self.dentries.put(file.path, file)
+
+
+def _pack_entry(file, path):
+    target = file.get_target() if isinstance(file, SymbolicLink) else ""
+    return protocol.pack_entry(path, file.get_stat(), target)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                opcode, payload = protocol.read_frame(self.rfile)
+            except (protocol.ProtocolError, ConnectionError):
+                return
+            if opcode is None:
+                return
+            path = None
+            try:
+                image, path, offset, length = protocol.unpack_request(payload)
+                self._dispatch(opcode, self.server.get_image(image), path, offset, length)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                if not isinstance(e, (OSError, ValueError, KeyError)):
+                    logger.exception("Failed request %d on %s", opcode, path)
+                self.wfile.write(protocol.pack_error(e))
+            self.wfile.flush()
+
+    def _dispatch(self, opcode, image, path, offset, length):
+        if opcode == protocol.STAT:
+            file = image.get_file(path)
+            self.wfile.write(protocol.frame(protocol.ENTRIES, _pack_entry(file, file.filename or "/")))
+        elif opcode == protocol.LIST:
+            file = image.get_file(path)
+            if isinstance(file, Directory):
+                files = list(file.get_files())
+                image.cache_files(files)
+            else:
+                files = [file]
+            self._send_entries((file, file.filename) for file in files)
+        elif opcode == protocol.WALK:
+            root = image.get_file(path)
+            if not isinstance(root, Directory):
+                raise NotADirectoryError(path)
+            self._send_entries((file, file.path) for file in root.walk())
+        elif opcode == protocol.READ:
+            self._send_content(image.get_file(path), offset, length)
+        else:
+            raise ValueError(f"Unknown request {opcode}")
+
+    def _send_entries(self, files):
+        batch = []
+        for file, path in files:
+            batch.append(_pack_entry(file, path))
+            if len(batch) >= protocol.ENTRIES_PER_FRAME:
+                self.wfile.write(protocol.frame(protocol.ENTRIES, b"".join(batch)))
+                batch = []
+        if batch:
+            self.wfile.write(protocol.frame(protocol.ENTRIES, b"".join(batch)))
+        self.wfile.write(protocol.frame(protocol.END))
+
+    def _send_content(self, file, offset, length):
+        if isinstance(file, Directory):
+            raise IsADirectoryError(file.path)
+        if not isinstance(file, RegularFile):
+            raise OSError(errno.EINVAL, "Not a regular file", file.path)
+        size = file.inode.get_size()
+        start = min(offset, size)
+        end = size if length < 0 else min(size, start + length)
+        content = file.content
+        if start == 0 and end == size:
+            chunks = content.iter_bytes()
+        else:
+            chunks = (content.get_bytes(pos, min(pos + protocol.MAX_DATA_SIZE, end))
+                      for pos in range(start, end, protocol.MAX_DATA_SIZE))
+        for chunk in chunks:
+            for i in range(0, len(chunk), protocol.MAX_DATA_SIZE):
+                self.wfile.write(protocol.frame(protocol.DATA, chunk[i:i + protocol.MAX_DATA_SIZE]))
+        self.wfile.write(protocol.frame(protocol.END))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve `images` (paths to block devices or image files) on the Unix
+    socket `socket_path`, which is only accessible by the current user.
+    `cache_size` (in bytes) bounds the caches shared by all the images; if
+    None, each image has its own caches."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, images, cache_size=None):
+        self.images = {_image_key(path): None for path in images}
+        self.pool = None
+        if cache_size is not None:
+            from .pool import CachePool
+            self.pool = CachePool(cache_size)
+        self._images_lock = threading.Lock()
+        _remove_stale_socket(socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+        logger.info("Serving %d images on %s", len(self.images), socket_path)
+
+    def get_image(self, path) -> _Image:
+        key = _image_key(path)
+        if key not in self.images:
+            raise FileNotFoundError(f"{path} is not served")
+        with self._images_lock:
+            if self.images[key] is None:
+                self.images[key] = _Image(key, self.pool)
+            return self.images[key]
+
+    def server_close(self):
+        super().server_close()
+        for image in self.images.values():
+            if image is not None:
+                image.close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def _image_key(path):
+    """Resolved path of a local image (URLs are kept as given)"""
+    if path.startswith(("http://", "https://")):
+        return path
+    return os.path.realpath(path)
+
+
+def _remove_stale_socket(socket_path):
+    """Remove `socket_path` if it is a socket nobody listens to anymore"""
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+        else:
+            raise OSError(f"{socket_path}: a server is already running")
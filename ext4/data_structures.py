@@ -17,10 +17,9 @@
 # <https://www.gnu.org/licenses/>.
 
 import ctypes
-import enum
 
-from . import logger, tools
-from .tools import FSException, crc16, crc32c
+from . import logger, stats, tools
+from .tools import FSException, IntConstants, crc16, crc32c
 
 
 class Superblock(ctypes.LittleEndianStructure):
@@ -131,7 +130,7 @@ class Superblock(ctypes.LittleEndianStructure):
         fit = min(len(struct_data), ctypes.sizeof(self))
         ctypes.memmove(ctypes.addressof(self), struct_data, fit)
         if self.filesystem.fail_on_wrong_checksum \
-                and not self.verify_checksums(struct_data):
+                and not stats.timed(self.filesystem.stats, "checksum_ns", self.verify_checksums, struct_data):
             raise FSException(f"Wrong checksum in superblock")
         logger.info("Decoded superbock: FS UUID = %s", self._format_uuid())
         return self
@@ -151,6 +150,15 @@ class Superblock(ctypes.LittleEndianStructure):
     def get_block_size(self):
         return 2 ** (10 + self.s_log_block_size)
 
+    def get_blocks_count(self):
+        count = self.s_blocks_count_lo
+        if self.has_flag(Superblock.FeatureIncompat.INCOMPAT_64BIT):
+            count |= self.s_blocks_count_hi << 32
+        return count
+
+    def get_groups_count(self):
+        return -(-(self.get_blocks_count() - self.s_first_data_block) // self.s_blocks_per_group)
+
     def get_groups_per_flex(self):
         return 2 ** self.s_log_groups_per_flex
 
@@ -158,7 +166,9 @@ class Superblock(ctypes.LittleEndianStructure):
         return bytes(self.s_volume_name).decode('utf-8')
 
     def has_flag(self, flag):
-        if isinstance(flag, self.FeatureIncompat):
+        if isinstance(flag, self.FeatureCompat):
+            return self.s_feature_compat & flag != 0
+        elif isinstance(flag, self.FeatureIncompat):
             return self.s_feature_incompat & flag != 0
         elif isinstance(flag, self.FeatureRoCompat):
             return self.s_feature_ro_compat & flag != 0
@@ -174,14 +184,14 @@ class Superblock(ctypes.LittleEndianStructure):
 
     # Field types
 
-    class CreatorOS(enum.IntEnum):
+    class CreatorOS(IntConstants):
         LINUX = 0
         HURD = 1
         MASIX = 2
         FEREBSD = 3
         LITES = 4
 
-    class FeatureCompat(enum.IntEnum):
+    class FeatureCompat(IntConstants):
         COMPAT_DIR_PREALLOC = 0x1
         COMPAT_IMAGIC_INODES = 0x2
         COMPAT_HAS_JOURNAL = 0x4
@@ -193,7 +203,7 @@ class Superblock(ctypes.LittleEndianStructure):
         COMPAT_EXCLUDE_BITMAP = 0x100
         COMPAT_SPARSE_SUPER2 = 0x200
 
-    class FeatureIncompat(enum.IntEnum):
+    class FeatureIncompat(IntConstants):
         INCOMPAT_COMPRESSION = 0x1
         INCOMPAT_FILETYPE = 0x2
         INCOMPAT_RECOVER = 0x4
@@ -210,7 +220,7 @@ class Superblock(ctypes.LittleEndianStructure):
         INCOMPAT_INLINE_DATA = 0x8000
         INCOMPAT_ENCRYPT = 0x10000
 
-    class FeatureRoCompat(enum.IntEnum):
+    class FeatureRoCompat(IntConstants):
         RO_COMPAT_SPARSE_SUPER = 0x1
         RO_COMPAT_LARGE_FILE = 0x2
         RO_COMPAT_BTREE_DIR = 0x4
@@ -254,16 +264,25 @@ class BlockGroupDescriptor(ctypes.LittleEndianStructure):
         fit = min(len(struct_data), ctypes.sizeof(self))
         ctypes.memmove(ctypes.addressof(self), struct_data, fit)
         if self.filesystem.fail_on_wrong_checksum \
-                and not self.verify_checksums():
+                and not stats.timed(self.filesystem.stats, "checksum_ns", self.verify_checksums):
             raise FSException(f"Wrong checksum in block group descriptor {self.no}")
         logger.info("Decoded block group descriptor %d (@%X)", self.no, self.pos)
         return self
 
     def verify_checksums(self):
+        if not self._has_checksum():
+            return True  # Nothing to check
+        algo = self._get_checksum_algo()
         data = bytes(self.filesystem.UUID) + self.no.to_bytes(4, 'little') + bytes(self)[:0x1E]
-        csum = self._get_checksum_algo()(data) & 0xFFFF
+        if algo is crc32c:
+            data += b"\x00\x00"  # The checksum field itself, zeroed
+        csum = algo(data) & 0xFFFF
         return csum == self.bg_checksum
 
+    def _has_checksum(self):
+        return self.filesystem.conf.s_feature_ro_compat \
+            & (Superblock.FeatureRoCompat.RO_COMPAT_GDT_CSUM | Superblock.FeatureRoCompat.RO_COMPAT_METADATA_CSUM) != 0
+
     def _get_checksum_algo(self):
         if self.filesystem.conf.s_feature_ro_compat & Superblock.FeatureRoCompat.RO_COMPAT_GDT_CSUM != 0 \
                 and self.filesystem.conf.s_feature_ro_compat & Superblock.FeatureRoCompat.RO_COMPAT_METADATA_CSUM == 0:
@@ -290,7 +309,7 @@ class BlockGroupDescriptor(ctypes.LittleEndianStructure):
 
     # Field types
 
-    class Flags(enum.IntEnum):
+    class Flags(IntConstants):
         INODE_UNINIT = 0x1
         BLOCK_UNINIT = 0x2
         INODE_ZEROED = 0x4
@@ -312,9 +331,13 @@ class BlockGroupDescriptor64(BlockGroupDescriptor):
     ]
 
     def verify_checksums(self):
+        if not self._has_checksum():
+            return True  # Nothing to check
+        algo = self._get_checksum_algo()
+        # crc32c covers the checksum field itself (zeroed), crc16 skips it
         data = bytes(self.filesystem.UUID) + self.no.to_bytes(4, 'little') + bytes(self)[:0x1E] \
-               + b"\x00\x00" + bytes(self)[0x20:]
-        csum = self._get_checksum_algo()(data) & 0xFFFF
+               + (b"\x00\x00" if algo is crc32c else b"") + bytes(self)[0x20:]
+        csum = algo(data) & 0xFFFF
         return csum == self.bg_checksum
 
     def get_bg_block_bitmap_loc(self):
@@ -448,14 +471,17 @@ class Inode(ctypes.LittleEndianStructure):
         if len(struct_data) < self.filesystem.conf.s_inode_size:
             raise ValueError(f"Too few data to read a inode, "
                              f"expected at least {self.filesystem.conf.s_inode_size} bytes")
-        min_size = self.EXT2_GOOD_OLD_INODE_SIZE + Inode.i_extra_isize.size
+        # 128-byte inodes have no i_extra_isize: it is left to 0
+        min_size = min(self.EXT2_GOOD_OLD_INODE_SIZE + Inode.i_extra_isize.size, len(struct_data))
         ctypes.memmove(ctypes.addressof(self), struct_data, min_size)
-        ctypes.memmove(ctypes.addressof(self) + min_size, struct_data[min_size:],
-                       self.i_extra_isize - Inode.i_extra_isize.size)
+        # i_extra_isize is 0 in unused (zeroed) inodes: stay within bounds
+        extra_size = max(0, min(self.i_extra_isize - Inode.i_extra_isize.size, ctypes.sizeof(self) - min_size,
+                                len(struct_data) - min_size))
+        ctypes.memmove(ctypes.addressof(self) + min_size, struct_data[min_size:], extra_size)
         self._extraneous_data = struct_data[self.EXT2_GOOD_OLD_INODE_SIZE + self.i_extra_isize:
                                             self.filesystem.conf.s_inode_size]
         if self.filesystem.fail_on_wrong_checksum \
-                and not self.verify_checksums():
+                and not stats.timed(self.filesystem.stats, "checksum_ns", self.verify_checksums):
             raise FSException(f"Wrong checksum in inode {self.no}")
         return self
 
@@ -470,7 +496,7 @@ class Inode(ctypes.LittleEndianStructure):
         seed = self.filesystem.conf.get_csum_seed()
         checksum_lo_start = Inode.i_osd2.offset + _Inode_Linux2.l_i_checksum_lo.offset
         checksum_hi_start = Inode.i_checksum_hi.offset
-        struct_data = bytes(self)
+        struct_data = bytes(self)[:self.EXT2_GOOD_OLD_INODE_SIZE + self.i_extra_isize]  # Then _extraneous_data
         crc = crc32c(self.no.to_bytes(4, 'little'), seed)
         crc = crc32c(self.i_generation.to_bytes(4, 'little'), crc)
         crc = crc32c(struct_data[:checksum_lo_start], crc)
@@ -489,14 +515,42 @@ class Inode(ctypes.LittleEndianStructure):
             provided_csum |= self.i_checksum_hi << 16
         if has_lo:
             provided_csum |= self.i_osd2.linux2.l_i_checksum_lo
-        # Compare
-        return computed_csum == provided_csum
+        # Compare.  Unused inodes are zeroed, without checksum (like in e2fsprogs)
+        return computed_csum == provided_csum or not any(bytes(self)) and not any(self._extraneous_data)
 
     # Some accelerators
 
     def has_flag(self, flag):
         return self.i_flags & flag != 0
 
+    def iter_ibody_xattrs(self):
+        """(entry, value) of the extended attributes stored in the inode itself
+        (after the extra fields).  No I/O: they come with the inode."""
+        data = self._extraneous_data
+        if len(data) < 4 or int.from_bytes(data[:4], 'little') != ExtendedAttributeHeader.MAGIC:
+            return iter(())
+        # Value offsets are relative to the first entry
+        return ExtendedAttributeEntry.read_entries(data, 4, 4)
+
+    def get_ibody_xattrs(self):
+        """Same as `iter_ibody_xattrs()`, as a {name: value} dict"""
+        return {entry.get_full_name(): value for entry, value in self.iter_ibody_xattrs()}
+
+    def get_file_acl(self):
+        """Block holding the extended attributes of the inode (0 if none)"""
+        file_acl = self.i_file_acl_lo
+        if self.filesystem.conf.s_creator_os == Superblock.CreatorOS.LINUX:
+            file_acl |= self.i_osd2.linux2.l_i_file_acl_high << 32
+        return file_acl
+
+    def get_inline_data(self):
+        """Content of an inode with inline data: `i_block`, continued by the
+        value of the "system.data" extended attribute"""
+        data = bytes(self.i_block)
+        if self.get_size() > len(data):
+            data += self.get_ibody_xattrs().get("system.data") or b""
+        return data
+
     def get_file_type(self):
         file_type = self.i_mode & 0xF000
         try:
@@ -548,7 +602,7 @@ class Inode(ctypes.LittleEndianStructure):
 
     # Field types
 
-    class Mode(enum.IntEnum):
+    class Mode(IntConstants):
         # File mode
         IXOTH = 0x1  # Others may execute
         IWOTH = 0x2  # Others may write
@@ -572,7 +626,7 @@ class Inode(ctypes.LittleEndianStructure):
         IFLNK = 0xA000  # Symbolic link
         IFSOCK = 0xC000  # Socket
 
-    class Flags(enum.IntEnum):
+    class Flags(IntConstants):
         SECRM = 0x1
         UNRM = 0x2
         COMPR = 0x4
@@ -648,6 +702,9 @@ class ExtentIdx(ctypes.LittleEndianStructure):
         ctypes.memmove(ctypes.addressof(self), struct_data, fit)
         return self
 
+    def get_leaf(self):
+        return (self.ee_leaf_hi << 32) | self.ei_leaf_lo
+
 
 class Extent(ctypes.LittleEndianStructure):
     """Leaf nodes of the extent tree."""
@@ -664,9 +721,18 @@ class Extent(ctypes.LittleEndianStructure):
         ctypes.memmove(ctypes.addressof(self), struct_data, fit)
         return self
 
+    # Longest initialized extent.  Above, the extent is unwritten (reads as zeros)
+    EXT_INIT_MAX_LEN = 32768
+
     def get_start(self):
         return (self.ee_start_hi << 32) | self.ee_start_lo
 
+    def is_initialized(self):
+        return self.ee_len <= self.EXT_INIT_MAX_LEN
+
+    def get_length(self):
+        return self.ee_len if self.is_initialized() else self.ee_len - self.EXT_INIT_MAX_LEN
+
 
 class DirEntry(ctypes.LittleEndianStructure):
     _pack_ = 1
@@ -730,7 +796,7 @@ class DirEntry2(ctypes.LittleEndianStructure):
 
     # Field types
 
-    class FileType(enum.IntEnum):
+    class FileType(IntConstants):
         UNKNOWN = 0x0
         REGULAR_FILE = 0x1
         DIRECTORY = 0x2
@@ -786,7 +852,7 @@ class DxRootInfo(ctypes.LittleEndianStructure):
 
     # Field types
 
-    class HashAlgo(enum.IntEnum):
+    class HashAlgo(IntConstants):
         LEGACY = 0x0
         HALF_MD4 = 0x1
         TEA = 0x2
@@ -879,3 +945,101 @@ class DxNode(ctypes.LittleEndianStructure):
         fit = min(len(struct_data), ctypes.sizeof(self))
         ctypes.memmove(ctypes.addressof(self), struct_data, fit)
         return self
+
+
+class ExtendedAttributeHeader(ctypes.LittleEndianStructure):
+    """Header of an extended attribute block (see `i_file_acl`)"""
+    _pack_ = 1
+    _fields_ = [
+        ("h_magic", ctypes.c_uint32),
+        ("h_refcount", ctypes.c_uint32),
+        ("h_blocks", ctypes.c_uint32),
+        ("h_hash", ctypes.c_uint32),
+        ("h_checksum", ctypes.c_uint32),
+        ("h_reserved", ctypes.c_uint32 * 3),
+    ]
+
+    MAGIC = 0xEA020000
+
+    def read_bytes(self, struct_data):
+        fit = min(len(struct_data), ctypes.sizeof(self))
+        ctypes.memmove(ctypes.addressof(self), struct_data, fit)
+        return self
+
+
+class ExtendedAttributeEntry(ctypes.LittleEndianStructure):
+    _pack_ = 1
+    _fields_ = [
+        ("e_name_len", ctypes.c_uint8),
+        ("e_name_index", ctypes.c_uint8),
+        ("e_value_offs", ctypes.c_uint16),
+        ("e_value_inum", ctypes.c_uint32),
+        ("e_value_size", ctypes.c_uint32),
+        ("e_hash", ctypes.c_uint32),
+        # ("e_name",)  # Variable length, see below
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self._name = ...
+
+    def read_bytes(self, struct_data):
+        fit = min(len(struct_data), ctypes.sizeof(self))
+        ctypes.memmove(ctypes.addressof(self), struct_data, fit)
+        # Variable-length field, stored separately
+        self._name = bytes(struct_data[0x10:0x10 + self.e_name_len])
+        return self
+
+    # Accelerators
+
+    @property
+    def name(self):
+        return self._name
+
+    def get_size(self):
+        """Size of the entry, with its name and padding"""
+        return (ctypes.sizeof(self) + self.e_name_len + 3) & ~3
+
+    @classmethod
+    def read_entries(cls, data, offset, values_offset):
+        """Iterate over the (entry, value) of the list of entries starting at
+        `offset`.  Values are at `e_value_offs` from `values_offset`; the
+        value is None if it is stored in its own inode (`e_value_inum`)."""
+        while offset + 4 <= len(data) and data[offset:offset + 4] != b"\x00\x00\x00\x00":
+            entry = cls().read_bytes(data[offset:])
+            if entry.e_value_inum != 0:
+                value = None
+            else:
+                start = values_offset + entry.e_value_offs
+                value = bytes(data[start:start + entry.e_value_size])
+            yield entry, value
+            offset += entry.get_size()
+
+    def get_full_name(self):
+        prefix = self.NAME_PREFIXES.get(self.e_name_index)
+        if prefix is None:
+            raise FSException(f"Unknown extended attribute name index {self.e_name_index}")
+        return prefix + self._name.decode('utf-8', 'surrogateescape')
+
+    # Field types
+
+    class NameIndex(IntConstants):
+        USER = 1
+        POSIX_ACL_ACCESS = 2
+        POSIX_ACL_DEFAULT = 3
+        TRUSTED = 4
+        LUSTRE = 5
+        SECURITY = 6
+        SYSTEM = 7
+        RICHACL = 8
+
+    NAME_PREFIXES = {
+        NameIndex.USER: "user.",
+        NameIndex.POSIX_ACL_ACCESS: "system.posix_acl_access",
+        NameIndex.POSIX_ACL_DEFAULT: "system.posix_acl_default",
+        NameIndex.TRUSTED: "trusted.",
+        NameIndex.LUSTRE: "lustre.",
+        NameIndex.SECURITY: "security.",
+        NameIndex.SYSTEM: "system.",
+        NameIndex.RICHACL: "system.richacl",
+    }
@@ -0,0 +1,381 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Differences between two snapshots of a file system, without walking the
+trees.
+
+1. The inode bitmaps of each group are compared: they give the added and
+   deleted inodes.  Block bitmaps give the count of allocated and freed
+   blocks.
+2. The inode table blocks holding inodes used in both snapshots are
+   compared byte for byte (a whole run of blocks at once), and only the
+   differing inodes are decoded.  With a `block_hint` (see `ext4.pool`) on
+   both file systems, blocks with the same hint are not even read.
+3. Inode numbers are mapped to paths by a `DentryIndex` of the old
+   snapshot, updated with the changed directories only.
+
+    result = old_filesystem.diff(new_filesystem, index=DentryIndex.load("old.didx"))
+    for change in result.changes:
+        ...
+    result.index.save("new.didx")
+"""
+
+import struct
+
+from . import logger
+from .data_structures import BlockGroupDescriptor, DirEntry2, Inode, Superblock
+from .ext4 import SpecialInode
+from .tools import IntConstants
+
+
+class ChangeKind(IntConstants):
+    ADDED = 0
+    DELETED = 1
+    MODIFIED = 2
+
+
+class Change:
+    """A changed inode.  `paths` are its paths in the new snapshot (in the
+    old one if deleted), `old_paths` its paths in the old snapshot if
+    modified (different if renamed).  `fields` tells what changed, among
+    "content" (size, mtime or mapping), "metadata" (mode, owner, links,
+    ctime, flags, extended attributes…) and "atime"."""
+
+    def __init__(self, kind, inode_no, paths, old_paths=(), fields=frozenset()):
+        self.kind = kind
+        self.inode_no = inode_no
+        self.paths = paths
+        self.old_paths = old_paths
+        self.fields = fields
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}<{self.kind.name} {self.inode_no} {self.paths}>"
+
+
+class SnapshotDiff:
+    """Result of `diff()`: the `changes` (by inode number), the counts of
+    `blocks_allocated` and `blocks_freed`, and the `index` of the new
+    snapshot"""
+
+    def __init__(self, changes, blocks_allocated, blocks_freed, index):
+        self.changes = changes
+        self.blocks_allocated = blocks_allocated
+        self.blocks_freed = blocks_freed
+        self.index = index
+
+
+# Byte ranges of the raw inode telling what changed
+def _field_range(name):
+    field = getattr(Inode, name)
+    return field.offset, field.offset + field.size
+
+
+_CONTENT_RANGES = [_field_range(name) for name in ("i_size_lo", "i_size_high", "i_mtime", "i_mtime_extra",
+                                                   "i_blocks_lo", "i_block")]
+_ATIME_RANGES = [_field_range(name) for name in ("i_atime", "i_atime_extra")]
+_GENERATION = slice(*_field_range("i_generation"))
+# Checksums and i_version change with anything else
+_IGNORED_RANGES = [_field_range(name) for name in ("i_osd1", "i_checksum_hi", "i_version_hi")] \
+                  + [(Inode.i_osd2.offset + 8, Inode.i_osd2.offset + 10)]  # l_i_checksum_lo
+
+
+def diff(old, new, index=None):
+    """Changes from file system `old` to `new`, two snapshots of the same
+    file system.  `index` is the `DentryIndex` of `old` (built by walking
+    its directories if None)."""
+    conf = old.conf
+    if bytes(conf.s_uuid) != bytes(new.conf.s_uuid) or conf.s_inodes_per_group != new.conf.s_inodes_per_group \
+            or conf.s_inode_size != new.conf.s_inode_size:
+        raise ValueError(f"{old.block_device} and {new.block_device} are not snapshots of the same file system")
+    if index is None:
+        logger.info("Build the dentry index of %s", old.block_device)
+        index = DentryIndex.build(old)
+    elif index.uuid != bytes(conf.s_uuid):
+        raise ValueError("Dentry index of another file system")
+
+    added, deleted, modified = [], [], []
+    blocks_allocated = blocks_freed = 0
+    inodes_per_group = conf.s_inodes_per_group
+    for bg_no in range(min(conf.get_groups_count(), new.conf.get_groups_count())):
+        bgd_old, bgd_new = old.get_block_group_desc(bg_no), new.get_block_group_desc(bg_no)
+        first = bg_no * inodes_per_group + 1
+        used_old, used_new = _inode_bitmap(old, bgd_old), _inode_bitmap(new, bgd_new)
+        added.extend(first + i for i in _bits(used_new & ~used_old))
+        deleted.extend(first + i for i in _bits(used_old & ~used_new))
+        modified.extend(_changed_inodes(old, new, bg_no, bgd_old, bgd_new, used_old & used_new))
+        if not bgd_old.has_flag(BlockGroupDescriptor.Flags.BLOCK_UNINIT) \
+                and not bgd_new.has_flag(BlockGroupDescriptor.Flags.BLOCK_UNINIT):
+            blocks_old, blocks_new = _block_bitmap(old, bgd_old), _block_bitmap(new, bgd_new)
+            if blocks_old != blocks_new:
+                blocks_allocated += (blocks_new & ~blocks_old).bit_count()
+                blocks_freed += (blocks_old & ~blocks_new).bit_count()
+
+    is_tracked = lambda inode_no: inode_no == SpecialInode.ROOT_DIRECTORY or inode_no >= conf.s_first_ino
+    changes = []
+    removed_dirs, changed_dirs = [], []
+    for inode_no in filter(is_tracked, deleted):
+        changes.append(Change(ChangeKind.DELETED, inode_no, index.get_paths(inode_no)))
+        removed_dirs.append(inode_no)
+    for inode_no, raw_old, raw_new in modified:
+        if not is_tracked(inode_no):
+            continue
+        if raw_old[_GENERATION] != raw_new[_GENERATION] or _file_type(raw_old) != _file_type(raw_new):
+            # Deleted, then the inode was reused (the generation is not
+            # always bumped, but a file never changes its type)
+            changes.append(Change(ChangeKind.DELETED, inode_no, index.get_paths(inode_no)))
+            added.append(inode_no)
+            removed_dirs.append(inode_no)
+            continue
+        fields = _changed_fields(raw_old, raw_new)
+        if fields:
+            changes.append(Change(ChangeKind.MODIFIED, inode_no, None, index.get_paths(inode_no), fields))
+            changed_dirs.append(inode_no)
+    added = list(filter(is_tracked, added))
+    new_index = index.updated(new, removed_dirs, changed_dirs + added)
+    for change in changes:
+        if change.kind == ChangeKind.MODIFIED:
+            change.paths = new_index.get_paths(change.inode_no)
+    changes.extend(Change(ChangeKind.ADDED, inode_no, new_index.get_paths(inode_no)) for inode_no in added)
+    changes.sort(key=lambda change: change.inode_no)
+    return SnapshotDiff(changes, blocks_allocated, blocks_freed, new_index)
+
+
+def _bits(value):
+    """Indexes of the bits set in `value`"""
+    while value:
+        low = value & -value
+        yield low.bit_length() - 1
+        value ^= low
+
+
+def _inode_bitmap(filesystem, bgd):
+    if bgd.has_flag(BlockGroupDescriptor.Flags.INODE_UNINIT):
+        return 0
+    bitmap = filesystem.get_block(bgd.get_bg_inode_bitmap_loc())
+    return int.from_bytes(bitmap[:filesystem.conf.s_inodes_per_group // 8], 'little')
+
+
+def _block_bitmap(filesystem, bgd):
+    bitmap = filesystem.get_block(bgd.get_bg_block_bitmap_loc())
+    return int.from_bytes(bitmap[:filesystem.conf.s_blocks_per_group // 8], 'little')
+
+
+def _changed_inodes(old, new, bg_no, bgd_old, bgd_new, used):
+    """(inode number, old raw inode, new raw inode) of the inodes `used` in
+    both snapshots whose raw bytes differ"""
+    conf = old.conf
+    block_size, inode_size = conf.get_block_size(), conf.s_inode_size
+    per_block = block_size // inode_size
+    table_old, table_new = bgd_old.get_inode_table_loc(), bgd_new.get_inode_table_loc()
+    hinted = old.block_hint is not None and new.block_hint is not None and table_old == table_new
+    first_inode = bg_no * conf.s_inodes_per_group + 1
+    indexes = list(_bits(used))
+    blocks = sorted({index // per_block for index in indexes})
+    for run in _runs(blocks, max_length=64):
+        if hinted:
+            run = [block for block in run
+                   if old.block_hint(table_old + block) is None
+                   or old.block_hint(table_old + block) != new.block_hint(table_new + block)]
+            if not run:
+                continue
+        for sub_run in _runs(run, max_length=64):
+            n = len(sub_run)
+            data_old = old.get_block(table_old + sub_run[0], n)
+            data_new = new.get_block(table_new + sub_run[0], n)
+            if data_old == data_new:
+                continue
+            for i, block in enumerate(sub_run):
+                start = i * block_size
+                if data_old[start:start + block_size] == data_new[start:start + block_size]:
+                    continue
+                for index in range(block * per_block, (block + 1) * per_block):
+                    if not used >> index & 1:
+                        continue
+                    offset = start + (index - block * per_block) * inode_size
+                    raw_old, raw_new = data_old[offset:offset + inode_size], data_new[offset:offset + inode_size]
+                    if raw_old != raw_new:
+                        yield first_inode + index, raw_old, raw_new
+
+
+def _runs(blocks, max_length):
+    """Split sorted block numbers into runs of consecutive ones"""
+    run = []
+    for block in blocks:
+        if run and (block != run[-1] + 1 or len(run) == max_length):
+            yield run
+            run = []
+        run.append(block)
+    if run:
+        yield run
+
+
+def _file_type(raw_inode):
+    return int.from_bytes(raw_inode[Inode.i_mode.offset:Inode.i_mode.offset + 2], 'little') & 0xF000
+
+
+def _changed_fields(raw_old, raw_new):
+    def differ(ranges):
+        return any(raw_old[start:end] != raw_new[start:end] for start, end in ranges)
+
+    fields = set()
+    if differ(_CONTENT_RANGES):
+        fields.add("content")
+    if differ(_ATIME_RANGES):
+        fields.add("atime")
+    masked_old, masked_new = bytearray(raw_old), bytearray(raw_new)
+    for start, end in _CONTENT_RANGES + _ATIME_RANGES + _IGNORED_RANGES:
+        masked_old[start:end] = masked_new[start:end] = bytes(end - start)
+    if masked_old != masked_new:
+        fields.add("metadata")
+    return frozenset(fields)
+
+
+_INDEX_HEADER = struct.Struct("<8sH16sQ")  # Magic, version, UUID, directories count
+_INDEX_DIRECTORY = struct.Struct("<II")  # Inode, entries count
+_INDEX_ENTRY = struct.Struct("<IB")  # Inode, name length
+_INDEX_MAGIC = b"EXT4DIDX"
+_INDEX_VERSION = 1
+
+
+class DentryIndex:
+    """Entries of all the directories of a file system (without `.` and
+    `..`): `entries[directory inode] = {name: inode}`.  Gives the paths of
+    an inode (several if hard linked)."""
+
+    def __init__(self, uuid, entries=None):
+        self.uuid = bytes(uuid)
+        self.entries = entries if entries is not None else {}
+        self._parents = None  # inode -> [(directory inode, name)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def build(cls, filesystem):
+        """Index of the directories of `filesystem`, read breadth-first (file
+        contents and inodes of non-directories are not read, except without
+        the file type feature)"""
+        index = cls(filesystem.UUID)
+        queue = [SpecialInode.ROOT_DIRECTORY]
+        while queue:
+            subdirectories = index._read_directory(filesystem, queue.pop())
+            queue.extend(subdirectories)
+        return index
+
+    def _read_directory(self, filesystem, inode_no):
+        """Index the directory `inode_no`, and return its subdirectories"""
+        from .files import Directory
+        has_file_type = filesystem.conf.has_flag(Superblock.FeatureIncompat.INCOMPAT_FILETYPE)
+        directory = Directory(filesystem, "", inode_no, filesystem.get_inode(inode_no))
+        entries, subdirectories = {}, []
+        for direntry in directory._get_direntries():
+            name = direntry.get_name()
+            if name in (".", ".."):
+                continue
+            entries[name] = direntry.inode
+            if has_file_type:
+                is_directory = direntry.file_type == DirEntry2.FileType.DIRECTORY
+            else:
+                is_directory = filesystem.get_inode(direntry.inode).i_mode & 0xF000 == Inode.Mode.IFDIR
+            if is_directory:
+                subdirectories.append(direntry.inode)
+        self.entries[inode_no] = entries
+        return subdirectories
+
+    def updated(self, filesystem, removed, changed):
+        """Index of `filesystem`, a later snapshot where the inodes
+        `removed` were deleted, and the inodes `changed` were added or
+        modified (those which are directories are read again)"""
+        index = DentryIndex(self.uuid, dict(self.entries))
+        for inode_no in removed:
+            index.entries.pop(inode_no, None)
+        queue = list(changed)
+        while queue:
+            inode_no = queue.pop()
+            inode = filesystem.get_inode(inode_no)
+            if inode.i_mode & 0xF000 != Inode.Mode.IFDIR:
+                index.entries.pop(inode_no, None)  # Not a directory anymore
+                continue
+            known = inode_no in index.entries
+            subdirectories = index._read_directory(filesystem, inode_no)
+            if not known:
+                # New directory: its subdirectories are new too, maybe not
+                # listed as changed if the snapshots are far apart
+                queue.extend(child for child in subdirectories if child not in index.entries)
+        return index
+
+    def get_paths(self, inode_no):
+        if self._parents is None:
+            self._parents = {}
+            for directory, entries in self.entries.items():
+                for name, child in entries.items():
+                    self._parents.setdefault(child, []).append((directory, name))
+        if inode_no == SpecialInode.ROOT_DIRECTORY:
+            return ["/"]
+        paths = []
+        for directory, name in self._parents.get(inode_no, ()):
+            # Up to the root (directories have a single parent)
+            components = [name]
+            seen = {inode_no}
+            while directory != SpecialInode.ROOT_DIRECTORY:
+                parents = self._parents.get(directory)
+                if not parents or directory in seen:
+                    break  # Detached (or looping) directory
+                seen.add(directory)
+                directory, parent_name = parents[0]
+                components.append(parent_name)
+            else:
+                paths.append("/" + "/".join(reversed(components)))
+        return paths
+
+    # Persistence
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, self.uuid, len(self.entries)))
+            for directory, entries in self.entries.items():
+                f.write(_INDEX_DIRECTORY.pack(directory, len(entries)))
+                for name, child in entries.items():
+                    encoded = name.encode('utf-8')
+                    f.write(_INDEX_ENTRY.pack(child, len(encoded)) + encoded)
+
+    @classmethod
+    def load(cls, path, filesystem=None):
+        """Load an index saved by `save()`.  If `filesystem` is given, check
+        the index was built from it."""
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, uuid, n = _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError(f"{path}: not a dentry index")
+        if filesystem is not None and uuid != bytes(filesystem.UUID):
+            raise ValueError(f"{path}: dentry index of another file system")
+        index = cls(uuid)
+        pos = _INDEX_HEADER.size
+        for _ in range(n):
+            directory, n_entries = _INDEX_DIRECTORY.unpack_from(data, pos)
+            pos += _INDEX_DIRECTORY.size
+            entries = {}
+            for _ in range(n_entries):
+                child, name_len = _INDEX_ENTRY.unpack_from(data, pos)
+                pos += _INDEX_ENTRY.size
+                entries[data[pos:pos + name_len].decode('utf-8')] = child
+                pos += name_len
+            index.entries[directory] = entries
+        return index
+
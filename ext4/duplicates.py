@@ -0,0 +1,145 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Files with identical content (candidates for deduplication), found
+without reading every file in full:
+
+1. regular files are grouped by size (hard links count once);
+2. files sharing all their extents (reflinks) have the same content: only
+   one of them is read;
+3. groups are split by a digest of the first and last blocks of the files,
+   read in physical block order by a pool of threads;
+4. only then, groups are split by a digest of the whole content (see
+   `ext4.hash`).
+
+    for group in filesystem.find_duplicates("/"):
+        print(group.wasted_bytes, [copy[0].path for copy in group.copies])
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+
+from . import logger
+from .files import Directory, InlineFileContent, RegularFile
+from .hash import hash_files
+from .tools import bounded_map
+
+
+class DuplicateGroup:
+    """Files of `size` bytes with identical content.  `copies` are lists of
+    files: the files of a list share their extents (one copy on disk), the
+    lists do not.  `digest` is the digest of the content, if computed."""
+
+    def __init__(self, size, copies, digest=None):
+        self.size = size
+        self.copies = copies
+        self.digest = digest
+
+    @property
+    def wasted_bytes(self):
+        """Bytes that deduplication would free"""
+        return self.size * (len(self.copies) - 1)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}<{len(self.copies)} copies of {self.size} bytes>"
+
+
+def _extent_signature(file):
+    """Key equal for files with the same block mapping, or None"""
+    content = file.content
+    if isinstance(content, InlineFileContent):
+        return None
+    extent_map = content.get_extent_map()
+    return (extent_map.logical.tobytes(), extent_map.physical.tobytes(), extent_map.length.tobytes(),
+            extent_map.initialized.tobytes())
+
+
+def _sample_digest(file, algorithm):
+    """Digest of the first and last blocks of `file`, and whether they are
+    the whole content"""
+    block_size = file.filesystem.conf.get_block_size()
+    size = file.inode.get_size()
+    h = hashlib.new(algorithm)
+    if size <= 2 * block_size:
+        h.update(file.content.get_bytes())
+        return h.hexdigest(), True
+    h.update(file.content.get_bytes(0, block_size))
+    h.update(file.content.get_bytes(size - block_size, size))
+    return h.hexdigest(), False
+
+
+def _split(groups, keys):
+    """Split each group (a list of copies) by the key of its copies"""
+    result = []
+    for group in groups:
+        by_key = collections.defaultdict(list)
+        for copy in group:
+            by_key[keys[copy[0].inode_no]].append(copy)
+        result.extend(subgroup for subgroup in by_key.values() if len(subgroup) > 1)
+    return result
+
+
+def find_duplicates(filesystem, path="/", min_size=1, algorithm="sha256", workers=8):
+    """Groups of regular files under `path`, of at least `min_size` bytes,
+    with identical content, as `DuplicateGroup`s (most wasted space
+    first).  See `Filesystem.find_duplicates()`."""
+    root = filesystem.get_file(path)
+    files = root.walk() if isinstance(root, Directory) else [root]
+    # By size, one file per inode
+    by_size = collections.defaultdict(dict)
+    for file in files:
+        if isinstance(file, RegularFile) and file.inode.get_size() >= min_size:
+            by_size[file.inode.get_size()].setdefault(file.inode_no, file)
+    groups = []
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+        # Reflinked files are one copy
+        copies = collections.defaultdict(list)
+        for file in same_size.values():
+            signature = _extent_signature(file)
+            copies[signature if signature is not None else file.inode_no].append(file)
+        if len(copies) > 1:
+            groups.append(list(copies.values()))
+    logger.info("%d groups of files of the same size (%d copies)", len(groups), sum(map(len, groups)))
+
+    # First and last blocks
+    to_sample = sorted((copy[0] for group in groups for copy in group),
+                       key=lambda file: file.content.get_physical_start())
+    keys, complete = {}, set()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        samples = bounded_map(pool, lambda file: (file, _sample_digest(file, algorithm)), to_sample, 4 * workers)
+        for file, (digest, whole) in samples:
+            keys[file.inode_no] = digest
+            if whole:
+                complete.add(file.inode_no)
+    groups = _split(groups, keys)
+    logger.info("%d groups left after sampling (%d copies)", len(groups), sum(map(len, groups)))
+
+    # Whole content, for the groups not fully read yet
+    to_hash = sorted((copy[0] for group in groups for copy in group if copy[0].inode_no not in complete),
+                     key=lambda file: file.content.get_physical_start())
+    for file, digest in hash_files(filesystem, to_hash, algorithm, workers):
+        keys[file.inode_no] = digest
+    groups = _split(groups, keys)
+    logger.info("%d groups of duplicates (%d files fully read)", len(groups), len(to_hash))
+
+    result = [DuplicateGroup(group[0][0].inode.get_size(), group, keys[group[0][0].inode_no]) for group in groups]
+    result.sort(key=lambda group: group.wasted_bytes, reverse=True)
+    return result
@@ -16,16 +16,20 @@
 # License along with ext4-reader.  If not, see
 # <https://www.gnu.org/licenses/>.
 
-import enum
-import functools
+import mmap
 import os
+import threading
+import time
 
 from ext4.files import Directory, File
 from .data_structures import \
     Superblock, BlockGroupDescriptor, BlockGroupDescriptor64, Inode
+from .stats import Stats
+from .tools import IntConstants, LRUCache
+from .xattr import XattrBlockCache
 
 
-class SpecialInode(enum.IntEnum):
+class SpecialInode(IntConstants):
     NULL = 0
     DEFECTIVE_BLOCKS = 1
     ROOT_DIRECTORY = 2
@@ -40,38 +44,182 @@ class SpecialInode(enum.IntEnum):
     FIRST_NON_REVERSED = 11
 
 
+class _Readahead:
+    """Detect sequential block accesses, and size the next read accordingly.
+    The window doubles on each sequential miss, up to `max_window` blocks,
+    and falls back to one block on a random access."""
+
+    def __init__(self, max_window):
+        self.max_window = max_window
+        self._next = None
+        self._window = 1
+
+    def get_window(self, index):
+        if index == self._next:
+            self._window = min(self._window * 2, self.max_window)
+        else:
+            self._window = 1
+        self._next = index + self._window
+        return self._window
+
+
 class Filesystem:
     fail_on_wrong_checksum = True
+    extent_map_cache_size = 1024  # Number of inodes
+    block_cache_size = 4096  # Number of blocks
+    xattr_block_cache_size = 1024  # Number of extended attribute blocks
+    block_group_desc_cache_size = 32  # Number of descriptors (128B each)
+    readahead_max_window = 32  # Number of blocks
+
+    # O_DIRECT transfers must be aligned (offset, length and buffer) on the
+    # logical block size of the device: a page is a safe bet.
+    direct_io_alignment = mmap.PAGESIZE
+
+    def __init__(self, block_device, direct_io=False, offset=0, length=None, pool=None, replay_journal=True):
+        """`direct_io` opens the device with O_DIRECT, bypassing the page
+        cache: the block cache is then the only cache.
+
+        The file system lies in the `length` bytes (up to the end if None)
+        from byte `offset` of `block_device`, e.g. a partition of a whole
+        disk image (see `ext4.partitions`).
 
-    def __init__(self, block_device):
-        self.block_device = block_device
+        Compressed images (seekable zstd, gzip) are read in place, see
+        `ext4.compressed` (not with `direct_io`), and images served over
+        HTTP (`block_device` being an URL), see `ext4.http_image`.
+
+        `pool` is a `ext4.pool.CachePool` holding the caches, shared with
+        other file systems.
+
+        If the file system was not cleanly unmounted, the blocks of the
+        committed transactions of its journal are read instead of their
+        on-disk copies (the image is left untouched), unless
+        `replay_journal` is false.  See `ext4.journal`."""
+        self.block_device = os.fsdecode(block_device)  # Also given as a path-like or bytes
+        self.direct_io = direct_io
+        self.offset = offset
+        self.length = length
+        self.replay_journal = replay_journal
+        self.journal = None  # Overlay of the replayed journal, see ext4.journal
+        self._direct_io_buffers = threading.local()
+        self.image = None  # Reader of a compressed image
+        self.stats: Stats | None = None  # Set to a Stats instance to enable instrumentation
         self.fd = ...
         self.conf: Superblock = ...
+        self.pool = pool
+        self.block_hint = None  # See CachePool.open()
+        if pool is None:
+            self.extent_map_cache = LRUCache(self.extent_map_cache_size)
+            self.block_cache = LRUCache(self.block_cache_size)
+        else:
+            self.extent_map_cache = pool.cache("extent_map", lambda extent_map: 100 + 25 * len(extent_map))
+            self.block_cache = pool.block_cache(self)
+        self.xattr_block_cache = XattrBlockCache(self.xattr_block_cache_size)
+        self.block_group_desc_cache = LRUCache(self.block_group_desc_cache_size)
+        self._readahead = _Readahead(self.readahead_max_window)
 
     def __enter__(self):
-        self.fd = os.open(self.block_device, os.O_RDONLY)
+        if self.block_device.startswith(("http://", "https://")):
+            from .http_image import HttpImage
+            self.fd = None
+            self.image = HttpImage(self.block_device)
+            self.image.stats = self.stats
+            return self._read_superblock()
+        flags = os.O_RDONLY
+        if self.direct_io:
+            if not hasattr(os, 'O_DIRECT'):
+                raise NotImplementedError("O_DIRECT is not supported on this platform")
+            flags |= os.O_DIRECT
+        self.fd = os.open(self.block_device, flags)
+        # Skip the import for usual images, which start with zeroed padding
+        if not self.direct_io and any(os.pread(self.fd, 4, 0)):
+            from .compressed import open_image
+            self.image = open_image(self.block_device, self.fd)
+            if self.image is not None:
+                self.image.stats = self.stats
+        return self._read_superblock()
+
+    def _read_superblock(self):
         # 1024s hardcoded here, because we do not know anything about the filesystem currently
         superblock = self.get_bytes(0x400, 1024)
         self.conf = Superblock(self).read_bytes(superblock)
+        if self.stats is not None:
+            self.stats.count("parsed.Superblock")
+        if self.replay_journal and self.journal is None \
+                and self.conf.has_flag(Superblock.FeatureIncompat.INCOMPAT_RECOVER):
+            self._replay_journal()
         return self
 
+    def _replay_journal(self):
+        from .journal import Journal
+        self.journal = Journal.read(self)
+        if not self.journal:
+            return
+        # What was read to find the journal may be stale
+        self.block_group_desc_cache.clear()
+        for block_no, block in self.journal.blocks.items():
+            if block_no in self.block_cache:
+                self.block_cache.put(block_no, block)
+        self._read_superblock()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        os.close(self.fd)
+        if self.image is not None:
+            self.image.close()
+        if self.fd is not None:
+            os.close(self.fd)
 
     @property
     def UUID(self):
         return self.conf.s_uuid
 
     def get_bytes(self, offset, length):
+        if self.stats is not None:
+            start = time.perf_counter_ns()
+            b = self._get_bytes(offset, length)
+            self.stats.record_read(offset, len(b), time.perf_counter_ns() - start)
+            return b
+        return self._get_bytes(offset, length)
+
+    def _get_bytes(self, offset, length):
+        if self.journal:
+            return self.journal.patch(offset, self._get_image_bytes(offset, length))
+        return self._get_image_bytes(offset, length)
+
+    def _get_image_bytes(self, offset, length):
+        # Translate into the window of the file system
+        if self.length is not None:
+            length = max(0, min(length, self.length - offset))
+        offset += self.offset
+        # Positional read: no shared file offset, so safe to call from several threads
         try:
-            os.lseek(self.fd, offset, os.SEEK_SET)
+            if self.image is not None:
+                b = self.image.pread(length, offset)
+            elif self.direct_io:
+                b = self._get_bytes_direct(offset, length)
+            else:
+                b = os.pread(self.fd, length, offset)
         except OSError as ose:
             if ose.errno == 22:
-                ose.strerror += f" (fd={self.fd}, offset={offset}, whence=SEEK_SET)"
+                ose.strerror += f" (fd={self.fd}, offset={offset}, length={length})"
             raise ose
-        b = os.read(self.fd, length)
         return b
 
+    def _get_bytes_direct(self, offset, length):
+        """Read through an aligned buffer, extending the range to aligned
+        bounds.  Buffers are allocated with mmap (hence page-aligned) and
+        reused by each thread."""
+        alignment = self.direct_io_alignment
+        start = offset - offset % alignment
+        end = -(-(offset + length) // alignment) * alignment
+        buffer = getattr(self._direct_io_buffers, 'buffer', None)
+        if buffer is None or len(buffer) < end - start:
+            if buffer is not None:
+                buffer.close()
+            buffer = mmap.mmap(-1, end - start)
+            self._direct_io_buffers.buffer = buffer
+        with memoryview(buffer) as view:
+            n = os.preadv(self.fd, [view[:end - start]], start)
+            return bytes(view[offset - start:min(offset - start + length, n)])
+
     def has_superblock(self, bg_no):
         # See https://stackoverflow.com/questions/1804311/how-to-check-if-an-integer-is-a-power-of-3
         # for power of {3, 5, 7} checks
@@ -82,17 +230,55 @@ class Filesystem:
                or (7 ** 11 % bg_no == 0)
 
     def get_block(self, index, n=1):
-        return self.get_bytes(index * self.conf.get_block_size(), n * self.conf.get_block_size())
+        """Read `n` blocks.  Single blocks go through the block cache, where
+        sequential misses trigger a growing readahead."""
+        block_size = self.conf.get_block_size()
+        if n != 1:
+            return self.get_bytes(index * block_size, n * block_size)
+        try:
+            block = self.block_cache.get(index)
+        except KeyError:
+            pass
+        else:
+            if self.stats is not None:
+                self.stats.count("block_cache.hits")
+            return block
+        if self.stats is not None:
+            self.stats.count("block_cache.misses")
+        window = self._readahead.get_window(index)
+        data = self.get_bytes(index * block_size, window * block_size)
+        for i in range(len(data) // block_size):
+            self.block_cache.put(index + i, data[i * block_size:(i + 1) * block_size])
+        return data[:block_size]
+
+    def _get_metadata_bytes(self, pos, length):
+        """Read a structure lying within one block, through the block cache"""
+        block_size = self.conf.get_block_size()
+        offset_in_block = pos % block_size
+        return self.get_block(pos // block_size)[offset_in_block:offset_in_block + length]
+
+    def advise(self, index, n, advice):
+        """Hint the kernel about the coming accesses to `n` blocks from
+        `index` (0 for up to the end).  `advice` is one of "normal",
+        "sequential", "random", "willneed", "dontneed" or "noreuse".  No-op
+        where `posix_fadvise()` is not available."""
+        if not hasattr(os, 'posix_fadvise') or self.direct_io or self.image is not None:
+            return
+        block_size = self.conf.get_block_size()
+        os.posix_fadvise(self.fd, self.offset + index * block_size, n * block_size,
+                         getattr(os, 'POSIX_FADV_' + advice.upper()))
 
-    @functools.lru_cache(32)  # 128B per entry
     def get_block_group_desc(self, bg_no) -> BlockGroupDescriptor:
+        return self.block_group_desc_cache.get(bg_no, lambda: self._read_block_group_desc(bg_no))
+
+    def _read_block_group_desc(self, bg_no):
         # Compute block group position
         bgd_size = self.conf.s_desc_size if self.conf.has_flag(self.conf.FeatureIncompat.INCOMPAT_64BIT) else 32
         bgd_per_block = self.conf.get_block_size() // bgd_size
         if self.conf.has_flag(Superblock.FeatureRoCompat.RO_COMPAT_SPARSE_SUPER):
             # All block groups descriptors are in block group 0
             superblock_size = 1
-            block_no = superblock_size + (bg_no // bgd_per_block)
+            block_no = self.conf.s_first_data_block + superblock_size + (bg_no // bgd_per_block)
             offset_in_block = bg_no % bgd_per_block * bgd_size
         elif self.conf.has_flag(Superblock.FeatureIncompat.INCOMPAT_FLEX_BG):
             # Block group descriptors are in first block group of the flex
@@ -107,12 +293,14 @@ class Filesystem:
             raise NotImplementedError
         bgd_pos = block_no * self.conf.get_block_size() + offset_in_block
         # Retrieve and parse data
+        if self.stats is not None:
+            self.stats.count("parsed.BlockGroupDescriptor")
         if self.conf.has_flag(Superblock.FeatureIncompat.INCOMPAT_64BIT):
             return BlockGroupDescriptor64(self, bg_no, bgd_pos) \
-                .read_bytes(self.get_bytes(bgd_pos, 64))
+                .read_bytes(self._get_metadata_bytes(bgd_pos, 64))
         else:
             return BlockGroupDescriptor(self, bg_no, bgd_pos) \
-                .read_bytes(self.get_bytes(bgd_pos, 32))
+                .read_bytes(self._get_metadata_bytes(bgd_pos, 32))
 
     def get_inode(self, inode_no) -> Inode:
         # Compute inode position
@@ -121,10 +309,20 @@ class Filesystem:
         inode_index = (inode_no - 1) % self.conf.s_inodes_per_group
         inode_pos = bgd.get_inode_table_loc() * self.conf.get_block_size() + self.conf.s_inode_size * inode_index
         # Retrieve and parse data
-        struct_data = self.get_bytes(inode_pos, self.conf.s_inode_size)
+        struct_data = self._get_metadata_bytes(inode_pos, self.conf.s_inode_size)
+        if self.pool is not None:
+            return self.pool.get_inode(self, inode_no, inode_pos, struct_data)
         inode = Inode(self, inode_no, inode_pos).read_bytes(struct_data)
+        if self.stats is not None:
+            self.stats.count("parsed.Inode")
         return inode
 
+    def stat_many(self, inode_nos):
+        """Stat fields of the inodes `inode_nos`, decoded in bulk, as a
+        `StatTable` (in the same order)"""
+        from .inode_table import read_stats
+        return read_stats(self, inode_nos)
+
     def get_file(self, path) -> File:
         if not path.startswith("/"):
             raise ValueError("Path must be absolute")
@@ -136,3 +334,62 @@ class Filesystem:
 
     def get_root_dir(self) -> Directory:
         return Directory(self, "/", SpecialInode.ROOT_DIRECTORY, self.get_inode(SpecialInode.ROOT_DIRECTORY))
+
+    def build_block_map(self):
+        """Reverse block map of the whole file system: see `ext4.block_map.BlockMap`"""
+        from .block_map import BlockMap
+        return BlockMap.build(self)
+
+    def grep(self, pattern, path="/", ignore_case=False, fixed_strings=False, max_size=None,
+             files_with_matches=False, workers=None):
+        """Yield (path, offset, line) for the lines matching `pattern` (a
+        regular expression, or a string if `fixed_strings`, as str or bytes)
+        in the regular files under `path`, of at most `max_size` bytes.
+        With `files_with_matches`, only the first match of each file.
+        Files are searched by `workers` processes (one per CPU if None).
+        See `ext4.grep`."""
+        from .grep import grep
+        return grep(self, pattern, path, ignore_case=ignore_case, fixed_strings=fixed_strings, max_size=max_size,
+                    files_with_matches=files_with_matches, workers=workers)
+
+    def find_duplicates(self, path="/", min_size=1, algorithm="sha256", workers=8):
+        """Groups of regular files under `path` with identical content, most
+        wasted space first.  Files are compared by size, then by their first
+        and last blocks, and only then read in full: see
+        `ext4.duplicates`.  Shared extents are found by
+        `build_block_map().shared_runs()`."""
+        from .duplicates import find_duplicates
+        return find_duplicates(self, path, min_size=min_size, algorithm=algorithm, workers=workers)
+
+    def diff(self, other, index=None):
+        """Changes from this file system to `other`, a later snapshot of it:
+        see `ext4.diff.diff()`"""
+        from .diff import diff
+        return diff(self, other, index)
+
+    def hash_tree(self, path="/", algorithm="sha256", workers=8, max_in_flight=64 * 1024 * 1024):
+        """Yield (file, hex digest) for the regular files under `path`, in
+        physical block order.  Reads are pipelined with the hashing, by
+        `workers` threads, with at most `max_in_flight` bytes read ahead.
+        See `ext4.hash`."""
+        from .hash import hash_tree
+        return hash_tree(self, path, algorithm=algorithm, workers=workers, max_in_flight=max_in_flight)
+
+    def timeline(self, sort_buffer=1000000, tmpdir=None):
+        """Yield (seconds, nanoseconds, flags, inode number) for the access,
+        modification, change and creation times of all the allocated
+        inodes, sorted by time; `flags` tells which of these times it is.
+        Beyond `sort_buffer` events, the sort spills to temporary files (in
+        `tmpdir`).  See `ext4.timeline`."""
+        from .timeline import timeline
+        return timeline(self, sort_buffer=sort_buffer, tmpdir=tmpdir)
+
+    def extract(self, src, dst, tar=False, workers=8):
+        """Copy the subtree at path `src` out of the filesystem.
+
+        `dst` is a local directory path, or (if `tar` is set) a path or a
+        writable binary stream receiving an uncompressed tar stream (a
+        directory `src` is its member ".", the other members are named
+        relative to it)."""
+        from .extract import extract
+        extract(self, src, dst, tar=tar, workers=workers)
@@ -0,0 +1,182 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Bulk copy of a subtree out of the filesystem, to a local directory or to
+a tar stream.
+
+Metadata are collected first by a breadth-first walk.  File contents are
+then read in physical block order by a pool of threads, so that the device
+is scanned (mostly) forward."""
+
+import concurrent.futures
+import io
+import os
+import tarfile
+
+from . import logger
+from .files import Directory, RegularFile, SymbolicLink
+from .tools import bounded_map, relative_path
+
+# In tar mode, files up to this size are read ahead by the thread pool.
+# Bigger ones are streamed by the writing thread.
+_PREFETCH_MAX_SIZE = 1024 * 1024
+
+
+class _ContentReader(io.RawIOBase):
+    """Read-only stream over a file content, fed by `FileContent.iter_bytes()`"""
+
+    def __init__(self, content):
+        super().__init__()
+        self._chunks = content.iter_bytes()
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _collect(root):
+    """Walk the tree and sort files.  Return directories (in breadth-first
+    order), symbolic links, and regular files (in physical block order)."""
+    directories, symlinks, regular_files = [], [], []
+    for file in root.walk():
+        if isinstance(file, Directory):
+            directories.append(file)
+        elif isinstance(file, SymbolicLink):
+            symlinks.append(file)
+        elif isinstance(file, RegularFile):
+            regular_files.append(file)
+    regular_files.sort(key=lambda file: file.content.get_physical_start())
+    return directories, symlinks, regular_files
+
+
+def _copy_file(file, local_path):
+    # Holes are not written, so that the local copy is sparse too
+    with open(local_path, "wb") as f:
+        for offset, chunk in file.content.iter_data():
+            f.seek(offset)
+            f.write(chunk)
+        f.truncate(file.inode.get_size())
+    # Copied data will not be read again: do not let it evict the page cache
+    file.content.advise("dontneed")
+    _set_metadata(file, local_path)
+
+
+def _set_metadata(file, local_path):
+    stat = file.get_stat()
+    if not isinstance(file, SymbolicLink):
+        os.chmod(local_path, file.inode.get_mode())
+        os.utime(local_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    elif os.utime in os.supports_follow_symlinks:
+        os.utime(local_path, ns=(stat.st_atime_ns, stat.st_mtime_ns), follow_symlinks=False)
+
+
+def _extract_to_directory(root, dst, workers):
+    if not isinstance(root, Directory):
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, root.filename)
+        _copy_file(root, dst)
+        return
+    directories, symlinks, regular_files = _collect(root)
+    os.makedirs(dst, exist_ok=True)
+    for directory in directories:
+        os.makedirs(os.path.join(dst, relative_path(root, directory)), exist_ok=True)
+    for symlink in symlinks:
+        local_path = os.path.join(dst, relative_path(root, symlink))
+        os.symlink(symlink.get_target(), local_path)
+        _set_metadata(symlink, local_path)
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        copies = bounded_map(pool, lambda file: _copy_file(file, os.path.join(dst, relative_path(root, file))),
+                             regular_files, 4 * workers)
+        for _ in copies:
+            pass
+    # Directories last (deepest first), as creating their content changed their mtime
+    for directory in reversed(directories):
+        _set_metadata(directory, os.path.join(dst, relative_path(root, directory)))
+    _set_metadata(root, dst)
+    logger.info("Extracted %d directories, %d symbolic links and %d regular files",
+                len(directories), len(symlinks), len(regular_files))
+
+
+def _tar_info(file, name):
+    info = tarfile.TarInfo(name)
+    stat = file.get_stat()
+    info.mode = file.inode.get_mode()
+    info.uid = stat.st_uid
+    info.gid = stat.st_gid
+    info.mtime = stat.st_mtime
+    if isinstance(file, Directory):
+        info.type = tarfile.DIRTYPE
+    elif isinstance(file, SymbolicLink):
+        info.type = tarfile.SYMTYPE
+        info.linkname = file.get_target()
+    else:
+        info.type = tarfile.REGTYPE
+        info.size = stat.st_size
+    return info
+
+
+def _prefetch(file):
+    if file.inode.get_size() > _PREFETCH_MAX_SIZE:
+        return file, None
+    data = b"".join(file.content.iter_bytes())
+    file.content.advise("dontneed")
+    return file, data
+
+
+def _extract_to_tar(root, dst, workers):
+    if isinstance(dst, (str, bytes, os.PathLike)):
+        tar = tarfile.open(name=dst, mode="w|", format=tarfile.PAX_FORMAT)
+    else:
+        tar = tarfile.open(fileobj=dst, mode="w|", format=tarfile.PAX_FORMAT)
+    with tar:
+        if not isinstance(root, Directory):
+            tar.addfile(_tar_info(root, root.filename), io.BufferedReader(_ContentReader(root.content)))
+            return
+        directories, symlinks, regular_files = _collect(root)
+        # Members are named relative to the root, itself "." (as with `tar -C <root> -c .`)
+        tar.addfile(_tar_info(root, "."))
+        for file in directories + symlinks:
+            tar.addfile(_tar_info(file, relative_path(root, file)))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for file, data in bounded_map(pool, _prefetch, regular_files, 4 * workers):
+                fileobj = io.BytesIO(data) if data is not None \
+                    else io.BufferedReader(_ContentReader(file.content))
+                tar.addfile(_tar_info(file, relative_path(root, file)), fileobj)
+                if data is None:
+                    file.content.advise("dontneed")
+
+
+def extract(filesystem, src, dst, tar=False, workers=8):
+    """Copy the file or directory at path `src` to `dst`.  See `Filesystem.extract()`."""
+    root = filesystem.get_file(src)
+    filesystem.advise(0, 0, "sequential")
+    if tar:
+        _extract_to_tar(root, dst, workers)
+    else:
+        _extract_to_directory(root, dst, workers)
@@ -17,14 +17,28 @@
 # <https://www.gnu.org/licenses/>.
 
 import abc
-from typing import Optional, Iterator
-
-from . import logger
+import array
+import bisect
+import collections
+import ctypes
+import errno
+import functools
+import itertools
+import struct
+from collections.abc import Iterator
+
+from . import logger, tools
 from .data_structures import \
     Inode, ExtentHeader, ExtentIdx, Extent, \
-    DirEntry, DirEntry2, Superblock, DxRoot
+    DirEntry, DirEntry2, Superblock
 from .tools import FSException
 
+# File type of directory entries, by file type bits of the inode mode
+_DIRENT_FILE_TYPES = {0x1: DirEntry2.FileType.FIFO, 0x2: DirEntry2.FileType.CHARACTER_DEVICE_FILE,
+                      0x4: DirEntry2.FileType.DIRECTORY, 0x6: DirEntry2.FileType.BLOCK_DEVICE_FILE,
+                      0x8: DirEntry2.FileType.REGULAR_FILE, 0xA: DirEntry2.FileType.SYMBOLIC_LINK,
+                      0xC: DirEntry2.FileType.SOCKET}
+
 
 class File:
     __metaclass__ = abc.ABCMeta
@@ -58,9 +72,12 @@ class File:
         self.path = path
         self.inode_no = inode_no
         self.inode = inode
-        self.content = FileContent(self.filesystem, inode)
         logger.info("Open file \"%s\" (inode %d, is a %s)", path, inode_no, self.__class__.__name__)
 
+    @functools.cached_property
+    def content(self):
+        return FileContent(self.filesystem, self.inode)
+
     def get_file_type(self):
         return self.inode.get_file_type()
 
@@ -94,6 +111,12 @@ class File:
         ))
         return stat
 
+    def get_xattrs(self):
+        """Extended attributes, as a {name: value} dict.  Those stored in the
+        inode come first; external blocks are cached, as they are shared."""
+        from .xattr import get_xattrs
+        return get_xattrs(self.filesystem, self.inode)
+
     def __repr__(self):
         return f"{self.__class__.__name__}<[{self.inode_no}]:{self.path}>"
 
@@ -116,7 +139,9 @@ class Directory(File):
     def __new__(cls, filesystem, path, inode_no, inode):
         if cls is Directory:
             # Build a subclass of this abstract class
-            if inode.i_flags & inode.Flags.INDEX != 0:
+            if inode.i_flags & inode.Flags.INLINE_DATA != 0:
+                return InlineDirectory.__new__(InlineDirectory, filesystem, path, inode_no, inode)
+            elif inode.i_flags & inode.Flags.INDEX != 0:
                 return HashTreeDirectory.__new__(HashTreeDirectory, filesystem, path, inode_no, inode)
             else:
                 return LinearDirectory.__new__(LinearDirectory, filesystem, path, inode_no, inode)
@@ -128,6 +153,29 @@ class Directory(File):
     def _get_direntries(self) -> Iterator[DirEntry]:
         raise NotImplementedError
 
+    def _read_block_direntries(self, block) -> Iterator[DirEntry]:
+        """Entries of a directory block.  Unused entries (inode 0, like
+        deleted entries or checksum tails) are skipped."""
+        if self.filesystem.pool is not None:
+            return iter(self.filesystem.pool.get_direntries(
+                self.filesystem, block, lambda: list(self._parse_block_direntries(block))))
+        return self._parse_block_direntries(block)
+
+    def _parse_block_direntries(self, block) -> Iterator[DirEntry]:
+        dir_entry_klass = DirEntry2 if self.filesystem.conf.has_flag(
+            Superblock.FeatureIncompat.INCOMPAT_FILETYPE) else DirEntry
+        i = 0
+        while i < len(block):
+            de = dir_entry_klass().read_bytes(block[i:])
+            if de.rec_len == 0:
+                break  # Corrupted entry, do not loop forever
+            i += de.rec_len
+            if de.inode == 0:
+                continue
+            if self.filesystem.stats is not None:
+                self.filesystem.stats.count("parsed.DirEntry")
+            yield de
+
     def get_files(self) -> [File]:
         for direntry in self._get_direntries():
             full_path = "/".join((self.path, direntry.get_name())) if not self.path.endswith("/") \
@@ -137,11 +185,55 @@ class Directory(File):
             file = File(self.filesystem, full_path, inode_no, inode)
             yield file
 
-    def _get_direct_subfile(self, path) -> Optional[File]:
+    def stat_all(self):
+        """Stat fields of all entries (like `get_files()`, so with `.` and
+        `..`), as a `StatTable` whose `names` are the entry names.  Much
+        faster than `get_stat()` on each file."""
+        names, inode_nos = [], []
+        for direntry in self._get_direntries():
+            names.append(direntry.get_name())
+            inode_nos.append(direntry.inode)
+        table = self.filesystem.stat_many(inode_nos)
+        table.names = names
+        return table
+
+    def walk(self, types=None) -> Iterator[File]:
+        """Breadth-first iteration over all files below this directory.
+
+        `.` and `..` entries are skipped, as well as the files whose type is
+        not supported.  If `types` is given (`DirEntry2.FileType` values),
+        the files of other types are skipped too, without reading their
+        inode when the directory entries tell their type (subdirectories
+        are walked anyway)."""
+        queue = collections.deque([self])
+        while queue:
+            directory = queue.popleft()
+            for direntry in directory._get_direntries():
+                name = direntry.get_name()
+                if name in (".", ".."):
+                    continue
+                file_type = getattr(direntry, "file_type", DirEntry2.FileType.UNKNOWN)
+                if types is not None and file_type not in types \
+                        and file_type not in (DirEntry2.FileType.DIRECTORY, DirEntry2.FileType.UNKNOWN):
+                    continue
+                full_path = "/".join((directory.path, name)) if not directory.path.endswith("/") \
+                    else directory.path + name
+                inode = self.filesystem.get_inode(direntry.inode)
+                try:
+                    file = File(self.filesystem, full_path, direntry.inode, inode)
+                except NotImplementedError:
+                    logger.warning("Skip \"%s\": unsupported file type", full_path)
+                    continue
+                if types is None or _DIRENT_FILE_TYPES.get(inode.i_mode >> 12) in types:
+                    yield file
+                if isinstance(file, Directory):
+                    queue.append(file)
+
+    def _get_direct_subfile(self, path) -> File | None:
         """Non-recursive version of `get_file()`."""
         for direntry in self._get_direntries():
             if direntry.get_name() == path:
-                full_path = "/".join((self.path, path))
+                full_path = "/".join((self.path, path)) if not self.path.endswith("/") else self.path + path
                 inode_no = direntry.inode
                 inode = self.filesystem.get_inode(inode_no)
                 return File(self.filesystem, full_path, inode_no, inode)
@@ -171,40 +263,36 @@ class Directory(File):
 
 class LinearDirectory(Directory):
     def _get_direntries(self) -> [DirEntry]:
-        dir_entry_klass = DirEntry2 if self.filesystem.conf.has_flag(
-            Superblock.FeatureIncompat.INCOMPAT_FILETYPE) else DirEntry
         for block in self.content.get_blocks():
-            i = 0
-            while i < 4096:
-                de = dir_entry_klass().read_bytes(block[i:])
-                if de.inode == 0:
-                    # End of the entry
-                    break
-                yield de
-                i += de.rec_len
+            yield from self._read_block_direntries(block)
+
+
+class InlineDirectory(Directory):
+    """Directory stored in its inode: `i_block` holds the parent inode
+    number then entries, continued by the "system.data" extended attribute.
+    There are no `.` and `..` entries: they are synthesized."""
+
+    def _get_direntries(self) -> Iterator[DirEntry]:
+        data = self.inode.get_inline_data()
+        parent = int.from_bytes(data[:4], 'little')
+        file_type = DirEntry2.FileType.DIRECTORY if self.filesystem.conf.has_flag(
+            Superblock.FeatureIncompat.INCOMPAT_FILETYPE) else 0
+        dots = struct.pack("<IHBB4s", self.inode_no, 12, 1, file_type, b".") \
+            + struct.pack("<IHBB4s", parent, 12, 2, file_type, b"..")
+        yield from self._read_block_direntries(dots)
+        i_block_size = ctypes.sizeof(self.inode.i_block)
+        yield from self._read_block_direntries(data[4:i_block_size])
+        yield from self._read_block_direntries(data[i_block_size:])
 
 
 class HashTreeDirectory(Directory):
     def _get_direntries(self) -> Iterator[DirEntry]:
-        dir_entry_klass = DirEntry2 if self.filesystem.conf.has_flag(
-            Superblock.FeatureIncompat.INCOMPAT_FILETYPE) else DirEntry
+        # The first block is the hash-tree root.  Other tree nodes are hidden
+        # in an unused DirEntry spanning the whole block, so a standard
+        # iteration over the leaves works whatever the tree depth.
         content_nos = list(self.content.get_blocks_no())
-        head = self.filesystem.get_block(content_nos[0])
-        dx_root = DxRoot().read_bytes(head)
-        if dx_root.dx_root_info.indirect_levels > 0:
-            raise NotImplementedError("Multi-levels hash directories are not supported")
-        # Standard iteration over other blocks.  Htrees parts are hidden in big (but valid) DirEntries
         for block_no in content_nos[1:]:
-            block = self.filesystem.get_block(block_no)
-            # In this block are some standards DirEntries
-            i = 0
-            while i < 4096:
-                de = dir_entry_klass().read_bytes(block[i:])
-                if de.inode == 0:
-                    # End of the entry
-                    break
-                yield de
-                i += de.rec_len
+            yield from self._read_block_direntries(self.filesystem.get_block(block_no))
 
     def _get_direct_subfile(self, path):
         # TODO: directory is index, we should use the index
@@ -239,7 +327,9 @@ class FileContent:
         if cls is FileContent:
             # Build a subclass of this abstract class
             if inode.i_flags & inode.Flags.INLINE_DATA != 0 or \
-                    inode.get_file_type() == Inode.Mode.IFLNK:
+                    (inode.i_mode & 0xF000 == Inode.Mode.IFLNK and inode.i_flags & inode.Flags.EXTENTS == 0
+                     and inode.get_size() < ctypes.sizeof(inode.i_block)):
+                # Fast symbolic links store their target into i_block
                 return InlineFileContent.__new__(InlineFileContent, filesystem, inode)
             elif inode.i_flags & inode.Flags.EXTENTS != 0:
                 return ExtentTreeFileContent.__new__(ExtentTreeFileContent, filesystem, inode)
@@ -254,69 +344,346 @@ class FileContent:
         self.inode = inode
 
     @abc.abstractmethod
-    def get_blocks_no(self) -> Iterator[int]:
+    def _decode_extents(self) -> Iterator[tuple[int, int, int, bool]]:
+        """Walk the on-disk block mapping of the inode"""
         raise NotImplementedError
 
+    def get_extent_map(self) -> "ExtentMap":
+        """Block mapping of the content.  It is decoded once per inode, and
+        shared by all the `FileContent` of that inode."""
+        stats = self.filesystem.stats
+        if stats is None:
+            return self.filesystem.extent_map_cache.get(self.inode.no, lambda: ExtentMap(self._decode_extents()))
+        try:
+            extent_map = self.filesystem.extent_map_cache.get(self.inode.no)
+        except KeyError:
+            stats.count("extent_map_cache.misses")
+            stats.count("parsed.ExtentMap")
+            extent_map = ExtentMap(self._decode_extents())
+            self.filesystem.extent_map_cache.put(self.inode.no, extent_map)
+        else:
+            stats.count("extent_map_cache.hits")
+        return extent_map
+
+    def get_extents(self) -> Iterator[tuple[int, int, int, bool]]:
+        """Mapped ranges of the content, as (logical block, physical block,
+        block count, initialized) tuples, in logical order.  Logical blocks
+        that are not covered are holes."""
+        return iter(self.get_extent_map())
+
+    def get_blocks_no(self) -> Iterator[int]:
+        """Physical numbers of the blocks holding data, in logical order.
+        Holes and unwritten extents are skipped."""
+        for logical, physical, length, initialized in self.get_extents():
+            if initialized:
+                yield from range(physical, physical + length)
+
+    def get_mapping_blocks_no(self) -> Iterator[int]:
+        """Physical numbers of the blocks holding the block mapping itself
+        (extent tree nodes or indirect blocks), outside of the inode"""
+        yield from []
+
     def get_blocks(self) -> Iterator[bytes]:
         for block_no in self.get_blocks_no():
             yield self.filesystem.get_block(block_no)
 
+    def _get_segments(self, offset=0) -> Iterator[tuple[int, int, int | None]]:
+        """Split [offset, size) into (offset, length, physical block) byte
+        ranges, the physical block being None for holes and unwritten
+        extents.  The first range starts at the block containing `offset`."""
+        block_size = self.filesystem.conf.get_block_size()
+        size = self.inode.get_size()
+        pos = offset // block_size * block_size
+        for logical, physical, length, initialized in self.get_extent_map().iter_from(offset // block_size):
+            start = logical * block_size
+            if start >= size:
+                break
+            if not initialized:
+                continue
+            if start < pos:
+                # Extent containing the starting offset
+                physical += (pos - start) // block_size
+                start = pos
+            end = min((logical + length) * block_size, size)
+            if start > pos:
+                yield pos, start - pos, None
+            yield start, end - start, physical
+            pos = end
+        if pos < size:
+            yield pos, size - pos, None
+
+    def iter_ranges(self) -> Iterator[tuple[int, int, bool]]:
+        """Split the content into (offset, length, is data) byte ranges.
+        Ranges that are not data read as zeros."""
+        for offset, length, physical in self._get_segments():
+            yield offset, length, physical is not None
+
+    def seek_data(self, offset):
+        """Smallest data offset greater or equal to `offset`, like `lseek(SEEK_DATA)`"""
+        for start, length, is_data in self.iter_ranges():
+            if is_data and offset < start + length:
+                return max(start, offset)
+        raise OSError(errno.ENXIO, "No data after offset", offset)
+
+    def seek_hole(self, offset):
+        """Smallest hole offset greater or equal to `offset`, like
+        `lseek(SEEK_HOLE)`.  The end of file is a hole."""
+        if offset > self.inode.get_size():
+            raise OSError(errno.ENXIO, "Offset beyond end of file", offset)
+        for start, length, is_data in self.iter_ranges():
+            if not is_data and offset < start + length:
+                return max(start, offset)
+        return self.inode.get_size()
+
+    def advise(self, advice):
+        """Hint the kernel about coming accesses to the data blocks.  See
+        `Filesystem.advise()`."""
+        for logical, physical, length, initialized in self.get_extents():
+            if initialized:
+                self.filesystem.advise(physical, length, advice)
+
+    def get_physical_start(self):
+        """First physical block of the content (0 if none), to sort reads by disk position"""
+        return next(iter(self.get_blocks_no()), 0)
+
+    def iter_data(self, chunk_blocks=256) -> Iterator[tuple[int, bytes]]:
+        """Yield (offset, chunk) for the data ranges of the content.  Holes
+        are skipped without any read.  Contiguous blocks are read at once,
+        by at most `chunk_blocks` blocks."""
+        block_size = self.filesystem.conf.get_block_size()
+        for offset, length, physical in self._get_segments():
+            if physical is None:
+                continue
+            if length > chunk_blocks * block_size:
+                # Let the kernel read the rest of the run while we process the first chunks
+                self.filesystem.advise(physical, -(-length // block_size), "willneed")
+            while length > 0:
+                n = min(length, chunk_blocks * block_size)
+                yield offset, self.filesystem.get_block(physical, -(-n // block_size))[:n]
+                offset += n
+                length -= n
+                physical += chunk_blocks
+
+    def iter_bytes(self, chunk_blocks=256) -> Iterator[bytes]:
+        """Yield the whole content as successive chunks, holes being
+        synthesized as zeros."""
+        max_zeros = chunk_blocks * self.filesystem.conf.get_block_size()
+        pos = 0
+        for offset, chunk in itertools.chain(self.iter_data(chunk_blocks), [(self.inode.get_size(), b"")]):
+            while pos < offset:
+                n = min(offset - pos, max_zeros)
+                yield bytes(n)
+                pos += n
+            if chunk:
+                yield chunk
+                pos += len(chunk)
+
     def get_bytes(self, start=0, end=-1):
         if end < 0:
             end = self.inode.get_size() + end + 1
-        if not (0 <= start < end <= self.inode.get_size()):
+        if not (0 <= start <= end <= self.inode.get_size()):
             raise ValueError(f"Cannot get file range between {start} and {end}")
         block_size = self.filesystem.conf.get_block_size()
-        selected_blocks_no = [b_no for b_index, b_no in enumerate(self.get_blocks_no())
-                              if start // block_size <= b_index <= end // block_size]
-        selected_blocks = [self.filesystem.get_block(block_no) for block_no in selected_blocks_no]
-        # Truncate ends
-        selected_blocks[0] = selected_blocks[0][start % block_size:]
-        selected_blocks[-1] = selected_blocks[-1][:end % block_size]
-        return b"".join(selected_blocks)
+        data = bytearray(end - start)  # Holes stay zeroed
+        for offset, length, physical in self._get_segments(start):
+            if offset >= end:
+                break
+            if physical is None or offset + length <= start:
+                continue
+            lo, hi = max(start, offset), min(end, offset + length)
+            first_block = (lo - offset) // block_size
+            last_block = (hi - 1 - offset) // block_size
+            blocks = self.filesystem.get_block(physical + first_block, last_block - first_block + 1)
+            skip = lo - offset - first_block * block_size
+            data[lo - start:hi - start] = blocks[skip:skip + hi - lo]
+        return bytes(data)
 
 
 class InlineFileContent(FileContent):
-    def get_blocks_no(self):
+    def _decode_extents(self):
         yield from []
 
+    def iter_ranges(self):
+        if self.inode.get_size() > 0:
+            yield 0, self.inode.get_size(), True
+
+    def iter_data(self, chunk_blocks=256):
+        if self.inode.get_size() > 0:
+            yield 0, self.get_bytes()
+
     def get_bytes(self, start=0, end=-1):
         if end < 0:
             end = self.inode.get_size() + end + 1
-        if not (0 <= start < end <= self.inode.get_size()):
+        if not (0 <= start <= end <= self.inode.get_size()):
             raise ValueError(f"Cannot get file range between {start} and {end}")
-        return bytes(self.inode.i_block)[start:end]
+        return self.inode.get_inline_data()[start:end]
 
 
 class DirectIndirectFileContent(FileContent):
-    def get_blocks_no(self):
-        for offset in range(12):
-            block_address = int.from_bytes(bytes(self.inode.i_block)[offset * 4:(offset + 1) * 4], 'little')
-            if block_address == 0:
+    """Block map of ext2/ext3 files: i_block holds 12 direct pointers, then
+    a single, a double and a triple indirect pointer.  Null pointers are
+    holes."""
+    N_DIRECT_BLOCKS = 12
+
+    def _decode_extents(self):
+        block_size = self.filesystem.conf.get_block_size()
+        n_blocks = -(-self.inode.get_size() // block_size)
+        i_block = tools.read_u32_array(bytes(self.inode.i_block))
+        runs = self._map_pointers(i_block[:self.N_DIRECT_BLOCKS], 0, 0, n_blocks)
+        logical = self.N_DIRECT_BLOCKS
+        for depth, pointer in enumerate(i_block[self.N_DIRECT_BLOCKS:], start=1):
+            if logical >= n_blocks:
                 break
-            else:
-                yield block_address
-        else:
-            raise NotImplementedError("Indirect block addressing is not supported")
+            runs = itertools.chain(runs, self._map_pointers([pointer], logical, depth, n_blocks))
+            logical += (block_size // 4) ** depth
+        yield from self._merge_runs(runs)
+
+    def _map_pointers(self, pointers, logical, depth, n_blocks):
+        """Yield (logical block, physical block, length) runs of data blocks
+        reachable from `pointers`, which are `depth` levels above data."""
+        if depth == 0:
+            yield from self._pointer_runs(pointers[:n_blocks - logical], logical)
+            return
+        span = (self.filesystem.conf.get_block_size() // 4) ** depth
+        for pointer in pointers:
+            if logical >= n_blocks:
+                break
+            if pointer != 0:
+                # Each pointer block is read once, and decoded as a whole
+                sub_pointers = tools.read_u32_array(self.filesystem.get_block(pointer))
+                yield from self._map_pointers(sub_pointers, logical, depth - 1, n_blocks)
+            logical += span
+
+    def get_mapping_blocks_no(self):
+        block_size = self.filesystem.conf.get_block_size()
+        n_blocks = -(-self.inode.get_size() // block_size)
+        i_block = tools.read_u32_array(bytes(self.inode.i_block))
+        logical = self.N_DIRECT_BLOCKS
+        for depth, pointer in enumerate(i_block[self.N_DIRECT_BLOCKS:], start=1):
+            if logical >= n_blocks:
+                break
+            yield from self._pointer_blocks([pointer], logical, depth, n_blocks)
+            logical += (block_size // 4) ** depth
+
+    def _pointer_blocks(self, pointers, logical, depth, n_blocks):
+        """Yield the indirect blocks reachable from `pointers`, which are
+        `depth` levels above data"""
+        span = (self.filesystem.conf.get_block_size() // 4) ** depth
+        for pointer in pointers:
+            if logical >= n_blocks:
+                break
+            if pointer != 0:
+                yield pointer
+                if depth > 1:
+                    sub_pointers = tools.read_u32_array(self.filesystem.get_block(pointer))
+                    yield from self._pointer_blocks(sub_pointers, logical, depth - 1, n_blocks)
+            logical += span
+
+    @staticmethod
+    def _pointer_runs(pointers, logical):
+        i, n = 0, len(pointers)
+        while i < n:
+            start = pointers[i]
+            if start == 0:
+                i += 1
+                continue
+            j = i + 1
+            while j < n and pointers[j] == start + j - i:
+                j += 1
+            yield logical + i, start, j - i
+            i = j
+
+    @staticmethod
+    def _merge_runs(runs):
+        """Merge runs that are adjacent both logically and physically, as extents"""
+        current = None
+        for logical, physical, length in runs:
+            if current is not None and current[0] + current[2] == logical \
+                    and current[1] + current[2] == physical:
+                current[2] += length
+                continue
+            if current is not None:
+                yield current[0], current[1], current[2], True
+            current = [logical, physical, length]
+        if current is not None:
+            yield current[0], current[1], current[2], True
 
 
 class ExtentTreeFileContent(FileContent):
-    def __init__(self, filesystem, inode):
-        super().__init__(filesystem, inode)
-        ExtentHeader(self.filesystem).read_bytes(self.inode.i_block)  # Verify checksums
-
-    def get_blocks_no(self):
-        header = ExtentHeader(self.filesystem).read_bytes(self.inode.i_block)
-        if header.eh_depth != 0:
-            # Index block locations are here
-            idx_blocks = (ExtentIdx(self.inode.i_block[i * 12:(i + 1) * 12]) for i in range(header.eh_entries))
-            raise NotImplementedError("Deep extent trees are not supported")
-        else:
-            # Data block locations are here
-            for i in range(header.eh_entries):
-                ee = Extent().read_bytes(bytes(self.inode.i_block)[(i + 1) * 12:(i + 2) * 12])
-                if ee.ee_len > 32768:
-                    raise NotImplementedError("Uninitialized extents are not supported")
-                start = ee.get_start()
-                for i_block in range(ee.ee_len):
-                    yield start + i_block
+    def _decode_extents(self):
+        yield from self._walk_extent_node(bytes(self.inode.i_block))
+
+    def _walk_extent_node(self, node):
+        header = ExtentHeader(self.filesystem).read_bytes(node)
+        if self.filesystem.stats is not None:
+            self.filesystem.stats.count("parsed.ExtentNode")
+        for i in range(header.eh_entries):
+            entry = node[(i + 1) * 12:(i + 2) * 12]
+            if header.eh_depth != 0:
+                # Index node: entries point to lower level blocks
+                idx = ExtentIdx().read_bytes(entry)
+                yield from self._walk_extent_node(self.filesystem.get_block(idx.get_leaf()))
+            else:
+                ee = Extent().read_bytes(entry)
+                yield ee.ee_block, ee.get_start(), ee.get_length(), ee.is_initialized()
+
+    def get_mapping_blocks_no(self):
+        yield from self._walk_index_node(bytes(self.inode.i_block))
+
+    def _walk_index_node(self, node):
+        header = ExtentHeader(self.filesystem).read_bytes(node)
+        if header.eh_depth == 0:
+            return
+        for i in range(header.eh_entries):
+            leaf = ExtentIdx().read_bytes(node[(i + 1) * 12:(i + 2) * 12]).get_leaf()
+            yield leaf
+            yield from self._walk_index_node(self.filesystem.get_block(leaf))
+
+
+class ExtentMap:
+    """Compact block mapping of a file: parallel arrays of logical start,
+    physical start, length and initialized flag of the extents, sorted by
+    logical start."""
+
+    def __init__(self, extents=()):
+        self.logical = array.array('Q')
+        self.physical = array.array('Q')
+        self.length = array.array('Q')
+        self.initialized = array.array('B')
+        for logical, physical, length, initialized in extents:
+            self.logical.append(logical)
+            self.physical.append(physical)
+            self.length.append(length)
+            self.initialized.append(initialized)
+
+    def __len__(self):
+        return len(self.logical)
+
+    def __getitem__(self, index):
+        return self.logical[index], self.physical[index], self.length[index], bool(self.initialized[index])
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}<{len(self)} extents>"
+
+    def find(self, block):
+        """Index of the extent containing logical `block`, or of the first
+        extent after it if `block` is in a hole"""
+        index = bisect.bisect_right(self.logical, block) - 1
+        if index < 0:
+            return 0
+        if self.logical[index] + self.length[index] <= block:
+            index += 1
+        return index
+
+    def iter_from(self, block):
+        """Iterate over extents, from the one containing logical `block`"""
+        index = self.find(block)
+        for logical, physical, length, initialized in zip(self.logical[index:], self.physical[index:],
+                                                          self.length[index:], self.initialized[index:]):
+            yield logical, physical, length, bool(initialized)
+
+    def get_block_count(self):
+        return sum(self.length)
@@ -0,0 +1,193 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Search of a pattern in the contents of files, without extracting them.
+
+Regular files are selected by the type given in their directory entry (the
+inodes of other files are not even read), then by their size.  They are
+split into batches, in physical block order, which are searched by a pool of
+processes (each one opening the file system again).
+
+The content of each file is streamed by chunks (`FileContent.iter_data()`),
+line by line like grep: the incomplete last line of a chunk is kept for the
+next one, so matches straddling chunks (hence blocks) are found.  Lines of
+more than `_MAX_LINE` bytes (binary files) are cut, with an overlap of
+`_OVERLAP` bytes, the longest match found across cuts.  Holes end lines.
+
+    for path, offset, line in filesystem.grep(rb"AKIA[0-9A-Z]{16}", "/home"):
+        ...
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import os
+import re
+
+from .data_structures import DirEntry2
+from .files import Directory, FileContent, RegularFile
+
+_MAX_LINE = 64 * 1024  # Bytes
+_OVERLAP = 4 * 1024  # Bytes
+_MAX_CONTEXT = 256  # Bytes of a line returned around a match
+_BATCH_SIZE = 16 * 1024 * 1024  # Bytes of files searched by a task
+_BATCH_FILES = 256
+
+_filesystem = None  # Of a worker process
+
+
+def compile_pattern(pattern, ignore_case=False, fixed_strings=False):
+    """Bytes to search (fixed strings, case-sensitive) or compiled regular
+    expression, for `pattern` (str, bytes, or compiled regular expression)"""
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    if isinstance(pattern, str):
+        pattern = pattern.encode("utf-8")
+    if fixed_strings:
+        if not ignore_case:
+            return pattern
+        pattern = re.escape(pattern)
+    return re.compile(pattern, re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+
+
+def _matching_lines(buffer, end, pattern):
+    """Yield (match start, line start, line end) for the lines of `buffer`
+    matching `pattern` and starting before `end`"""
+    pos = 0
+    while pos < end:
+        if isinstance(pattern, bytes):
+            start = buffer.find(pattern, pos)
+            if start < 0:
+                return
+        else:
+            match = pattern.search(buffer, pos)
+            if match is None:
+                return
+            start = match.start()
+        if start >= end:
+            return
+        line_start = buffer.rfind(b"\n", 0, start) + 1
+        line_end = buffer.find(b"\n", start)
+        if line_end < 0:
+            line_end = len(buffer)
+        yield start, line_start, line_end
+        pos = line_end + 1
+
+
+def search_content(content, pattern):
+    """Yield (offset, line) for the lines of `content` (a `FileContent`)
+    matching `pattern` (see `compile_pattern()`).  `line` is cut to
+    `_MAX_CONTEXT` bytes around the match; `offset` is the one of its first
+    byte (the start of the line, as `grep -b`, unless it was cut)."""
+    buffer, base = b"", 0
+    for offset, chunk in content.iter_data():
+        if buffer and offset != base + len(buffer):
+            # Hole: end of the pending line
+            yield from _report(buffer, base, len(buffer), pattern)
+            buffer = b""
+        if not buffer:
+            base = offset
+        buffer += chunk
+        end = buffer.rfind(b"\n") + 1
+        if end == 0:
+            if len(buffer) <= _MAX_LINE:
+                continue
+            end = len(buffer) - _OVERLAP
+        yield from _report(buffer, base, end, pattern)
+        buffer, base = buffer[end:], base + end
+    yield from _report(buffer, base, len(buffer), pattern)
+
+
+def _report(buffer, base, end, pattern):
+    for start, line_start, line_end in _matching_lines(buffer, end, pattern):
+        if line_end - line_start > _MAX_CONTEXT:
+            line_start = max(line_start, start - _MAX_CONTEXT // 4)
+            line_end = min(line_end, line_start + _MAX_CONTEXT)
+        yield base + line_start, buffer[line_start:line_end]
+
+
+def _search_batch(filesystem, batch, pattern, first_only):
+    matches = []
+    for path, inode_no in batch:
+        content = FileContent(filesystem, filesystem.get_inode(inode_no))
+        found = search_content(content, pattern)
+        if first_only:
+            found = itertools.islice(found, 1)
+        matches.extend((path, offset, line) for offset, line in found)
+    return matches
+
+
+def _init_worker(block_device, kwargs, pool_max_bytes, fail_on_wrong_checksum):
+    global _filesystem
+    from .ext4 import Filesystem
+    if pool_max_bytes is not None:
+        # A pool does not cross processes: each worker gets one of the same size
+        from .pool import CachePool
+        kwargs = dict(kwargs, pool=CachePool(pool_max_bytes))
+    _filesystem = Filesystem(block_device, **kwargs)
+    _filesystem.fail_on_wrong_checksum = fail_on_wrong_checksum
+    _filesystem.__enter__()
+
+
+def _search_batch_in_worker(batch, pattern, first_only):
+    return _search_batch(_filesystem, batch, pattern, first_only)
+
+
+def _batches(files):
+    batch, size = [], 0
+    for file in files:
+        batch.append((file.path, file.inode_no))
+        size += file.inode.get_size()
+        if size >= _BATCH_SIZE or len(batch) >= _BATCH_FILES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def grep(filesystem, pattern, path="/", ignore_case=False, fixed_strings=False, max_size=None,
+         files_with_matches=False, workers=None):
+    """Yield (path, offset, line) for the lines matching `pattern` in the
+    regular files under `path`.  See `Filesystem.grep()`."""
+    pattern = compile_pattern(pattern, ignore_case, fixed_strings)
+    root = filesystem.get_file(path)
+    files = root.walk(types=(DirEntry2.FileType.REGULAR_FILE,)) if isinstance(root, Directory) else [root]
+    files = [file for file in files if isinstance(file, RegularFile) and file.inode.get_size() > 0
+             and (max_size is None or file.inode.get_size() <= max_size)]
+    files.sort(key=lambda file: file.content.get_physical_start())
+    batches = _batches(files)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(files) <= 1:
+        for batch in batches:
+            yield from _search_batch(filesystem, batch, pattern, files_with_matches)
+        return
+    # Workers reopen the image as the parent did (same window, journal replay and checks)
+    kwargs = {"direct_io": filesystem.direct_io, "offset": filesystem.offset, "length": filesystem.length,
+              "replay_journal": filesystem.replay_journal}
+    pool_max_bytes = filesystem.pool.max_bytes if filesystem.pool is not None else None
+    initargs = (filesystem.block_device, kwargs, pool_max_bytes, filesystem.fail_on_wrong_checksum)
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+        # Bounded number of pending batches, yielded in submission order
+        pending = collections.deque()
+        for batch in batches:
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+            pending.append(pool.submit(_search_batch_in_worker, batch, pattern, files_with_matches))
+        while pending:
+            yield from pending.popleft().result()
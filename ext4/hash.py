@@ -0,0 +1,182 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Digests of all the regular files of a subtree (e.g. to build a SHA-256
+manifest of a snapshot).
+
+Files are hashed by a pool of threads, in physical block order.  The data of
+each file is read by another pool, a few chunks ahead of its hashing, so
+that the device always has requests queued; holes and unwritten extents are
+hashed as zeros, without any read.  At most `max_in_flight` bytes are read
+ahead and not hashed yet (besides a chunk per thread for small files).
+Both reading and hashing release the GIL."""
+
+import collections
+import concurrent.futures
+import hashlib
+import threading
+
+from .files import Directory, InlineFileContent, RegularFile
+from .tools import relative_path
+
+
+class _Budget:
+    """Bytes that may be in flight (read and not hashed yet)"""
+
+    def __init__(self, size):
+        self.size = size
+        self._available = size
+        self._condition = threading.Condition()
+
+    def acquire(self, n, blocking=True):
+        with self._condition:
+            if blocking:
+                self._condition.wait_for(lambda: self._available >= n)
+            elif self._available < n:
+                return False
+            self._available -= n
+            return True
+
+    def release(self, n):
+        with self._condition:
+            self._available += n
+            self._condition.notify_all()
+
+
+class _Hasher:
+    def __init__(self, filesystem, algorithm, readers, budget, chunk_blocks):
+        self.filesystem = filesystem
+        self.algorithm = algorithm
+        self.readers = readers
+        self.budget = budget
+        self.chunk_size = chunk_blocks * filesystem.conf.get_block_size()
+        self.zeros = memoryview(bytes(self.chunk_size))
+
+    def _chunks(self, content):
+        """(length, physical block) of the chunks to hash, in logical order,
+        the physical block being None for zeros"""
+        block_size = self.filesystem.conf.get_block_size()
+        for offset, length, physical in content._get_segments():
+            while length > 0:
+                n = min(length, self.chunk_size)
+                yield n, physical
+                length -= n
+                if physical is not None:
+                    physical += n // block_size
+
+    def _read(self, length, physical):
+        block_size = self.filesystem.conf.get_block_size()
+        # Not through the block cache: data blocks are read once
+        return self.filesystem.get_bytes(physical * block_size, length)
+
+    def hash_file(self, file):
+        """Hex digest of the content of `file`"""
+        h = hashlib.new(self.algorithm)
+        content = file.content
+        if isinstance(content, InlineFileContent):
+            h.update(content.get_bytes())
+            return h.hexdigest()
+        if file.inode.get_size() <= self.chunk_size:
+            # A single chunk: not worth a hop through the readers
+            for length, physical in self._chunks(content):
+                h.update(self.zeros[:length] if physical is None else self._read(length, physical))
+            return h.hexdigest()
+        pending = collections.deque()  # (length, future) of the chunks read ahead, in logical order
+        try:
+            for length, physical in self._chunks(content):
+                if physical is None:
+                    while pending:
+                        self._hash_next(h, pending)
+                    h.update(self.zeros[:length])
+                    continue
+                # Only wait for budget when holding none: the holders of
+                # budget always hash (hence release) without waiting for more
+                while not self.budget.acquire(length, blocking=not pending):
+                    self._hash_next(h, pending)
+                pending.append((length, self.readers.submit(self._read, length, physical)))
+            while pending:
+                self._hash_next(h, pending)
+        finally:
+            for length, future in pending:
+                future.cancel()
+                self.budget.release(length)
+        content.advise("dontneed")
+        return h.hexdigest()
+
+    def _hash_next(self, h, pending):
+        """Hash the first chunk read ahead"""
+        length, future = pending[0]
+        data = future.result()
+        pending.popleft()
+        self.budget.release(length)
+        h.update(data)
+
+
+def hash_tree(filesystem, path="/", algorithm="sha256", workers=8, max_in_flight=64 * 1024 * 1024,
+              chunk_blocks=256):
+    """Yield (file, hex digest) for the regular files under `path`, in
+    physical block order.  See `Filesystem.hash_tree()`."""
+    root = filesystem.get_file(path)
+    if isinstance(root, Directory):
+        files = [file for file in root.walk() if isinstance(file, RegularFile)]
+        files.sort(key=lambda file: file.content.get_physical_start())
+    elif isinstance(root, RegularFile):
+        files = [root]
+    else:
+        files = []
+    filesystem.advise(0, 0, "sequential")
+    return hash_files(filesystem, files, algorithm, workers, max_in_flight, chunk_blocks)
+
+
+def hash_files(filesystem, files, algorithm="sha256", workers=8, max_in_flight=64 * 1024 * 1024,
+               chunk_blocks=256):
+    """Yield (file, hex digest) for the regular files of the iterable
+    `files`, in the same order"""
+    hashlib.new(algorithm)  # Unknown algorithms fail early
+    chunk_blocks = max(1, min(chunk_blocks, max_in_flight // filesystem.conf.get_block_size()))
+    digests = {}  # Inode number -> future, for the hard links
+    with concurrent.futures.ThreadPoolExecutor(workers) as readers, \
+            concurrent.futures.ThreadPoolExecutor(workers) as hashers:
+        hasher = _Hasher(filesystem, algorithm, readers, _Budget(max_in_flight), chunk_blocks)
+
+        def submit(file):
+            future = digests.get(file.inode_no)
+            if future is None:
+                future = digests[file.inode_no] = hashers.submit(hasher.hash_file, file)
+            return file, future
+
+        # Bounded number of pending files, yielded in submission order
+        pending = collections.deque()
+        for file in files:
+            if len(pending) >= 4 * workers:
+                done_file, done = pending.popleft()
+                yield done_file, done.result()
+            pending.append(submit(file))
+        while pending:
+            done_file, done = pending.popleft()
+            yield done_file, done.result()
+
+
+def manifest_line(root, file, digest):
+    """Line of `file` in a manifest readable by `sha256sum -c` (from the
+    directory where `root` is extracted)"""
+    name = relative_path(root, file) or file.filename
+    if "\\" in name or "\n" in name:
+        # Escaped like coreutils does
+        return "\\" + digest + "  " + name.replace("\\", "\\\\").replace("\n", "\\n")
+    return digest + "  " + name
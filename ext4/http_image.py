@@ -0,0 +1,243 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Images served over HTTP, read with range requests.
+
+Reads are rounded to `chunk_size` chunks, so that neighbouring blocks are
+fetched together; the missing chunks of a read are coalesced into ranges of
+at most `max_range_size` bytes, fetched in parallel over a pool of
+keep-alive connections.  Fetched chunks are kept in an on-disk cache (a
+sparse copy of the image, under `cache_dir`), which is dropped when the
+image changes (ETag, Last-Modified or size); without ETag nor
+Last-Modified, chunks are not cached.  The server must support range
+requests.
+
+`Filesystem` opens "http://" and "https://" URLs with `HttpImage`."""
+
+import concurrent.futures
+import errno
+import hashlib
+import http.client
+import json
+import os
+import threading
+import urllib.parse
+
+from . import logger
+
+
+class HttpImage:
+    chunk_size = 1 << 16  # Unit of fetching and caching
+    max_range_size = 1 << 22  # Larger ranges are split, and fetched in parallel
+    max_connections = 8
+    timeout = 30  # Seconds
+    # Set to None to disable the on-disk cache
+    cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ext4-reader")
+
+    def __init__(self, url):
+        self.url = url
+        self.stats = None  # Set by Filesystem
+        parsed = urllib.parse.urlsplit(url)
+        self._connection_class = http.client.HTTPSConnection if parsed.scheme == "https" \
+            else http.client.HTTPConnection
+        self._netloc = parsed.netloc
+        self._target = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        self._connections = []  # Idle ones
+        self._lock = threading.Lock()
+        self._executor = None
+        self.size, validator = self._head()
+        self._cache = None
+        if self.cache_dir is not None and validator is None:
+            # A changed image of the same size would be read from stale chunks
+            logger.warning("%s: no ETag nor Last-Modified, fetched chunks are not cached on disk", url)
+        elif self.cache_dir is not None:
+            directory = os.path.join(self.cache_dir, hashlib.sha256(url.encode()).hexdigest()[:32])
+            self._cache = _ChunkCache(directory, self.size, self.chunk_size, validator)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._cache is not None:
+            self._cache.close()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    def pread(self, length, offset):
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return b""
+        first, last = offset // self.chunk_size, (end - 1) // self.chunk_size + 1
+        chunks = {}
+        missing = []
+        for i in range(first, last):
+            chunk = self._cache.get(i) if self._cache is not None else None
+            if chunk is None:
+                missing.append(i)
+            else:
+                chunks[i] = chunk
+        if self.stats is not None:
+            self.stats.count("chunk_cache.hits", len(chunks))
+            self.stats.count("chunk_cache.misses", len(missing))
+        if missing:
+            ranges = self._coalesce(missing)
+            if len(ranges) == 1:
+                fetched = [self._fetch(*ranges[0])]
+            else:
+                fetched = self._get_executor().map(lambda r: self._fetch(*r), ranges)
+            for (start_chunk, n), data in zip(ranges, fetched):
+                for i in range(n):
+                    chunk = data[i * self.chunk_size:(i + 1) * self.chunk_size]
+                    chunks[start_chunk + i] = chunk
+                    if self._cache is not None:
+                        self._cache.put(start_chunk + i, chunk)
+        data = b"".join(chunks[i] for i in range(first, last))
+        start = offset - first * self.chunk_size
+        return data[start:start + end - offset]
+
+    def _coalesce(self, chunk_nos):
+        """Runs of consecutive chunks, as (first chunk, count), of at most
+        `max_range_size` bytes"""
+        max_chunks = max(1, self.max_range_size // self.chunk_size)
+        ranges = []
+        for i in chunk_nos:
+            if ranges and ranges[-1][0] + ranges[-1][1] == i and ranges[-1][1] < max_chunks:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([i, 1])
+        return ranges
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.max_connections)
+            return self._executor
+
+    # HTTP
+
+    def _head(self):
+        """Size and validator (ETag or Last-Modified) of the image"""
+        response, _ = self._request("HEAD", {})
+        if response.status != 200:
+            raise self._error(response)
+        size = response.getheader("Content-Length")
+        if size is None:
+            raise OSError(errno.EIO, "Size of the image unknown (no Content-Length)", self.url)
+        return int(size), response.getheader("ETag") or response.getheader("Last-Modified")
+
+    def _fetch(self, first_chunk, n):
+        start = first_chunk * self.chunk_size
+        end = min(start + n * self.chunk_size, self.size)
+        response, body = self._request("GET", {"Range": f"bytes={start}-{end - 1}"})
+        if response.status == 200:
+            # The whole image for each chunk: unusable
+            raise OSError(errno.EIO, "The server does not support range requests", self.url)
+        if response.status != 206:
+            raise self._error(response)
+        if len(body) != end - start:
+            raise OSError(errno.EIO, f"Short read at {start} ({len(body)} of {end - start} bytes)", self.url)
+        if self.stats is not None:
+            self.stats.count("http.requests")
+            self.stats.observe("http.range_size", len(body))
+        return body
+
+    def _error(self, response):
+        # FileNotFoundError and PermissionError where it makes sense
+        error = {403: errno.EACCES, 404: errno.ENOENT}.get(response.status, errno.EIO)
+        return OSError(error, f"HTTP {response.status} {response.reason}", self.url)
+
+    def _request(self, method, headers):
+        # Once more on a fresh connection if the server closed a kept-alive one
+        for retry in (False, True):
+            connection = self._get_connection()
+            try:
+                connection.request(method, self._target, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, ConnectionError) as e:
+                connection.close()
+                if retry:
+                    raise OSError(errno.EIO, str(e), self.url) from e
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                with self._lock:
+                    self._connections.append(connection)
+            return response, body
+
+    def _get_connection(self):
+        with self._lock:
+            if self._connections:
+                return self._connections.pop()
+        return self._connection_class(self._netloc, timeout=self.timeout)
+
+
+class _ChunkCache:
+    """Fetched chunks: a sparse copy of the image, and the bitmap of the
+    chunks present in it (saved on close)"""
+
+    def __init__(self, directory, size, chunk_size, validator):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.chunk_size = chunk_size
+        self._bitmap_path = os.path.join(directory, "chunks")
+        self._lock = threading.Lock()
+        info = {"size": size, "chunk_size": chunk_size, "validator": validator}
+        info_path = os.path.join(directory, "image.json")
+        try:
+            with open(info_path) as f:
+                valid = json.load(f) == info
+        except (OSError, ValueError):
+            valid = False
+        self._present = bytearray(-(-size // chunk_size // 8) + 1)
+        if valid:
+            try:
+                with open(self._bitmap_path, "rb") as f:
+                    f.readinto(self._present)
+            except FileNotFoundError:
+                pass
+        self._fd = os.open(os.path.join(directory, "image"), os.O_RDWR | os.O_CREAT, 0o600)
+        if not valid:
+            # Drop the chunks of the previous image
+            try:
+                os.unlink(self._bitmap_path)
+            except FileNotFoundError:
+                pass
+            os.ftruncate(self._fd, 0)
+            with open(info_path, "w") as f:
+                json.dump(info, f)
+        os.ftruncate(self._fd, size)
+
+    def get(self, i):
+        if not self._present[i >> 3] & 1 << (i & 7):
+            return None
+        return os.pread(self._fd, self.chunk_size, i * self.chunk_size)
+
+    def put(self, i, chunk):
+        os.pwrite(self._fd, chunk, i * self.chunk_size)
+        with self._lock:
+            self._present[i >> 3] |= 1 << (i & 7)
+
+    def close(self):
+        with self._lock:
+            tmp_path = self._bitmap_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self._present)
+            os.replace(tmp_path, self._bitmap_path)
+        os.close(self._fd)
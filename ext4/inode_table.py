@@ -0,0 +1,143 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Bulk decoding of the stat fields of many inodes.
+
+Instead of building an `Inode` (and a `File`) per inode, the needed fields
+are unpacked straight from the inode table blocks, visited in disk order,
+into columns (see `StatTable`)."""
+
+import array
+import os
+import struct
+
+from .data_structures import Inode, Superblock
+from .tools import FSException, crc32c
+
+# Fields of the 128 first bytes: i_mode, i_uid, i_size_lo, i_atime,
+# i_ctime, i_mtime, i_gid, i_links_count, i_blocks_lo, i_flags,
+# i_generation, i_size_high, l_i_blocks_high
+_BASE = struct.Struct("<HHIiii4xHHII4x60xI4xI4xH")
+# i_extra_isize, i_ctime_extra, i_mtime_extra, i_atime_extra
+_EXTRA = struct.Struct("<H2xIII")
+_CHECKSUM_LO = Inode.i_osd2.offset + 8  # l_i_checksum_lo
+_CHECKSUM_HI = Inode.i_checksum_hi.offset
+
+
+class StatTable:
+    """Stat fields of a list of inodes, as columns: `table.size[i]` is the
+    size of the `i`th inode.  Times are in nanoseconds; `blocks` are in
+    units of `blksize` bytes (see `Inode.get_blocksize()`).  `names` is set
+    by `Directory.stat_all()`."""
+
+    columns = ("ino", "mode", "nlink", "uid", "gid", "size",
+               "atime_ns", "mtime_ns", "ctime_ns", "blksize", "blocks")
+    _typecodes = "QHHHHQqqqIQ"
+
+    def __init__(self, n):
+        for column, typecode in zip(self.columns, self._typecodes):
+            setattr(self, column, array.array(typecode, bytes(array.array(typecode).itemsize * n)))
+        self.names = None
+
+    def __len__(self):
+        return len(self.ino)
+
+    def get_stat(self, i):
+        """The `i`th row, as an `os.stat_result` like `File.get_stat()`"""
+        atime_ns, mtime_ns, ctime_ns = self.atime_ns[i], self.mtime_ns[i], self.ctime_ns[i]
+        return os.stat_result((self.mode[i], self.ino[i], 0, self.nlink[i], self.uid[i], self.gid[i], self.size[i],
+                               -1, -1, -1, atime_ns / 1e9, mtime_ns / 1e9, ctime_ns / 1e9,
+                               atime_ns, mtime_ns, ctime_ns, self.blksize[i], self.blocks[i], 0))
+
+
+def read_stats(filesystem, inode_nos) -> StatTable:
+    conf = filesystem.conf
+    n = len(inode_nos)
+    table = StatTable(n)
+    inode_size = conf.s_inode_size
+    block_size = conf.get_block_size()
+    inodes_per_group = conf.s_inodes_per_group
+    has_extra = inode_size > Inode.EXT2_GOOD_OLD_INODE_SIZE
+    is_linux = conf.s_creator_os == Superblock.CreatorOS.LINUX
+    huge_file = conf.has_flag(Superblock.FeatureRoCompat.RO_COMPAT_HUGE_FILE)
+    check = filesystem.fail_on_wrong_checksum \
+        and conf.has_flag(Superblock.FeatureRoCompat.RO_COMPAT_METADATA_CSUM)
+    seed = conf.get_csum_seed() if check else None
+    ino, mode, nlink, uid, gid, size, atime_ns, mtime_ns, ctime_ns, blksize, blocks = \
+        (getattr(table, column) for column in table.columns)
+
+    # Visit the inodes in disk order, so that inode table blocks are read
+    # sequentially (and only once)
+    block_no, block = None, None
+    for i in sorted(range(n), key=inode_nos.__getitem__):
+        inode_no = inode_nos[i]
+        bg_no, index = divmod(inode_no - 1, inodes_per_group)
+        pos = filesystem.get_block_group_desc(bg_no).get_inode_table_loc() * block_size + index * inode_size
+        if pos // block_size != block_no:
+            block_no = pos // block_size
+            block = filesystem.get_block(block_no)
+        offset = pos % block_size
+        (i_mode, i_uid, size_lo, i_atime, i_ctime, i_mtime, i_gid, links, blocks_lo, flags,
+         generation, size_high, blocks_high) = _BASE.unpack_from(block, offset)
+        if has_extra:
+            extra_isize, ctime_extra, mtime_extra, atime_extra = _EXTRA.unpack_from(block, offset + 128)
+        else:
+            extra_isize = 0
+        if check and not _verify_checksum(seed, inode_no, generation, block[offset:offset + inode_size],
+                                          extra_isize, is_linux):
+            raise FSException(f"Wrong checksum in inode {inode_no}")
+
+        ino[i] = inode_no
+        mode[i] = i_mode
+        nlink[i] = links
+        uid[i] = i_uid
+        gid[i] = i_gid
+        size[i] = size_high << 32 | size_lo
+        # See tools.read_timestamp_ns(): i_*time are read as signed here
+        atime_ns[i] = (i_atime + ((atime_extra & 0x3) << 32)) * 1000000000 + (atime_extra >> 2) \
+            if extra_isize > 12 else i_atime * 1000000000
+        mtime_ns[i] = (i_mtime + ((mtime_extra & 0x3) << 32)) * 1000000000 + (mtime_extra >> 2) \
+            if extra_isize > 8 else i_mtime * 1000000000
+        ctime_ns[i] = (i_ctime + ((ctime_extra & 0x3) << 32)) * 1000000000 + (ctime_extra >> 2) \
+            if extra_isize > 4 else i_ctime * 1000000000
+        # See Inode.get_block_count() and Inode.get_blocksize()
+        blocks[i] = blocks_lo + (blocks_high << 32 if is_linux and huge_file else 0)
+        blksize[i] = block_size if huge_file and flags & Inode.Flags.HUGE_FILE else 512
+    if filesystem.stats is not None:
+        filesystem.stats.count("parsed.InodeStat", n)
+    return table
+
+
+def _verify_checksum(seed, inode_no, generation, data, extra_isize, is_linux):
+    """Same as `Inode.verify_checksums()`, on the raw inode"""
+    has_hi = extra_isize > Inode.i_extra_isize.size
+    if not has_hi and not is_linux:
+        return True
+    provided = 0
+    if is_linux:
+        provided |= int.from_bytes(data[_CHECKSUM_LO:_CHECKSUM_LO + 2], 'little')
+        data = data[:_CHECKSUM_LO] + b"\x00\x00" + data[_CHECKSUM_LO + 2:]
+    if has_hi:
+        provided |= int.from_bytes(data[_CHECKSUM_HI:_CHECKSUM_HI + 2], 'little') << 16
+        data = data[:_CHECKSUM_HI] + b"\x00\x00" + data[_CHECKSUM_HI + 2:]
+    crc = crc32c(inode_no.to_bytes(4, 'little') + generation.to_bytes(4, 'little') + data, seed)
+    if not has_hi:
+        crc &= 0x0000FFFF
+    if not is_linux:
+        crc &= 0xFFFF0000
+    return crc == provided or not any(data)  # Unused inodes are zeroed, without checksum
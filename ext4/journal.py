@@ -0,0 +1,324 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Replay of the JBD2 journal, for consistent reads of volumes not cleanly
+unmounted (live systems, crashes).
+
+The log is scanned once, sequentially, from its start: the blocks logged by
+each committed transaction (and not revoked by it or a later one) are kept in
+memory, the last committed copy of each block winning.  `Filesystem` then
+reads these blocks from this overlay instead of their on-disk location,
+without writing anything: the image is not modified.
+
+Only internal journals are supported; fast commits (logical, per inode)
+are not replayed."""
+
+import array
+import bisect
+import ctypes
+import struct
+
+from . import logger
+from .data_structures import Superblock
+from .tools import IntConstants, crc32c
+
+JBD2_MAGIC = 0xC03B3998
+_HEADER = struct.Struct(">III")  # Magic, block type, sequence
+_DEFAULT_FAST_COMMIT_BLOCKS = 256
+_READ_BLOCKS = 256  # Journal blocks read at once
+
+
+class BlockType(IntConstants):
+    DESCRIPTOR = 1
+    COMMIT = 2
+    SUPERBLOCK_V1 = 3
+    SUPERBLOCK_V2 = 4
+    REVOKE = 5
+
+
+class TagFlags(IntConstants):
+    ESCAPE = 0x1  # The block started with the magic number, zeroed in the log
+    SAME_UUID = 0x2  # No UUID follows the tag
+    DELETED = 0x4
+    LAST_TAG = 0x8
+
+
+class JournalSuperblock(ctypes.BigEndianStructure):
+    _pack_ = 1
+    _fields_ = [
+        ("h_magic", ctypes.c_uint32),
+        ("h_blocktype", ctypes.c_uint32),
+        ("h_sequence", ctypes.c_uint32),
+        ("s_blocksize", ctypes.c_uint32),
+        ("s_maxlen", ctypes.c_uint32),
+        ("s_first", ctypes.c_uint32),
+        ("s_sequence", ctypes.c_uint32),
+        ("s_start", ctypes.c_uint32),
+        ("s_errno", ctypes.c_int32),
+        ("s_feature_compat", ctypes.c_uint32),
+        ("s_feature_incompat", ctypes.c_uint32),
+        ("s_feature_ro_compat", ctypes.c_uint32),
+        ("s_uuid", ctypes.c_uint8 * 16),
+        ("s_nr_users", ctypes.c_uint32),
+        ("s_dynsuper", ctypes.c_uint32),
+        ("s_max_transaction", ctypes.c_uint32),
+        ("s_max_trans_data", ctypes.c_uint32),
+        ("s_checksum_type", ctypes.c_uint8),
+        ("s_padding2", ctypes.c_uint8 * 3),
+        ("s_num_fc_blks", ctypes.c_uint32),
+    ]
+
+    class FeatureIncompat(IntConstants):
+        REVOKE = 0x1
+        BIT64 = 0x2
+        ASYNC_COMMIT = 0x4
+        CSUM_V2 = 0x8
+        CSUM_V3 = 0x10
+        FAST_COMMIT = 0x20
+
+    def read_bytes(self, struct_data):
+        fit = min(len(struct_data), ctypes.sizeof(self))
+        ctypes.memmove(ctypes.addressof(self), struct_data, fit)
+        return self
+
+    def has_flag(self, flag):
+        return self.s_feature_incompat & flag != 0
+
+    def has_checksums(self):
+        return self.has_flag(self.FeatureIncompat.CSUM_V2) or self.has_flag(self.FeatureIncompat.CSUM_V3)
+
+    def get_tag_size(self):
+        """Size of the block tags of descriptor blocks (without UUID)"""
+        if self.has_flag(self.FeatureIncompat.CSUM_V3):
+            return 16
+        size = 12 + (2 if self.has_flag(self.FeatureIncompat.CSUM_V2) else 0)
+        return size if self.has_flag(self.FeatureIncompat.BIT64) else size - 4
+
+    def get_log_end(self):
+        """End of the log, before the fast commit area"""
+        if not self.has_flag(self.FeatureIncompat.FAST_COMMIT):
+            return self.s_maxlen
+        return self.s_maxlen - (self.s_num_fc_blks or _DEFAULT_FAST_COMMIT_BLOCKS)
+
+
+class _LogReader:
+    """Sequential reads of the journal blocks, `_READ_BLOCKS` at once along
+    the extents of the journal inode"""
+
+    def __init__(self, filesystem, content):
+        from .files import ExtentMap
+        self.filesystem = filesystem
+        # Not through the extent map cache, which is only valid after replay
+        self.extent_map = ExtentMap(content._decode_extents())
+        self.block_size = filesystem.conf.get_block_size()
+        self._start, self._data = 0, b""
+
+    def get(self, logical):
+        index = logical - self._start
+        if not 0 <= index * self.block_size < len(self._data):
+            self._fill(logical)
+            index = 0
+        return self._data[index * self.block_size:(index + 1) * self.block_size]
+
+    def _fill(self, logical):
+        i = self.extent_map.find(logical)
+        if i >= len(self.extent_map):
+            raise OSError(f"Journal block {logical} is not mapped")
+        extent_logical, physical, length, _ = self.extent_map[i]
+        if extent_logical > logical:
+            raise OSError(f"Journal block {logical} is not mapped")
+        n = min(_READ_BLOCKS, extent_logical + length - logical)
+        self._start = logical
+        # Raw read: the overlay is not built yet
+        self._data = self.filesystem.get_bytes((physical + logical - extent_logical) * self.block_size,
+                                               n * self.block_size)
+
+
+class Journal:
+    """Overlay of the committed transactions of the journal: `blocks` maps
+    a block number to its last committed copy.  `transactions` is the
+    number of transactions replayed, from `first_sequence`."""
+
+    def __init__(self, filesystem):
+        self.filesystem = filesystem
+        self.superblock = None  # JournalSuperblock, if valid
+        self.blocks = {}
+        self.transactions = 0
+        self.first_sequence = None
+        self._block_nos = array.array('Q')  # Sorted keys of `blocks`
+
+    @classmethod
+    def read(cls, filesystem):
+        from .files import FileContent
+        journal = cls(filesystem)
+        conf = filesystem.conf
+        if not conf.has_flag(Superblock.FeatureCompat.COMPAT_HAS_JOURNAL):
+            return journal
+        if conf.s_journal_inum == 0:
+            logger.warning("External journals are not supported, journal not replayed")
+            return journal
+        inode = filesystem.get_inode(conf.s_journal_inum)
+        journal._scan(_LogReader(filesystem, FileContent(filesystem, inode)))
+        journal._block_nos.extend(sorted(journal.blocks))
+        return journal
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def _scan(self, reader):
+        sb = JournalSuperblock().read_bytes(reader.get(0))
+        if sb.h_magic != JBD2_MAGIC or sb.h_blocktype not in (BlockType.SUPERBLOCK_V1, BlockType.SUPERBLOCK_V2):
+            logger.warning("Invalid journal superblock, journal not replayed")
+            return
+        if sb.h_blocktype == BlockType.SUPERBLOCK_V1:
+            sb.s_feature_incompat = 0
+        self.superblock = sb
+        if sb.s_blocksize != reader.block_size:
+            logger.warning("Journal block size %d differs from the file system one, journal not replayed",
+                           sb.s_blocksize)
+            return
+        if sb.has_flag(sb.FeatureIncompat.FAST_COMMIT):
+            logger.warning("Fast commits of the journal are not replayed")
+        self.first_sequence = sequence = sb.s_sequence
+        if sb.s_start == 0:
+            return  # Clean journal
+        seed = crc32c(bytes(sb.s_uuid)) if sb.has_checksums() else None
+        log_end = sb.get_log_end()
+        position = sb.s_start
+        pending, revoked = {}, set()  # Of the current transaction
+        for _ in range(log_end - sb.s_first):
+            block = reader.get(position)
+            magic, block_type, block_sequence = _HEADER.unpack_from(block)
+            if magic != JBD2_MAGIC or block_sequence != sequence:
+                break  # End of the log
+            if block_type == BlockType.DESCRIPTOR:
+                if not self._verify_tail(seed, block):
+                    logger.warning("Wrong checksum of descriptor block %d of the journal", position)
+                    break
+                for block_no, flags, checksum in self._parse_tags(sb, block):
+                    position = self._next(sb, position, log_end)
+                    data = reader.get(position)
+                    if seed is not None and not self._verify_tag(sb, seed, sequence, data, checksum):
+                        logger.warning("Wrong checksum of block %d in journal transaction %d, skipped",
+                                       block_no, sequence)
+                        continue
+                    if flags & TagFlags.ESCAPE:
+                        data = JBD2_MAGIC.to_bytes(4, 'big') + data[4:]
+                    pending[block_no] = data
+            elif block_type == BlockType.COMMIT:
+                if seed is not None and not self._verify_commit(seed, block):
+                    logger.warning("Wrong checksum of commit block of journal transaction %d", sequence)
+                    break
+                # Revoked blocks are not replayed from this and previous transactions
+                for block_no in revoked:
+                    self.blocks.pop(block_no, None)
+                    pending.pop(block_no, None)
+                self.blocks.update(pending)
+                pending, revoked = {}, set()
+                self.transactions += 1
+                sequence += 1
+            elif block_type == BlockType.REVOKE:
+                if not self._verify_tail(seed, block):
+                    logger.warning("Wrong checksum of revoke block %d of the journal", position)
+                    break
+                revoked.update(self._parse_revoke(sb, block))
+            else:
+                break
+            position = self._next(sb, position, log_end)
+        if pending or revoked:
+            logger.info("Journal transaction %d is not committed, ignored", sequence)
+        logger.info("Journal: %d transactions from %d, %d blocks", self.transactions, self.first_sequence,
+                    len(self.blocks))
+
+    @staticmethod
+    def _next(sb, position, log_end):
+        position += 1
+        return sb.s_first if position >= log_end else position
+
+    @staticmethod
+    def _parse_tags(sb, block):
+        """(block number, flags, checksum) of the tags of a descriptor block"""
+        tag_size = sb.get_tag_size()
+        csum_v3 = sb.has_flag(sb.FeatureIncompat.CSUM_V3)
+        bit64 = sb.has_flag(sb.FeatureIncompat.BIT64)
+        end = len(block) - (4 if sb.has_checksums() else 0)  # Block tail
+        offset = _HEADER.size
+        while offset + tag_size <= end:
+            if csum_v3:
+                block_no, flags, block_no_high, checksum = struct.unpack_from(">IIII", block, offset)
+            else:
+                block_no, checksum, flags = struct.unpack_from(">IHH", block, offset)
+                block_no_high = struct.unpack_from(">I", block, offset + 8)[0] if bit64 else 0
+            if bit64:
+                block_no |= block_no_high << 32
+            yield block_no, flags, checksum
+            offset += tag_size
+            if not flags & TagFlags.SAME_UUID:
+                offset += 16
+            if flags & TagFlags.LAST_TAG:
+                break
+
+    @staticmethod
+    def _parse_revoke(sb, block):
+        count, = struct.unpack_from(">I", block, _HEADER.size)
+        record_size = 8 if sb.has_flag(sb.FeatureIncompat.BIT64) else 4
+        offset = _HEADER.size + 4
+        end = min(count, len(block))
+        while offset + record_size <= end:
+            yield int.from_bytes(block[offset:offset + record_size], 'big')
+            offset += record_size
+
+    @staticmethod
+    def _verify_tail(seed, block):
+        if seed is None:
+            return True
+        provided = int.from_bytes(block[-4:], 'big')
+        return crc32c(block[:-4] + bytes(4), seed) == provided
+
+    @staticmethod
+    def _verify_commit(seed, block):
+        provided = int.from_bytes(block[16:20], 'big')  # h_chksum[0]
+        return crc32c(block[:16] + bytes(4) + block[20:], seed) == provided
+
+    @staticmethod
+    def _verify_tag(sb, seed, sequence, data, checksum):
+        csum = crc32c(data, crc32c(sequence.to_bytes(4, 'big'), seed))
+        if sb.has_flag(sb.FeatureIncompat.CSUM_V3):
+            return csum == checksum
+        return csum & 0xFFFF == checksum
+
+    # Overlay
+
+    def patch(self, offset, data):
+        """`data` read at byte `offset` of the file system, with the blocks
+        of the overlay replaced by their journal copy"""
+        block_size = self.filesystem.conf.get_block_size()
+        first, end = offset // block_size, -(-(offset + len(data)) // block_size)
+        i = bisect.bisect_left(self._block_nos, first)
+        if i == len(self._block_nos) or self._block_nos[i] >= end:
+            return data
+        data = bytearray(data)
+        while i < len(self._block_nos) and self._block_nos[i] < end:
+            block_no = self._block_nos[i]
+            copy = self.blocks[block_no]
+            # Intersection of the block with the read range
+            start = max(block_no * block_size, offset)
+            stop = min((block_no + 1) * block_size, offset + len(data))
+            data[start - offset:stop - offset] = copy[start - block_no * block_size:stop - block_no * block_size]
+            i += 1
+        return bytes(data)
@@ -0,0 +1,354 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Partitions of whole disk images: MBR (with logical partitions), GPT,
+and linear logical volumes of LVM2 physical volumes.
+
+Partitions are opened in place, as a window of the image (no copy, no loop
+device):
+
+    for partition in find_ext4_partitions("disk.img"):
+        with partition.open() as filesystem:
+            ...
+    with open_partition("disk.img", "2") as filesystem:
+        ...
+"""
+
+import os
+import re
+import struct
+import uuid
+import zlib
+
+from . import logger
+
+SECTOR_SIZE = 512
+
+_EXT4_MAGIC_OFFSET = 0x400 + 0x38  # s_magic, in the superblock
+_EXT4_MAGIC = 0xEF53
+
+# MBR
+_MBR_ENTRY = struct.Struct("<B3sB3sII")  # status, CHS, type, CHS, first LBA, sectors
+_MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+_MBR_GPT_PROTECTIVE = 0xEE
+_MBR_LVM = 0x8E
+
+# GPT
+_GPT_HEADER = struct.Struct("<8sIIIIQQQQ16sQIII")
+_GPT_ENTRY = struct.Struct("<16s16sQQQ72s")
+_GPT_LVM = uuid.UUID("E6D6D379-F507-44C2-A23C-238F2A3DF928")
+_GPT_TYPES = {
+    uuid.UUID("0FC63DAF-8483-4772-8E79-3D69D8477DE4"): "Linux filesystem",
+    uuid.UUID("4F68BCE3-E8CD-4DB1-96E7-FBCAF984B709"): "Linux root (x86-64)",
+    uuid.UUID("933AC7E1-2EB4-4F13-B844-0E14E2AEF915"): "Linux home",
+    uuid.UUID("0657FD6D-A4AB-43C4-84E5-0933C84B4F4F"): "Linux swap",
+    uuid.UUID("C12A7328-F81F-11D2-BA4B-00A0C93EC93B"): "EFI system",
+    uuid.UUID("21686148-6449-6E6F-744E-656564454649"): "BIOS boot",
+    _GPT_LVM: "Linux LVM",
+}
+
+# LVM2
+_LVM_LABEL = struct.Struct("<8sQII8s")  # id, sector, crc, offset of the PV header, type
+_LVM_MDA_HEADER = struct.Struct("<I16sIQQ")  # checksum, magic, version, start, size
+_LVM_RAW_LOCN = struct.Struct("<QQII")  # offset, size, checksum, flags
+_LVM_MDA_MAGIC = b" LVM2 x[5A%r0N*>"
+
+
+class Partition:
+    """A window of `length` bytes at `offset` of the image at `path`.
+    `name` is its number in the partition table ("1", "5",…), or
+    "<volume group>/<logical volume>" for LVM."""
+
+    def __init__(self, path, name, offset, length, type_, label=""):
+        self.path = path
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.type = type_
+        self.label = label
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}<{self.path}:{self.name}@{self.offset}+{self.length}>"
+
+    def is_ext4(self):
+        """Whether the partition holds an ext2/3/4 file system (by its magic)"""
+        with open(self.path, "rb") as f:
+            magic = os.pread(f.fileno(), 2, self.offset + _EXT4_MAGIC_OFFSET)
+        return len(magic) == 2 and int.from_bytes(magic, 'little') == _EXT4_MAGIC
+
+    def open(self, **kwargs):
+        """The `Filesystem` of the partition (keyword arguments are passed to it)"""
+        from .ext4 import Filesystem
+        return Filesystem(self.path, offset=self.offset, length=self.length, **kwargs)
+
+
+def list_partitions(path):
+    """Partitions of the image (logical volumes replacing their LVM physical
+    volume), in table order.  Without partition table, the whole image is
+    partition "0"."""
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size or _device_size(fd)
+        partitions = _read_gpt(path, fd, size)
+        if partitions is None:
+            partitions = _read_mbr(path, fd)
+        if not partitions:
+            # No partition table: the whole image (a file system or an LVM
+            # physical volume)
+            partitions = [Partition(path, "0", 0, size, "whole disk")]
+        result = []
+        for partition in partitions:
+            if partition.type in ("Linux LVM", "0x8e") or _has_lvm_label(fd, partition.offset):
+                volumes = _read_lvm(path, fd, partition)
+                if volumes is not None:
+                    result.extend(volumes)
+                    continue
+            result.append(partition)
+        return result
+
+
+def find_ext4_partitions(path):
+    return [partition for partition in list_partitions(path) if partition.is_ext4()]
+
+
+def open_partition(path, name, **kwargs):
+    """Open partition `name` (see `Partition.name`) of the image at `path`"""
+    for partition in list_partitions(path):
+        if partition.name == str(name):
+            return partition.open(**kwargs)
+    raise FileNotFoundError(f"{path}: no partition {name}")
+
+
+def _device_size(fd):
+    # Block devices have no st_size
+    return os.lseek(fd, 0, os.SEEK_END)
+
+
+# MBR
+
+def _read_mbr(path, fd):
+    sector = os.pread(fd, SECTOR_SIZE, 0)
+    if len(sector) < SECTOR_SIZE or sector[510:512] != b"\x55\xAA":
+        return []
+    partitions = []
+    for i in range(4):
+        status, _, type_, _, first, count = _MBR_ENTRY.unpack_from(sector, 0x1BE + i * 16)
+        if type_ == 0 or count == 0:
+            continue
+        if type_ in _MBR_EXTENDED_TYPES:
+            partitions.extend(_read_ebr_chain(path, fd, first))
+        else:
+            partitions.append(Partition(path, str(i + 1), first * SECTOR_SIZE, count * SECTOR_SIZE, f"0x{type_:02x}"))
+    return partitions
+
+
+def _read_ebr_chain(path, fd, extended_start):
+    """Logical partitions: a chain of extended boot records, numbered from 5"""
+    partitions, ebr, seen = [], extended_start, set()
+    while ebr not in seen:
+        seen.add(ebr)
+        sector = os.pread(fd, SECTOR_SIZE, ebr * SECTOR_SIZE)
+        if len(sector) < SECTOR_SIZE or sector[510:512] != b"\x55\xAA":
+            break
+        _, _, type_, _, first, count = _MBR_ENTRY.unpack_from(sector, 0x1BE)
+        if type_ != 0 and count != 0:
+            # Relative to this EBR
+            partitions.append(Partition(path, str(5 + len(partitions)), (ebr + first) * SECTOR_SIZE,
+                                        count * SECTOR_SIZE, f"0x{type_:02x}"))
+        _, _, next_type, _, next_first, _ = _MBR_ENTRY.unpack_from(sector, 0x1CE)
+        if next_type not in _MBR_EXTENDED_TYPES:
+            break
+        ebr = extended_start + next_first  # Relative to the extended partition
+    return partitions
+
+
+# GPT
+
+def _read_gpt(path, fd, size):
+    """Partitions of the GPT (the backup one if the primary is corrupted),
+    or None if there is no GPT"""
+    mbr = os.pread(fd, SECTOR_SIZE, 0)
+    if len(mbr) < SECTOR_SIZE or mbr[510:512] != b"\x55\xAA":
+        return None
+    if not any(_MBR_ENTRY.unpack_from(mbr, 0x1BE + i * 16)[2] == _MBR_GPT_PROTECTIVE for i in range(4)):
+        return None
+    for sector_size in (512, 4096):
+        for lba in (1, size // sector_size - 1):
+            partitions = _read_gpt_header(path, fd, lba, sector_size)
+            if partitions is not None:
+                if lba != 1:
+                    logger.warning("%s: primary GPT header is invalid, using the backup", path)
+                return partitions
+    logger.warning("%s: protective MBR without valid GPT", path)
+    return None
+
+
+def _read_gpt_header(path, fd, lba, sector_size):
+    header = os.pread(fd, _GPT_HEADER.size, lba * sector_size)
+    if len(header) < _GPT_HEADER.size:
+        return None
+    (signature, _, header_size, header_crc, _, current_lba, _, _, _, _,
+     entries_lba, n_entries, entry_size, entries_crc) = _GPT_HEADER.unpack(header)
+    if signature != b"EFI PART" or current_lba != lba or not 92 <= header_size <= sector_size:
+        return None
+    raw_header = bytearray(os.pread(fd, header_size, lba * sector_size))
+    raw_header[16:20] = b"\x00" * 4
+    if zlib.crc32(raw_header) != header_crc:
+        return None
+    entries = os.pread(fd, n_entries * entry_size, entries_lba * sector_size)
+    if zlib.crc32(entries) != entries_crc:
+        return None
+    partitions = []
+    for i in range(n_entries):
+        type_guid, _, first, last, _, name = _GPT_ENTRY.unpack_from(entries, i * entry_size)
+        if type_guid == bytes(16):
+            continue
+        type_ = uuid.UUID(bytes_le=type_guid)
+        partitions.append(Partition(path, str(i + 1), first * sector_size, (last - first + 1) * sector_size,
+                                    _GPT_TYPES.get(type_, str(type_)),
+                                    name.decode('utf-16-le').split("\x00", 1)[0]))
+    return partitions
+
+
+# LVM2
+
+def _has_lvm_label(fd, offset):
+    return _find_lvm_label(fd, offset) is not None
+
+
+def _find_lvm_label(fd, offset):
+    """Sector of the LVM label (one of the 4 first sectors), or None"""
+    for i in range(4):
+        sector = os.pread(fd, SECTOR_SIZE, offset + i * SECTOR_SIZE)
+        if sector[:8] == b"LABELONE" and sector[24:32] == b"LVM2 001":
+            return sector
+    return None
+
+
+def _read_lvm(path, fd, partition):
+    """Linear logical volumes of the physical volume `partition`, or None if
+    it is not a physical volume"""
+    sector = _find_lvm_label(fd, partition.offset)
+    if sector is None:
+        return None
+    pv_header = _LVM_LABEL.unpack_from(sector)[3]
+    pv_uuid = sector[pv_header:pv_header + 32].decode('ascii')
+    # Lists of (offset, size) disk locations, each ended by a null one:
+    # data areas, then metadata areas
+    pos = pv_header + 32 + 8
+    lists = []
+    for _ in range(2):
+        locations = []
+        while pos + 16 <= len(sector):
+            area_offset, area_size = struct.unpack_from("<QQ", sector, pos)
+            pos += 16
+            if area_offset == 0:
+                break
+            locations.append((area_offset, area_size))
+        lists.append(locations)
+    for mda_offset, mda_size in lists[1]:
+        metadata = _read_lvm_metadata(fd, partition.offset + mda_offset, mda_size)
+        if metadata is not None:
+            return _linear_volumes(path, partition, pv_uuid, metadata)
+    logger.warning("%s: no readable LVM metadata in partition %s", path, partition.name)
+    return None
+
+
+def _read_lvm_metadata(fd, mda_pos, mda_size):
+    """Text of the current metadata, from the circular buffer of a metadata area"""
+    header = os.pread(fd, SECTOR_SIZE, mda_pos)
+    _, magic, _, _, _ = _LVM_MDA_HEADER.unpack_from(header)
+    if magic != _LVM_MDA_MAGIC:
+        return None
+    offset, size, _, _ = _LVM_RAW_LOCN.unpack_from(header, _LVM_MDA_HEADER.size)
+    if size == 0:
+        return None
+    if offset + size <= mda_size:
+        text = os.pread(fd, size, mda_pos + offset)
+    else:
+        # Wraps around, after the header
+        first = mda_size - offset
+        text = os.pread(fd, first, mda_pos + offset) + os.pread(fd, size - first, mda_pos + SECTOR_SIZE)
+    return _parse_lvm_config(text.rstrip(b"\x00").decode('utf-8', 'replace'))
+
+
+_LVM_TOKEN = re.compile(r'\s*(?:#[^\n]*\n?|("(?:[^"\\]|\\.)*")|([\w.+-]+)|(=|\{|\}|\[|\]|,))')
+
+
+def _parse_lvm_config(text):
+    """Parse the LVM configuration format into nested dicts (sections) and
+    values (ints, strings, lists)"""
+    tokens = []
+    for string, word, symbol in _LVM_TOKEN.findall(text):
+        if string:
+            tokens.append(('str', string[1:-1].replace('\\"', '"')))
+        elif word:
+            tokens.append(('int', int(word)) if re.fullmatch(r'-?\d+', word) else ('word', word))
+        elif symbol:
+            tokens.append(('sym', symbol))
+    tokens.reverse()
+
+    def parse_section():
+        section = {}
+        while tokens and tokens[-1] != ('sym', '}'):
+            _, key = tokens.pop()
+            _, symbol = tokens.pop()
+            if symbol == '{':
+                section[key] = parse_section()
+                tokens.pop()  # }
+            else:
+                section[key] = parse_value()
+        return section
+
+    def parse_value():
+        kind, value = tokens.pop()
+        if (kind, value) != ('sym', '['):
+            return value
+        values = []
+        while tokens[-1] != ('sym', ']'):
+            kind, value = tokens.pop()
+            if kind != 'sym':
+                values.append(value)
+        tokens.pop()  # ]
+        return values
+
+    return parse_section()
+
+
+def _linear_volumes(path, partition, pv_uuid, metadata):
+    volumes = []
+    for vg_name, vg in metadata.items():
+        if not isinstance(vg, dict) or "physical_volumes" not in vg:
+            continue
+        extent_size = vg["extent_size"] * SECTOR_SIZE
+        pvs = {name: pv for name, pv in vg["physical_volumes"].items()
+               if pv.get("id", "").replace("-", "") == pv_uuid}
+        for lv_name, lv in vg.get("logical_volumes", {}).items():
+            segments = [value for key, value in lv.items() if key.startswith("segment") and isinstance(value, dict)]
+            if len(segments) != 1 or segments[0].get("type") not in ("striped", "linear") \
+                    or segments[0].get("stripe_count", 1) != 1:
+                logger.warning("%s: skip %s/%s, not a linear volume in one segment", path, vg_name, lv_name)
+                continue
+            segment = segments[0]
+            pv_name, first_extent = segment["stripes"]
+            if pv_name not in pvs:
+                continue  # On another physical volume
+            offset = partition.offset + pvs[pv_name]["pe_start"] * SECTOR_SIZE + first_extent * extent_size
+            volumes.append(Partition(path, f"{vg_name}/{lv_name}", offset, segment["extent_count"] * extent_size,
+                                     "LVM logical volume"))
+    return volumes
@@ -0,0 +1,228 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Caches shared by several file systems, e.g. snapshots of one volume.
+
+    pool = CachePool(max_bytes=512 * 1024 * 1024)
+    for path in snapshots:
+        with pool.open(path) as filesystem:
+            ...
+
+Blocks are stored by content (BLAKE2b digest): a block found in several
+snapshots is kept once, and so are its parsed forms (inodes, directory
+entries), which are reused without parsing nor checksum verification.  A
+snapshot may also tell which of its blocks did not change (`block_hint`):
+those are then not even read again.
+
+All the entries share one LRU, bounded by `max_bytes` (an estimate of the
+memory used)."""
+
+import collections
+import hashlib
+import itertools
+import threading
+
+from .data_structures import Inode
+
+_ENTRY_OVERHEAD = 100  # Bytes, estimate of the memory used by a cache entry
+_INODE_SIZE = 600  # Bytes, estimate of the memory used by a parsed inode
+_DIR_ENTRY_SIZE = 150  # Bytes, estimate of the memory used by a parsed directory entry
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _bind(inode, filesystem):
+    """Copy of the parsed `inode` (a ctypes structure), bound to `filesystem`"""
+    copy = type(inode).from_buffer_copy(inode)
+    copy.__dict__.update(inode.__dict__, filesystem=filesystem)
+    return copy
+
+
+class CachePool:
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = collections.OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self._tokens = itertools.count()
+
+    def __len__(self):
+        return len(self._data)
+
+    def open(self, block_device, block_hint=None, **kwargs):
+        """A `Filesystem` using the pool.  `block_hint(block_no)`, if given,
+        returns a token such that blocks with the same number and token in
+        file systems of the same UUID have the same content (e.g. the
+        snapshot in which the block last changed), or None if unknown."""
+        from .ext4 import Filesystem
+        filesystem = Filesystem(block_device, pool=self, **kwargs)
+        filesystem.block_hint = block_hint
+        return filesystem
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    # Shared LRU
+
+    def get(self, key):
+        """Return the entry for `key`, or raise `KeyError`"""
+        with self._lock:
+            value, _ = self._data[key]
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, size):
+        size += _ENTRY_OVERHEAD
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._data[key] = value, size
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and self._data:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def _get_content(self, digest, data=None):
+        """The shared copy of the content `data` (to be stored if new)"""
+        try:
+            return self.get(("content", digest))
+        except KeyError:
+            if data is None:
+                raise
+        self.put(("content", digest), data, len(data))
+        return data
+
+    # Views for Filesystem
+
+    def block_cache(self, filesystem):
+        return _BlockCacheView(self, filesystem, next(self._tokens))
+
+    def cache(self, name, size_of):
+        """A per-file-system cache (same interface as `LRUCache`), whose
+        entries of `size_of(value)` bytes are kept in the pool"""
+        return _CacheView(self, (name, next(self._tokens)), size_of)
+
+    def get_inode(self, filesystem, inode_no, inode_pos, struct_data):
+        """The parsed inode, shared by the file systems of the same UUID.
+        Only its fields are shared: each caller gets a copy bound to its
+        own file system."""
+        key = ("inode", bytes(filesystem.UUID), inode_no, _digest(struct_data))
+        try:
+            inode = self.get(key)
+        except KeyError:
+            pass
+        else:
+            if filesystem.stats is not None:
+                filesystem.stats.count("pool.inode.hits")
+            return _bind(inode, filesystem)
+        if filesystem.stats is not None:
+            filesystem.stats.count("pool.inode.misses")
+            filesystem.stats.count("parsed.Inode")
+        inode = Inode(filesystem, inode_no, inode_pos).read_bytes(struct_data)
+        # Shared once its checksum is verified, as hits are not verified again
+        if filesystem.fail_on_wrong_checksum:
+            self.put(key, _bind(inode, None), _INODE_SIZE)
+        return inode
+
+    def get_direntries(self, filesystem, block, parse):
+        """Entries of a directory block, parsed by `parse()` if not known"""
+        key = ("direntries", filesystem.conf.s_feature_incompat, _digest(block))
+        try:
+            entries = self.get(key)
+        except KeyError:
+            pass
+        else:
+            if filesystem.stats is not None:
+                filesystem.stats.count("pool.direntries.hits")
+            return entries
+        if filesystem.stats is not None:
+            filesystem.stats.count("pool.direntries.misses")
+        entries = parse()
+        self.put(key, entries, len(entries) * _DIR_ENTRY_SIZE)
+        return entries
+
+
+class _CacheView:
+    def __init__(self, pool, namespace, size_of):
+        self.pool = pool
+        self.namespace = namespace
+        self.size_of = size_of
+
+    def __len__(self):
+        with self.pool._lock:
+            return sum(1 for key in self.pool._data if key[0] == self.namespace)
+
+    def __contains__(self, key):
+        return (self.namespace, key) in self.pool._data
+
+    def get(self, key, factory=None):
+        try:
+            return self.pool.get((self.namespace, key))
+        except KeyError:
+            if factory is None:
+                raise
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.pool.put((self.namespace, key), value, self.size_of(value))
+
+    def clear(self):
+        pass  # Left to the eviction
+
+
+class _BlockCacheView(_CacheView):
+    """Block cache of a file system: block numbers are mapped to contents.
+    The key of a block is shared by the file systems of the same UUID if
+    they give the same `block_hint` for it."""
+
+    def __init__(self, pool, filesystem, token):
+        super().__init__(pool, ("block", token), len)
+        self.filesystem = filesystem
+
+    def _key(self, block_no):
+        hint = self.filesystem.block_hint
+        token = hint(block_no) if hint is not None else None
+        if token is None:
+            return self.namespace, block_no
+        return "block", bytes(self.filesystem.UUID), block_no, token
+
+    def __contains__(self, block_no):
+        return self._key(block_no) in self.pool._data
+
+    def get(self, block_no, factory=None):
+        key = self._key(block_no)
+        try:
+            return self.pool._get_content(self.pool.get(key))
+        except KeyError:
+            if factory is None:
+                raise
+        value = factory()
+        self.put(block_no, value)
+        return value
+
+    def put(self, block_no, block):
+        digest = _digest(block)
+        self.pool._get_content(digest, block)
+        self.pool.put(self._key(block_no), digest, len(digest))
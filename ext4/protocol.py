@@ -0,0 +1,172 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Wire protocol between `ext4d` (see `ext4.daemon`) and its clients.
+
+Messages are frames: a 32-bit length (of what follows), an 8-bit opcode,
+then the payload.  All integers are little-endian; strings are prefixed by
+their 16-bit length.
+
+Requests, each answered by a single frame or by a stream of frames ended
+by `END`:
+
+- `LIST image path`: `ENTRIES`* `END`, the entries of a directory (or the
+  file itself);
+- `STAT image path`: `ENTRIES` with one entry;
+- `READ image path offset length`: `DATA`* `END` (a negative length reads
+  up to the end of the file);
+- `WALK image path`: `ENTRIES`* `END`, all files below a directory, in
+  breadth-first order.
+
+Any request may be answered by `ERROR errno message` instead.
+
+This module only depends on the standard library, so that clients start
+fast."""
+
+import errno
+import os
+import struct
+
+LIST = 1
+STAT = 2
+READ = 3
+WALK = 4
+ENTRIES = 128
+DATA = 129
+END = 130
+ERROR = 131
+
+MAX_DATA_SIZE = 256 * 1024  # Payload of a DATA frame
+ENTRIES_PER_FRAME = 256
+
+_HEADER = struct.Struct("<IB")
+_READ = struct.Struct("<Qq")
+_ERROR = struct.Struct("<H")
+# ino, mode, nlink, uid, gid, size, atime_ns, mtime_ns, ctime_ns, blksize, blocks
+_ENTRY = struct.Struct("<IHHIIQqqqIQ")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "ext4d.sock")
+    return f"/tmp/ext4d-{os.getuid()}.sock"
+
+
+def pack_string(value):
+    data = value.encode("utf-8", "surrogateescape")
+    return len(data).to_bytes(2, 'little') + data
+
+
+def unpack_string(payload, offset):
+    """Return the string at `offset`, and the offset following it"""
+    length = int.from_bytes(payload[offset:offset + 2], 'little')
+    end = offset + 2 + length
+    return bytes(payload[offset + 2:end]).decode("utf-8", "surrogateescape"), end
+
+
+def frame(opcode, payload=b""):
+    return _HEADER.pack(len(payload) + 1, opcode) + payload
+
+
+def read_frame(stream):
+    """Read a frame from a buffered binary stream.  Return (opcode,
+    payload), or (None, None) on a clean end of stream."""
+    header = stream.read(_HEADER.size)
+    if not header:
+        return None, None
+    if len(header) < _HEADER.size:
+        raise ProtocolError("Truncated frame header")
+    length, opcode = _HEADER.unpack(header)
+    payload = stream.read(length - 1)
+    if len(payload) < length - 1:
+        raise ProtocolError("Truncated frame")
+    return opcode, payload
+
+
+# Requests
+
+def pack_request(opcode, image, path, offset=0, length=-1):
+    payload = pack_string(image) + pack_string(path)
+    if opcode == READ:
+        payload += _READ.pack(offset, length)
+    return frame(opcode, payload)
+
+
+def unpack_request(payload):
+    """Return (image, path, offset, length)"""
+    image, i = unpack_string(payload, 0)
+    path, i = unpack_string(payload, i)
+    offset, length = _READ.unpack_from(payload, i) if len(payload) >= i + _READ.size else (0, -1)
+    return image, path, offset, length
+
+
+# Entries: the stat fields of a file, its path and its symbolic link target
+
+def pack_entry(path, stat, target=""):
+    return _ENTRY.pack(stat.st_ino, stat.st_mode, stat.st_nlink, stat.st_uid, stat.st_gid, stat.st_size,
+                       stat.st_atime_ns, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_blksize, stat.st_blocks) \
+        + pack_string(path) + pack_string(target)
+
+
+def unpack_entries(payload):
+    """Return a list of (path, stat, target), where `stat` is an
+    `os.stat_result` like the one of `File.get_stat()`"""
+    entries, i = [], 0
+    while i < len(payload):
+        ino, mode, nlink, uid, gid, size, atime_ns, mtime_ns, ctime_ns, blksize, blocks = \
+            _ENTRY.unpack_from(payload, i)
+        path, i = unpack_string(payload, i + _ENTRY.size)
+        target, i = unpack_string(payload, i)
+        stat = os.stat_result((mode, ino, 0, nlink, uid, gid, size, -1, -1, -1,
+                               atime_ns / 1e9, mtime_ns / 1e9, ctime_ns / 1e9, atime_ns, mtime_ns, ctime_ns,
+                               blksize, blocks, 0))
+        entries.append((path, stat, target))
+    return entries
+
+
+# Errors
+
+# Errors raised by the reader without errno
+_ERRNOS = {FileNotFoundError: errno.ENOENT, NotADirectoryError: errno.ENOTDIR,
+           IsADirectoryError: errno.EISDIR, PermissionError: errno.EACCES}
+
+
+def pack_error(exception):
+    if isinstance(exception, OSError) and exception.errno is not None:
+        code, message = exception.errno, exception.strerror or str(exception)
+        if exception.filename is not None:
+            message = f"{exception.filename}: {message}"
+    elif type(exception) in _ERRNOS:
+        code = _ERRNOS[type(exception)]
+        message = f"{exception}: {os.strerror(code)}"
+    elif isinstance(exception, (KeyError, ValueError)):
+        code, message = errno.EINVAL, str(exception)
+    else:
+        code, message = errno.EIO, f"{exception.__class__.__name__}: {exception}"
+    return frame(ERROR, _ERROR.pack(code) + pack_string(message))
+
+
+def raise_error(payload):
+    (code,) = _ERROR.unpack_from(payload)
+    message, _ = unpack_string(payload, _ERROR.size)
+    raise OSError(code, message)
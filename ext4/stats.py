@@ -0,0 +1,136 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""I/O and parsing instrumentation.
+
+Instrumentation is enabled by setting `Filesystem.stats` to a `Stats`
+instance.  When it is None (the default), instrumented paths only pay for
+an attribute test."""
+
+import collections
+import threading
+import time
+
+
+class Histogram:
+    """Power-of-two buckets histogram of non-negative integers"""
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.buckets[value.bit_length()] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the `p`th percentile"""
+        threshold = self.count * p / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= threshold:
+                return min((1 << bucket) - 1, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+class Stats:
+    """Counters and histograms about reads, caches and parsing.
+
+    `trace`, if set, is called as `trace(offset, length, duration_ns)` after
+    each read from the device."""
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+        self._last_end = None
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].add(value)
+
+    def record_read(self, offset, length, duration_ns):
+        with self._lock:
+            self.counters["read.calls"] += 1
+            self.counters["read.bytes"] += length
+            self.histograms["read.latency_ns"].add(duration_ns)
+            if self._last_end is not None and offset != self._last_end:
+                self.counters["read.seeks"] += 1
+                self.histograms["read.seek_distance"].add(abs(offset - self._last_end))
+            self._last_end = offset + length
+        if self.trace is not None:
+            self.trace(offset, length, duration_ns)
+
+    def summary(self):
+        counters, histograms = self.counters, self.histograms
+        latency = histograms["read.latency_ns"]
+        lines = [f"Reads: {counters['read.calls']} calls, {_human_size(counters['read.bytes'])}, "
+                 f"latency mean {_human_duration(latency.mean())}, p50 {_human_duration(latency.percentile(50))}, "
+                 f"p99 {_human_duration(latency.percentile(99))}, max {_human_duration(latency.max)}",
+                 f"Seeks: {counters['read.seeks']}, "
+                 f"mean distance {_human_size(histograms['read.seek_distance'].mean())}"]
+        for cache in ("block_cache", "extent_map_cache", "pool.inode", "pool.direntries"):
+            hits, misses = counters[f"{cache}.hits"], counters[f"{cache}.misses"]
+            if hits + misses:
+                lines.append(f"{cache.replace('_', ' ').replace('.', ' ').capitalize()}: {hits} hits, {misses} misses "
+                             f"({100 * hits / (hits + misses):.1f}% hits)")
+        checksum = histograms["checksum_ns"]
+        lines.append(f"Checksums: {checksum.count} verified in {_human_duration(checksum.total)}")
+        parsed = sorted((name.split(".", 1)[1], n) for name, n in counters.items() if name.startswith("parsed."))
+        lines.append("Parsed: " + (", ".join(f"{name} {n}" for name, n in parsed) or "nothing"))
+        return "\n".join(lines)
+
+
+def timed(stats, name, func, *args):
+    """Call `func(*args)`, adding its duration to histogram `name` if `stats` is not None"""
+    if stats is None:
+        return func(*args)
+    start = time.perf_counter_ns()
+    try:
+        return func(*args)
+    finally:
+        stats.observe(name, time.perf_counter_ns() - start)
+
+
+def _human_size(n):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TiB"
+
+
+def _human_duration(ns):
+    for unit in ("ns", "µs", "ms"):
+        if ns < 1000:
+            return f"{ns:.0f} {unit}" if unit == "ns" else f"{ns:.1f} {unit}"
+        ns /= 1000
+    return f"{ns:.2f} s"
@@ -0,0 +1,224 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Timeline of the modification (m), access (a), change (c) and creation
+(b, birth) times of all the allocated inodes, for forensics.
+
+Timestamps are decoded a whole inode table at once: each field is taken
+from the raw table by a strided `memoryview` slice, the nanoseconds and the
+epoch bits of the extra fields (see `tools.read_timestamp_ns()`) are
+combined by `map()` over `operator` functions, and the allocated inodes are
+picked with the inode bitmap by `itertools.compress()`: decoding runs no
+Python code per inode.
+
+Events are sorted by time.  Beyond `sort_buffer` events, sorted runs are
+spilled to temporary files, then merged (external merge sort).
+
+    for seconds, nanoseconds, flags, inode_no in filesystem.timeline():
+        ...
+"""
+
+import array
+import bisect
+import heapq
+import itertools
+import operator
+import struct
+import sys
+import tempfile
+
+from .data_structures import BlockGroupDescriptor, Inode
+
+MODIFIED, ACCESSED, CHANGED, BORN = 1, 2, 4, 8
+
+_OSD2 = Inode.i_osd2.offset
+_BITS = bytes.maketrans(b"01", b"\x00\x01")
+_EVENT = struct.Struct("<qIIB")  # Seconds, nanoseconds, inode number, flag
+_RUN_READ_SIZE = 4096  # Events read at once from a run
+
+
+class InodeTimes:
+    """Columns of the allocated inodes, by increasing inode number: `ino`,
+    `mode`, `uid`, `gid`, `size`, and for each of `atime`, `mtime`, `ctime`
+    and `crtime`, the seconds (`*_sec`) and the nanoseconds (`*_nsec`).
+    `has_crtime[i]` tells whether the inode has a creation time."""
+
+    columns = (("ino", 'I'), ("mode", 'H'), ("uid", 'I'), ("gid", 'I'), ("size", 'Q'),
+               ("atime_sec", 'q'), ("atime_nsec", 'I'), ("mtime_sec", 'q'), ("mtime_nsec", 'I'),
+               ("ctime_sec", 'q'), ("ctime_nsec", 'I'), ("crtime_sec", 'q'), ("crtime_nsec", 'I'),
+               ("has_crtime", 'B'))
+
+    def __init__(self):
+        for name, typecode in self.columns:
+            setattr(self, name, array.array(typecode))
+
+    def __len__(self):
+        return len(self.ino)
+
+    def find(self, inode_no):
+        """Index of inode `inode_no`, or raise `KeyError`"""
+        i = bisect.bisect_left(self.ino, inode_no)
+        if i == len(self.ino) or self.ino[i] != inode_no:
+            raise KeyError(inode_no)
+        return i
+
+    @classmethod
+    def read(cls, filesystem):
+        table = cls()
+        for bg_no in range(filesystem.conf.get_groups_count()):
+            table._read_group(filesystem, bg_no)
+        return table
+
+    def _read_group(self, filesystem, bg_no):
+        conf = filesystem.conf
+        bgd = filesystem.get_block_group_desc(bg_no)
+        if bgd.has_flag(BlockGroupDescriptor.Flags.INODE_UNINIT):
+            return
+        inodes_per_group = conf.s_inodes_per_group
+        bitmap = filesystem.get_block(bgd.get_bg_inode_bitmap_loc())
+        bits = int.from_bytes(bitmap[:inodes_per_group // 8], 'little')
+        if bits == 0:
+            return
+        # Inode table up to the last used inode, read at once
+        n = bits.bit_length()
+        inode_size = conf.s_inode_size
+        raw = memoryview(filesystem.get_bytes(bgd.get_inode_table_loc() * conf.get_block_size(), n * inode_size))
+
+        def column(offset, typecode):
+            """Field at `offset` of the `n` inodes"""
+            words = raw.cast(typecode)
+            values = array.array(typecode, words[offset // words.itemsize::inode_size // words.itemsize].tobytes())
+            if sys.byteorder != 'little':
+                values.byteswap()
+            return values
+
+        # One byte per inode: 1 if used.  Reserved inodes may be marked as
+        # used, yet be zeroed.
+        used = format(bits, f"0{n}b")[::-1].encode().translate(_BITS)
+        used = bytes(map(operator.and_, used, map(bool, column(Inode.i_mode.offset, 'H'))))
+
+        def field(offset, typecode):
+            """Field at `offset` of the used inodes"""
+            return array.array(typecode, itertools.compress(column(offset, typecode), used))
+
+        first = bg_no * inodes_per_group + 1
+        self.ino.extend(itertools.compress(range(first, first + n), used))
+        self.mode.extend(field(Inode.i_mode.offset, 'H'))
+        self.uid.extend(map(operator.or_, field(Inode.i_uid.offset, 'H'),
+                            map(operator.lshift, field(_OSD2 + 4, 'H'), itertools.repeat(16))))  # l_i_uid_high
+        self.gid.extend(map(operator.or_, field(Inode.i_gid.offset, 'H'),
+                            map(operator.lshift, field(_OSD2 + 6, 'H'), itertools.repeat(16))))  # l_i_gid_high
+        self.size.extend(map(operator.or_, field(Inode.i_size_lo.offset, 'I'),
+                             map(operator.lshift, field(Inode.i_size_high.offset, 'I'), itertools.repeat(32))))
+
+        count = len(self.ino) - len(self.atime_sec)
+        if inode_size > Inode.EXT2_GOOD_OLD_INODE_SIZE:
+            extra_isize = field(Inode.i_extra_isize.offset, 'H')
+        else:
+            extra_isize = array.array('H', bytes(2 * count))
+
+        def extra(name, typecode='I'):
+            """Extra field `name`, 0 for the inodes too small to have it"""
+            offset = getattr(Inode, name).offset
+            present = offset + 4 - Inode.EXT2_GOOD_OLD_INODE_SIZE  # Minimal i_extra_isize
+            if inode_size < offset + 4:
+                return array.array(typecode, bytes(4 * count))
+            values = field(offset, typecode)
+            if min(extra_isize, default=present) < present:
+                values = array.array(typecode, map(operator.mul, values,
+                                                   map(operator.ge, extra_isize, itertools.repeat(present))))
+            return values
+
+        for time in ("atime", "mtime", "ctime", "crtime"):
+            if time == "crtime":
+                seconds = extra("i_crtime", 'i')
+                self.has_crtime.extend(map(operator.ge, extra_isize, itertools.repeat(
+                    Inode.i_crtime.offset + 4 - Inode.EXT2_GOOD_OLD_INODE_SIZE)))
+            else:
+                seconds = field(getattr(Inode, f"i_{time}").offset, 'i')
+            time_extra = extra(f"i_{time}_extra")
+            # See tools.read_timestamp_ns(): 2 bits of epoch, 30 of nanoseconds
+            getattr(self, f"{time}_sec").extend(map(operator.add, seconds, map(
+                operator.lshift, map(operator.and_, time_extra, itertools.repeat(3)), itertools.repeat(32))))
+            getattr(self, f"{time}_nsec").extend(map(operator.rshift, time_extra, itertools.repeat(2)))
+
+
+def _events(times):
+    """(seconds, nanoseconds, inode number, flag) of every time of every inode"""
+    inos = times.ino
+    for flag, time in ((MODIFIED, "mtime"), (ACCESSED, "atime"), (CHANGED, "ctime")):
+        yield from zip(getattr(times, f"{time}_sec"), getattr(times, f"{time}_nsec"), inos, itertools.repeat(flag))
+    yield from itertools.compress(zip(times.crtime_sec, times.crtime_nsec, inos, itertools.repeat(BORN)),
+                                  times.has_crtime)
+
+
+def _read_run(f):
+    f.seek(0)
+    while True:
+        data = f.read(_EVENT.size * _RUN_READ_SIZE)
+        if not data:
+            return
+        yield from _EVENT.iter_unpack(data)
+
+
+def _sorted(events, sort_buffer, tmpdir):
+    """Sort `events`, spilling runs of `sort_buffer` sorted events to
+    temporary files (in `tmpdir`) if they do not fit, then merging them"""
+    runs = []
+    try:
+        while True:
+            batch = list(itertools.islice(events, sort_buffer))
+            batch.sort()
+            if not runs and len(batch) < sort_buffer:
+                yield from batch  # All in memory
+                return
+            if not batch:
+                break
+            run = tempfile.TemporaryFile(dir=tmpdir)
+            runs.append(run)
+            run.write(b"".join(itertools.starmap(_EVENT.pack, batch)))
+            del batch
+        yield from heapq.merge(*map(_read_run, runs))
+    finally:
+        for run in runs:
+            run.close()
+
+
+def timeline(filesystem, times=None, sort_buffer=1000000, tmpdir=None):
+    """Yield (seconds, nanoseconds, flags, inode number) for every time of
+    every allocated inode, sorted by time.  `flags` tells which times of
+    the inode (`MODIFIED`, `ACCESSED`, `CHANGED`, `BORN`) are equal to this
+    one.  `times` is the `InodeTimes` of the file system (read if None).
+    See `Filesystem.timeline()`."""
+    if times is None:
+        times = InodeTimes.read(filesystem)
+    current, flags = None, 0
+    for seconds, nanoseconds, inode_no, flag in _sorted(_events(times), sort_buffer, tmpdir):
+        if (seconds, nanoseconds, inode_no) != current:
+            if current is not None:
+                yield current[0], current[1], flags, current[2]
+            current, flags = (seconds, nanoseconds, inode_no), 0
+        flags |= flag
+    if current is not None:
+        yield current[0], current[1], flags, current[2]
+
+
+def macb(flags):
+    """`flags` like mactime: "m.c." for modified and changed"""
+    return "".join(letter if flags & flag else "." for letter, flag in
+                   (("m", MODIFIED), ("a", ACCESSED), ("c", CHANGED), ("b", BORN)))
@@ -16,15 +16,135 @@
 # License along with ext4-reader.  If not, see
 # <https://www.gnu.org/licenses/>.
 
-import crcmod
+import array
+import collections
+import sys
+import threading
 
 
 class FSException(Exception):
     pass
 
 
-crc16 = crcmod.mkCrcFun(0x18005)
-crc32c = crcmod.mkCrcFun(0x11EDC6F41)
+class LRUCache:
+    """Thread-safe mapping keeping the `maxsize` most recently used entries"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, factory=None):
+        """Return the entry for `key`.  On a miss, build it with `factory()`
+        (if provided, else raise `KeyError`) and store it."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                if factory is None:
+                    raise
+            else:
+                if self._expire(key, value):
+                    del self._data[key]
+                else:
+                    self._data.move_to_end(key)
+                return value
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def _expire(self, key, value):
+        """Whether the entry, just used, is to be dropped before its turn
+        (called with the lock held)"""
+        return False
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class _ConstantsType(type):
+    def __new__(mcs, name, bases, namespace):
+        cls = super().__new__(mcs, name, bases, namespace)
+        cls._members = {}
+        for key, value in namespace.items():
+            if key.isupper() and type(value) is int:
+                member = int.__new__(cls, value)
+                member.name = key
+                setattr(cls, key, member)
+                cls._members.setdefault(value, member)
+        return cls
+
+    def __call__(cls, value):
+        try:
+            return cls._members[value]
+        except KeyError:
+            raise ValueError(f"{value!r} is not a valid {cls.__name__}") from None
+
+    def __iter__(cls):
+        return iter(cls._members.values())
+
+    def __len__(cls):
+        return len(cls._members)
+
+
+class IntConstants(int, metaclass=_ConstantsType):
+    """Table of named integer constants, with the interface of
+    `enum.IntEnum` used in this package (`Table.NAME`, `Table(value)`,
+    `member.name`, iteration in definition order).
+
+    Building an `IntEnum` costs about 20 µs per member, which matters at
+    startup with the hundred flags of the on-disk structures."""
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}.{self.name}: {int(self)}>"
+
+
+def _lazy_crc(poly):
+    """CRC function, whose implementation (crcmod) is only imported on first use"""
+    implementation = None
+
+    def crc(data, *args):
+        nonlocal implementation
+        if implementation is None:
+            import crcmod
+            implementation = crcmod.mkCrcFun(poly)
+        return implementation(data, *args)
+    return crc
+
+
+crc16 = _lazy_crc(0x18005)
+crc32c = _lazy_crc(0x11EDC6F41)
+
+
+def bounded_map(pool, func, items, window):
+    """Like `pool.map()` (`pool` being an executor), but with at most
+    `window` pending tasks"""
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def relative_path(root, file):
+    """Path of `file` relative to the directory `root` it is under ("" for `root` itself)"""
+    return file.path[len(root.path):].lstrip("/")
 
 
 def human_readable_mode(mode):
@@ -43,13 +163,22 @@ def human_readable_mode(mode):
 
 
 def human_readable_file_type(mode):
-    return "pc?d?b?-?l?s???"[mode & 0o70000 >> 12]
+    return "?pc?d?b?-?l?s???"[(mode & 0o170000) >> 12]
 
 
 def read_timestamp_ns(i_time, i_time_extra):
-    """Read a 32-bits or 64-bits timestamp, as provided in inodes"""
-    time = i_time * 1000000000
-    if i_time_extra is not None:
-        time += (i_time_extra & 0x3 << 32) * 1000000000
-        time += i_time_extra >> 2
-    return time
+    """Read a 32-bits or 64-bits timestamp, as provided in inodes.  `i_time`
+    is signed; the 2 low bits of `i_time_extra` extend it (up to 2446), the
+    30 others are nanoseconds."""
+    seconds = i_time - ((i_time & 0x80000000) << 1)
+    if i_time_extra is None:
+        return seconds * 1000000000
+    return (seconds + ((i_time_extra & 0x3) << 32)) * 1000000000 + (i_time_extra >> 2)
+
+
+def read_u32_array(data):
+    """Decode a buffer of little-endian 32-bits integers at once"""
+    values = array.array('I', data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
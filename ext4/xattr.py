@@ -0,0 +1,111 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Extended attributes.
+
+They are stored in the inode (after the extra fields), then in an external
+block (`i_file_acl`), often shared by many inodes having the same
+attributes.  Large values may be stored in their own inode (`EA_INODE`)."""
+
+import ctypes
+
+from . import stats
+from .data_structures import ExtendedAttributeEntry, ExtendedAttributeHeader, Superblock
+from .tools import FSException, LRUCache, crc32c
+
+
+class XattrBlockCache(LRUCache):
+    """Parsed extended attribute blocks, by block number.
+
+    A block is shared by `h_refcount` inodes: it is dropped once it has been
+    served that many times, so that a walk over all the files reads each
+    block once without keeping it any longer.  At most `maxsize` blocks are
+    kept (least recently used first out)."""
+
+    def get(self, block_no):
+        """Return the attributes of the block, or raise `KeyError`"""
+        return super().get(block_no)[0]
+
+    def put(self, block_no, attributes, refcount):
+        """Store the attributes of a block just read for one of its
+        `refcount` users"""
+        if refcount <= 1:
+            return  # Not shared
+        super().put(block_no, [attributes, refcount - 1])
+
+    def _expire(self, block_no, entry):
+        entry[1] -= 1  # Remaining uses
+        return entry[1] <= 0
+
+
+def get_xattrs(filesystem, inode):
+    """Extended attributes of `inode`, as a {name: value} dict"""
+    attributes = _read_entries(filesystem, inode.iter_ibody_xattrs())
+    block_no = inode.get_file_acl()
+    if block_no != 0:
+        attributes.update(_get_block_xattrs(filesystem, block_no))
+    return attributes
+
+
+def _read_entries(filesystem, entries):
+    attributes = {}
+    for entry, value in entries:
+        if value is None:
+            # Stored in its own inode
+            from .files import FileContent
+            value_inode = filesystem.get_inode(entry.e_value_inum)
+            value = FileContent(filesystem, value_inode).get_bytes(0, entry.e_value_size)
+        attributes[entry.get_full_name()] = value
+    return attributes
+
+
+def _get_block_xattrs(filesystem, block_no):
+    cache_stats = filesystem.stats
+    try:
+        attributes = filesystem.xattr_block_cache.get(block_no)
+    except KeyError:
+        pass
+    else:
+        if cache_stats is not None:
+            cache_stats.count("xattr_block_cache.hits")
+        return attributes
+    if cache_stats is not None:
+        cache_stats.count("xattr_block_cache.misses")
+        cache_stats.count("parsed.ExtendedAttributeBlock")
+    block = filesystem.get_block(block_no)
+    header = ExtendedAttributeHeader().read_bytes(block)
+    if header.h_magic != ExtendedAttributeHeader.MAGIC:
+        raise FSException(f"Magic is not valid in extended attribute block {block_no}")
+    if filesystem.fail_on_wrong_checksum \
+            and not stats.timed(cache_stats, "checksum_ns", _verify_block_checksum, filesystem, block_no, block):
+        raise FSException(f"Wrong checksum in extended attribute block {block_no}")
+    # Value offsets are relative to the block
+    attributes = _read_entries(filesystem, ExtendedAttributeEntry.read_entries(block, ctypes.sizeof(header), 0))
+    filesystem.xattr_block_cache.put(block_no, attributes, header.h_refcount)
+    return attributes
+
+
+def _verify_block_checksum(filesystem, block_no, block):
+    if not filesystem.conf.has_flag(Superblock.FeatureRoCompat.RO_COMPAT_METADATA_CSUM):
+        return True  # No checksums
+    checksum_start = ExtendedAttributeHeader.h_checksum.offset
+    crc = crc32c(block_no.to_bytes(8, 'little'), filesystem.conf.get_csum_seed())
+    crc = crc32c(block[:checksum_start], crc)
+    crc = crc32c(b"\x00" * 4, crc)
+    crc = crc32c(block[checksum_start + 4:], crc)
+    return crc == int.from_bytes(block[checksum_start:checksum_start + 4], 'little')
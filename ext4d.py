@@ -0,0 +1,64 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+import signal
+import sys
+
+from ext4 import protocol
+from ext4.daemon import Server
+
+
+def main(images, socket_path=None, cache_size=None):
+    socket_path = socket_path or protocol.default_socket_path()
+    try:
+        server = Server(socket_path, images, cache_size * 1024 * 1024 if cache_size is not None else None)
+    except OSError as e:
+        print(f"ext4d: {e}", file=sys.stderr)
+        sys.exit(1)
+    # Stop cleanly (removing the socket) on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="ext4d", description="serve ext4 file systems over a Unix socket")
+    parser.add_argument("images", metavar="block_device", nargs="+",
+                        help="Path to a block device containing an ext4 file system, to serve")
+    parser.add_argument("-s", "--socket", dest="socket_path",
+                        help=f"Path of the Unix socket (default: {protocol.default_socket_path()})")
+    parser.add_argument("--cache-size", type=int, metavar="MIB",
+                        help="Share one cache of this size between all the images (e.g. snapshots of one volume)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Show debug information")
+    return parser
+
+
+if __name__ == '__main__':
+    _parser = _args_parser()
+    opts = _parser.parse_args()
+    if hasattr(opts, 'verbose'):
+        if opts.verbose:
+            import logging
+            logging.basicConfig(level=logging.INFO)
+        del opts.verbose
+    main(**vars(opts))
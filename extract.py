@@ -0,0 +1,62 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+import logging
+import sys
+
+from ext4 import Filesystem
+
+
+def main(block_device, path, destination, tar=False, jobs=8, direct_io=False):
+    try:
+        with Filesystem(block_device, direct_io=direct_io) as filesystem:
+            if tar and destination == "-":
+                destination = sys.stdout.buffer
+            filesystem.extract(path, destination, tar=tar, workers=jobs)
+    except PermissionError:
+        print(f"{block_device}: permission denied", file=sys.stderr)
+        sys.exit(1)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="extract", description="copy a directory tree out of the file system")
+    parser.add_argument("block_device",
+                        help="Path to the block device containing the ext4 file system")
+    parser.add_argument("path", metavar="SOURCE",
+                        help="File or directory to copy")
+    parser.add_argument("destination", metavar="DEST",
+                        help="Local directory to create, or tar file to write with --tar (- for stdout)")
+    parser.add_argument("-t", "--tar", action='store_true',
+                        help="write an uncompressed tar stream instead of a directory tree")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="number of reading threads")
+    parser.add_argument("--direct-io", action='store_true',
+                        help="bypass the page cache of the host (O_DIRECT)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Show debug information")
+    return parser
+
+
+if __name__ == '__main__':
+    _parser = _args_parser()
+    opts = _parser.parse_args()
+    if hasattr(opts, 'verbose'):
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+        del opts.verbose
+    main(**vars(opts))
@@ -0,0 +1,81 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+import logging
+import sys
+
+from ext4 import Filesystem
+
+# Control characters (but tabs) of binary content are escaped, not sent to the terminal
+_ESCAPES = {c: f"\\x{c:02x}" for c in [*range(0x20), 0x7F] if c != 0x09}
+
+
+def main(block_device, pattern, path="/", ignore_case=False, fixed_strings=False, files_with_matches=False,
+         max_size=None, jobs=None, direct_io=False):
+    found = False
+    try:
+        with Filesystem(block_device, direct_io=direct_io) as filesystem:
+            for file_path, offset, line in filesystem.grep(pattern, path, ignore_case=ignore_case,
+                                                           fixed_strings=fixed_strings, max_size=max_size,
+                                                           files_with_matches=files_with_matches, workers=jobs):
+                found = True
+                if files_with_matches:
+                    print(file_path)
+                else:
+                    print(f"{file_path}:{offset}:{line.decode('utf-8', 'backslashreplace').translate(_ESCAPES)}")
+    except PermissionError:
+        print(f"{block_device}: permission denied", file=sys.stderr)
+        sys.exit(2)
+    # Like grep: 1 if nothing matched
+    sys.exit(0 if found else 1)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="grep", description="print the lines of the files matching a pattern, "
+                                                              "with their path and byte offset")
+    parser.add_argument("block_device",
+                        help="Path to the block device containing the ext4 file system")
+    parser.add_argument("pattern", metavar="PATTERN",
+                        help="regular expression (Python syntax) to search")
+    parser.add_argument("path", metavar="PATH", nargs='?', default="/",
+                        help="File or directory to search (default: /)")
+    parser.add_argument("-i", "--ignore-case", action='store_true',
+                        help="ignore case distinctions")
+    parser.add_argument("-F", "--fixed-strings", action='store_true',
+                        help="PATTERN is a string, not a regular expression")
+    parser.add_argument("-l", "--files-with-matches", action='store_true',
+                        help="print only the paths of the files with a match")
+    parser.add_argument("--max-size", type=int, metavar="BYTES",
+                        help="skip bigger files")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of searching processes (default: one per CPU)")
+    parser.add_argument("--direct-io", action='store_true',
+                        help="bypass the page cache of the host (O_DIRECT)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Show debug information")
+    return parser
+
+
+if __name__ == '__main__':
+    _parser = _args_parser()
+    opts = _parser.parse_args()
+    if hasattr(opts, 'verbose'):
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+        del opts.verbose
+    main(**vars(opts))
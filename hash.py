@@ -0,0 +1,66 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import sys
+
+from ext4 import Filesystem
+from ext4.hash import manifest_line
+
+
+def main(block_device, path="/", algorithm="sha256", jobs=8, max_in_flight=64, direct_io=False):
+    try:
+        with Filesystem(block_device, direct_io=direct_io) as filesystem:
+            root = filesystem.get_file(path)
+            for file, digest in filesystem.hash_tree(path, algorithm=algorithm, workers=jobs,
+                                                     max_in_flight=max_in_flight * 1024 * 1024):
+                print(manifest_line(root, file, digest))
+    except PermissionError:
+        print(f"{block_device}: permission denied", file=sys.stderr)
+        sys.exit(1)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="hash", description="print a manifest of the digests of the files "
+                                                              "under a directory (sha256sum format)")
+    parser.add_argument("block_device",
+                        help="Path to the block device containing the ext4 file system")
+    parser.add_argument("path", metavar="PATH", nargs='?', default="/",
+                        help="File or directory to hash (default: /)")
+    parser.add_argument("-a", "--algorithm", default="sha256", choices=sorted(hashlib.algorithms_guaranteed),
+                        help="hash algorithm (default: sha256)")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="number of reading threads, and of hashing threads")
+    parser.add_argument("--max-in-flight", type=int, default=64, metavar="MIB",
+                        help="memory for the data read ahead of the hashing, in MiB")
+    parser.add_argument("--direct-io", action='store_true',
+                        help="bypass the page cache of the host (O_DIRECT)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Show debug information")
+    return parser
+
+
+if __name__ == '__main__':
+    _parser = _args_parser()
+    opts = _parser.parse_args()
+    if hasattr(opts, 'verbose'):
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+        del opts.verbose
+    main(**vars(opts))
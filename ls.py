@@ -17,50 +17,118 @@
 # <https://www.gnu.org/licenses/>.
 
 import datetime
+import functools
 import grp
-import logging
+import os
 import pwd
+import sys
+from stat import S_ISLNK
 
-from ext4 import Filesystem, tools
-import ext4.files
+from ext4 import tools
 
 
-def main(block_device, path, show_hidden=False, long_format=False):
-    with Filesystem(block_device) as filesystem:
+def main(block_device, path, show_hidden=False, long_format=False, stats=False, socket_path=None):
+    socket_path = socket_path or os.environ.get("EXT4D_SOCKET")
+    if socket_path:
+        entries = _list_remote(socket_path, block_device, path)
+    else:
+        entries = _list_local(block_device, path, long_format, stats)
+    if not show_hidden:
+        # Get rid of files starting with .
+        entries = [entry for entry in entries if not entry[0].startswith(".")]
+    entries.sort(key=lambda entry: entry[0].lower())
+
+    # Display
+    if not long_format:
+        for entry in entries:
+            print(entry[0])
+    else:
+        print(f"total {len(entries)}")  # TODO should be number of blocks (?)
+        prefix = path + ("/" if not path.endswith("/") else "")
+        lines = []
+        for filename, mode, nlink, uid, gid, size, mtime_ns, target in entries:
+            fname = prefix + filename
+            if target is not None:
+                fname += " -> " + target
+            lines.append((tools.human_readable_file_type(mode), tools.human_readable_mode(mode), str(nlink),
+                          _user_name(uid), _group_name(gid), str(size), _format_time(mtime_ns // 60000000000),
+                          fname))
+        col_length = [max(len(f) for f in fs) for fs in zip(*lines)]
+        for line in lines:
+            print("{:{}}{:{}} {: >{}} {: >{}} {: >{}} {: >{}} {:{}} {}"
+                  .format(*[c for cc in zip(line, col_length) for c in cc]))
+
+
+# Many files share the same owner, group, or modification minute
+
+@functools.lru_cache(None)
+def _user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+@functools.lru_cache(None)
+def _group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+@functools.lru_cache(4096)
+def _format_time(minutes):
+    return datetime.datetime.fromtimestamp(minutes * 60).strftime("%Y-%m-%d %H:%M")
+
+
+def _list_local(block_device, path, long_format, stats):
+    """Return (filename,) tuples or, in long format, (filename, mode, nlink,
+    uid, gid, size, mtime_ns, symbolic link target) tuples"""
+    from ext4 import Filesystem
+    from ext4.files import Directory, SymbolicLink
+    filesystem = Filesystem(block_device)
+    if stats:
+        from ext4.stats import Stats
+        filesystem.stats = Stats()
+    with filesystem:
         # Obtaining list of files to display
         file = filesystem.get_file(path)
-        if isinstance(file, ext4.files.Directory):
-            files = list(file.get_files())
-            if not show_hidden:
-                # Get rid of files starting with .
-                files = list(filter(lambda file: not file.filename.startswith("."), files))
-        else:
-            files = [file]
-
-        # Display
         if not long_format:
-            for file in sorted(files, key=lambda file: file.filename.lower()):
-                print(file.filename)
+            files = file.get_files() if isinstance(file, Directory) else [file]
+            entries = [(file.filename,) for file in files]
         else:
-            print(f"total {len(files)}")  # TODO should be number of blocks (?)
-            lines = []
-            for file in sorted(files, key=lambda file: file.filename.lower()):
-                stat = file.get_stat()
-                file_type = tools.human_readable_file_type(stat.st_mode)
-                rights = tools.human_readable_mode(stat.st_mode)
-                mtime = datetime.datetime.fromtimestamp(stat.st_mtime) \
-                    .strftime("%Y-%m-%d %H:%M")
-                owner = pwd.getpwuid(stat.st_uid).pw_name
-                group = grp.getgrgid(stat.st_gid).gr_name
-                fname = str(path + ("/" if not path.endswith("/") else "") + file.filename)
-                if isinstance(file, ext4.files.SymbolicLink):
-                    fname += " -> " + file.get_target()
-                lines.append((file_type, rights, str(stat.st_nlink),
-                              owner, group, str(stat.st_size), mtime, fname))
-            col_length = [max(len(f) for f in fs) for fs in zip(*lines)]
-            for line in lines:
-                print("{:{}}{:{}} {: >{}} {: >{}} {: >{}} {: >{}} {:{}} {}"
-                      .format(*[c for cc in zip(line, col_length) for c in cc]))
+            # Stats of all entries at once, decoded in bulk
+            if isinstance(file, Directory):
+                table = file.stat_all()
+            else:
+                table = filesystem.stat_many([file.inode_no])
+                table.names = [file.filename]
+            entries = []
+            for filename, mode, nlink, uid, gid, size, mtime_ns, inode_no in zip(
+                    table.names, table.mode, table.nlink, table.uid, table.gid, table.size, table.mtime_ns,
+                    table.ino):
+                target = None
+                if S_ISLNK(mode):
+                    inode = filesystem.get_inode(inode_no)
+                    target = SymbolicLink(filesystem, file.path.rstrip("/") + "/" + filename, inode_no, inode).get_target()
+                entries.append((filename, mode, nlink, uid, gid, size, mtime_ns, target))
+    if filesystem.stats is not None:
+        print(filesystem.stats.summary(), file=sys.stderr)
+    return entries
+
+
+def _list_remote(socket_path, block_device, path):
+    """Same as `_list_local()`, through ext4d"""
+    from ext4.client import Client
+    try:
+        with Client(socket_path) as client:
+            return [(name, stat.st_mode, stat.st_nlink, stat.st_uid, stat.st_gid, stat.st_size, stat.st_mtime_ns,
+                     target if S_ISLNK(stat.st_mode) else None)
+                    for name, stat, target in client.list(block_device, path)]
+    except OSError as e:
+        print(f"ls: {e.strerror}", file=sys.stderr)
+        sys.exit(1)
 
 
 def _args_parser():
@@ -74,15 +142,27 @@ def _args_parser():
                         help="use a long listing format")
     parser.add_argument("-v", "--verbose", action='store_true',
                         help="Show debug information")
+    parser.add_argument("--stats", action='store_true',
+                        help="Print I/O and parsing statistics on the standard error")
+    parser.add_argument("-s", "--socket", dest="socket_path",
+                        help="List through the ext4d server listening on this socket "
+                             "(default: $EXT4D_SOCKET if set, else read the device directly)")
     parser.add_argument("path", metavar="FILE",
                         help="List information about the FILE")
     return parser
 
 
 if __name__ == '__main__':
+    if len(sys.argv) == 3 and not any(arg.startswith("-") for arg in sys.argv[1:]):
+        # Plain invocation, the common case in scripts: skip argparse, which
+        # is slow to import and to set up
+        main(*sys.argv[1:])
+        sys.exit()
     _parser = _args_parser()
     opts = _parser.parse_args()
     if hasattr(opts, 'verbose'):
-        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+        if opts.verbose:  # Not imported otherwise: logging is slow to import
+            import logging
+            logging.basicConfig(level=logging.INFO)
         del opts.verbose
     main(**vars(opts))
@@ -0,0 +1,82 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Fixtures building small images with `mkfs.ext4 -d` (from e2fsprogs),
+from a tree of files written by the test."""
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+
+def require_tool(name):
+    if shutil.which(name) is None:
+        pytest.skip(f"{name} is not available")
+
+
+def write_tree(root, tree):
+    """Create the files of `tree`, a {relative path: content} dict.  The
+    content is bytes, None for a directory, or a function writing the file
+    at the path given as argument (e.g. a sparse file)."""
+    os.makedirs(root, exist_ok=True)
+    for name, content in tree.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if content is None:
+            os.makedirs(path, exist_ok=True)
+        elif callable(content):
+            content(path)
+        else:
+            with open(path, "wb") as f:
+                f.write(content)
+
+
+def read_tree(root):
+    """{relative path: content} of the regular files under `root`"""
+    tree = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                tree[os.path.relpath(path, root)] = f.read()
+    return tree
+
+
+def run_debugfs(image, *commands, write=False):
+    """Run debugfs `commands` on `image`, return their output"""
+    require_tool("debugfs")
+    args = ["debugfs"] + (["-w"] if write else []) + ["-f", "-", image]
+    result = subprocess.run(args, input="\n".join(commands) + "\n", capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+@pytest.fixture
+def make_image(tmp_path):
+    """Build an image of `block_size` blocks from a tree (see
+    `write_tree()`) with mkfs.ext4, extra `options` being passed to it.  Return its path; the tree is in
+    `<path>.src`."""
+    def make(tree, *options, size="16M", block_size=4096, name="image.ext4"):
+        require_tool("mkfs.ext4")
+        image = str(tmp_path / name)
+        write_tree(image + ".src", tree)
+        subprocess.run(["mkfs.ext4", "-q", "-F", "-b", str(block_size), *options, "-d", image + ".src", image, size],
+                       check=True, capture_output=True)
+        return image
+    return make
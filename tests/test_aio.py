@@ -0,0 +1,89 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Reads through the asyncio facade"""
+
+import asyncio
+import os
+import time
+
+from ext4.aio import AsyncFilesystem
+
+MiB = 1024 * 1024
+
+
+def _sparse(path):
+    with open(path, "wb") as f:
+        f.write(b"head")
+        f.seek(3 * MiB)
+        f.write(b"tail")
+
+
+TREE = {"big": os.urandom(2 * MiB + 100), "sparse": _sparse, "dir/a": b"a", "dir/b": b"b"}
+
+
+def test_contents(make_image):
+    image = make_image(TREE)
+
+    async def read():
+        async with AsyncFilesystem(image, max_workers=4) as fs:
+            big = await fs.get_file("/big")
+            sparse = await fs.get_file("/sparse")
+            names = [file.filename async for file in fs.iterdir("/dir", batch=1)]
+            return (names, await fs.get_bytes(big), await fs.get_bytes(big, 1000, 1 * MiB + 7),
+                    await fs.get_bytes(sparse), [len(chunk) async for chunk in fs.iter_bytes(sparse, chunk_blocks=64)])
+
+    names, big, part, sparse, chunks = asyncio.run(read())
+    assert sorted(names) == [".", "..", "a", "b"]
+    assert big == TREE["big"] and part == TREE["big"][1000:MiB + 7]
+    assert sparse == b"head" + bytes(3 * MiB - 4) + b"tail"
+    # The hole is made of chunks of zeros, of at most 64 blocks
+    assert sum(chunks) == 3 * MiB + 4 and max(chunks) <= 64 * 4096
+
+
+def test_inline_data(make_image):
+    image = make_image({"tiny": b"inline"}, "-O", "inline_data")
+
+    async def read():
+        async with AsyncFilesystem(image) as fs:
+            return await fs.get_bytes(await fs.get_file("/tiny"), 1)
+
+    assert asyncio.run(read()) == b"nline"
+
+
+def test_concurrent_reads_are_shared(make_image):
+    image = make_image(TREE)
+    calls = []
+
+    async def read():
+        async with AsyncFilesystem(image, max_workers=4) as fs:
+            file = await fs.get_file("/big")
+            get_block = fs.filesystem.get_block
+
+            def slow_get_block(index, n=1):
+                calls.append((index, n))
+                time.sleep(0.05)
+                return get_block(index, n)
+
+            fs.filesystem.get_block = slow_get_block
+            return await asyncio.gather(*(fs.get_bytes(file) for _ in range(5)))
+
+    contents = asyncio.run(read())
+    assert all(content == TREE["big"] for content in contents)
+    # Each block read once, by the first reader
+    assert calls and len(calls) == len(set(calls))
@@ -0,0 +1,85 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Reverse block map, checked against the block lists of debugfs"""
+
+import os
+
+import pytest
+
+from ext4 import Filesystem
+from ext4.block_map import BlockMap, OwnerKind
+from conftest import run_debugfs
+
+TREE = {"a": os.urandom(50000), "dir/b": os.urandom(300000), "dir/small": b"x"}
+
+
+def _blocks(image, path):
+    return [int(block_no) for block_no in run_debugfs(image, f"blocks {path}").splitlines()[-1].split()]
+
+
+def _inode_no(filesystem, path):
+    return filesystem.get_file(path).inode_no
+
+
+@pytest.mark.parametrize("options, block_size", [((), 4096), (("-t", "ext3"), 1024)], ids=["extents", "indirect"])
+def test_lookup(make_image, options, block_size):
+    image = make_image(TREE, *options, block_size=block_size)
+    with Filesystem(image) as filesystem:
+        block_map = filesystem.build_block_map()
+        for path in ("/a", "/dir/b", "/dir/small"):
+            inode_no = _inode_no(filesystem, path)
+            data = [(kind, logical) for block_no in _blocks(image, path)
+                    for kind, owner, logical in block_map.lookup(block_no) if owner == inode_no]
+            # debugfs lists the mapping blocks too
+            assert [logical for kind, logical in data if kind == OwnerKind.DATA] \
+                == list(range(-(-len(TREE[path[1:]]) // block_size)))
+            assert all(kind in (OwnerKind.DATA, OwnerKind.MAPPING) for kind, _ in data)
+        superblock_block = 1 if block_size == 1024 else 0
+        assert block_map.lookup(superblock_block) == [(OwnerKind.SUPERBLOCK, 0, 0)]
+        bgd = filesystem.get_block_group_desc(0)
+        assert block_map.lookup(bgd.get_inode_table_loc() + 1) \
+            == [(OwnerKind.INODE_TABLE, 1 + block_size // filesystem.conf.s_inode_size, -1)]
+        assert block_map.lookup(bgd.get_bg_inode_bitmap_loc()) == [(OwnerKind.INODE_BITMAP, 0, 0)]
+        assert list(block_map.shared_runs()) == []
+
+
+def test_save_and_load(make_image, tmp_path):
+    image = make_image(TREE)
+    other = make_image(TREE, name="other.ext4")
+    path = str(tmp_path / "map.bmap")
+    with Filesystem(image) as filesystem:
+        block_map = filesystem.build_block_map()
+        block_map.save(path)
+        loaded = BlockMap.load(path, filesystem)
+        for block_no in range(filesystem.conf.get_blocks_count()):
+            assert loaded.lookup(block_no) == block_map.lookup(block_no)
+    with Filesystem(other) as filesystem:
+        with pytest.raises(ValueError):
+            BlockMap.load(path, filesystem)
+
+
+def test_shared_blocks(make_image):
+    """A block of a file also mapped by another one (e.g. corruption)"""
+    image = make_image(TREE, "-t", "ext3", block_size=1024)
+    shared = _blocks(image, "/a")[3]
+    run_debugfs(image, f"sif /dir/small block[0] {shared}", write=True)
+    with Filesystem(image) as filesystem:
+        a, small = _inode_no(filesystem, "/a"), _inode_no(filesystem, "/dir/small")
+        runs = list(filesystem.build_block_map().shared_runs())
+    assert runs == [(shared, 1, [(OwnerKind.DATA, a, 3), (OwnerKind.DATA, small, 0)])]
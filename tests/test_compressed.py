@@ -0,0 +1,131 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Compressed images read in place: gzip members and zstd frames"""
+
+import gzip
+import os
+import pathlib
+import struct
+import sys
+
+import pytest
+
+from ext4 import Filesystem
+from ext4.compressed import GzipImage, ZstdImage, open_image
+
+FRAME_SIZE = 256 * 1024
+TREE = {"dir/file": os.urandom(300000), "zeros": bytes(100000), "small": b"x"}
+
+
+def _frames(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return [data[i:i + FRAME_SIZE] for i in range(0, len(data), FRAME_SIZE)]
+
+
+def _check_image(compressed, plain, image_class):
+    with Filesystem(compressed) as filesystem, Filesystem(plain) as reference:
+        assert isinstance(filesystem.image, image_class)
+        for path in TREE:
+            assert filesystem.get_file("/" + path).content.get_bytes() \
+                == reference.get_file("/" + path).content.get_bytes()
+        # Reads straddling frames
+        for offset in (FRAME_SIZE - 100, 3 * FRAME_SIZE - 1):
+            assert filesystem.get_bytes(offset, 200) == reference.get_bytes(offset, 200)
+
+
+def test_gzip_members(make_image, monkeypatch):
+    monkeypatch.setitem(sys.modules, "indexed_gzip", None)  # Members are frames only without it
+    plain = make_image(TREE, size="4M")
+    compressed = plain + ".gz"
+    with open(compressed, "wb") as f:
+        for frame in _frames(plain):
+            f.write(gzip.compress(frame))
+    _check_image(compressed, plain, GzipImage)
+    # The index built by the first opening is reused
+    assert os.path.exists(compressed + ".ext4idx")
+    _check_image(compressed, plain, GzipImage)
+
+
+def test_path_like_image(make_image, monkeypatch):
+    monkeypatch.setitem(sys.modules, "indexed_gzip", None)
+    plain = make_image(TREE, size="4M")
+    compressed = pathlib.Path(plain + ".gz")
+    compressed.write_bytes(b"".join(gzip.compress(frame) for frame in _frames(plain)))
+    fd = os.open(compressed, os.O_RDONLY)
+    try:
+        image = open_image(compressed, fd)
+        assert isinstance(image, GzipImage)
+        assert image.pread(100, 0x400) == open(plain, "rb").read()[0x400:0x464]
+    finally:
+        os.close(fd)
+    assert os.path.exists(plain + ".gz.ext4idx")
+
+
+def test_single_gzip_member(make_image):
+    pytest.importorskip("indexed_gzip")
+    plain = make_image(TREE, size="4M")
+    compressed = plain + ".gz"
+    with open(compressed, "wb") as f:
+        f.write(gzip.compress(open(plain, "rb").read()))
+    from ext4.compressed import IndexedGzipImage
+    _check_image(compressed, plain, IndexedGzipImage)
+    assert os.path.exists(compressed + ".gzidx")
+    fd = os.open(compressed, os.O_RDONLY)
+    try:
+        assert isinstance(open_image(pathlib.Path(compressed), fd), IndexedGzipImage)  # Index reused
+    finally:
+        os.close(fd)
+
+
+def test_stale_gzip_index(make_image, caplog):
+    """The index of an earlier version of the image is not used"""
+    pytest.importorskip("indexed_gzip")
+    from ext4.compressed import IndexedGzipImage
+    compressed = make_image(TREE, size="4M", name="first.ext4") + ".gz"
+    with open(compressed, "wb") as f:
+        f.write(gzip.compress(open(compressed[:-3], "rb").read()))
+    with Filesystem(compressed) as filesystem:
+        assert isinstance(filesystem.image, IndexedGzipImage)
+    second = make_image({"other": os.urandom(1000000)}, size="4M", name="second.ext4")
+    with open(compressed, "wb") as f:
+        f.write(gzip.compress(open(second, "rb").read()))
+    with Filesystem(compressed) as filesystem, Filesystem(second) as reference:
+        assert filesystem.get_file("/other").content.get_bytes() \
+            == reference.get_file("/other").content.get_bytes()
+    assert "stale or invalid index" in caplog.text
+
+
+@pytest.mark.parametrize("seek_table", [True, False], ids=["seekable", "scanned"])
+def test_zstd_frames(make_image, seek_table):
+    zstandard = pytest.importorskip("zstandard")
+    plain = make_image(TREE, size="4M")
+    compressed = plain + ".zst"
+    sizes = []
+    with open(compressed, "wb") as f:
+        for frame in _frames(plain):
+            data = zstandard.ZstdCompressor().compress(frame)
+            f.write(data)
+            sizes.append((len(data), len(frame)))
+        if seek_table:
+            table = b"".join(struct.pack("<II", *size) for size in sizes) + struct.pack("<IBI", len(sizes), 0,
+                                                                                        0x8F92EAB1)
+            f.write(struct.pack("<II", 0x184D2A5E, len(table)) + table)
+    _check_image(compressed, plain, ZstdImage)
+    assert os.path.exists(compressed + ".ext4idx") != seek_table
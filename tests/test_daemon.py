@@ -0,0 +1,113 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""`ext4d` round trips: a server in a thread, queried by `Client`"""
+
+import errno
+import http.server
+import os
+import threading
+
+import pytest
+
+from ext4 import protocol
+from ext4.client import Client
+from ext4.daemon import Server
+from ext4.http_image import HttpImage
+from benchmarks.http_server import RangeRequestHandler
+
+TREE = {"dir/a": b"first", "dir/sub/b": os.urandom(600000), "empty": None}
+
+
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def serve(*images, cache_size=None):
+        socket_path = str(tmp_path / "ext4d.sock")
+        server = Server(socket_path, images, cache_size)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return socket_path
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("cache_size", [None, 1024 * 1024])
+def test_round_trip(make_image, serve, cache_size):
+    image = make_image(TREE)
+    content = TREE["dir/sub/b"]
+    with Client(serve(image, cache_size=cache_size)) as client:
+        path, stat, target = client.stat(image, "/dir/sub/b")
+        assert path == "b" and stat.st_size == len(content) and target == ""
+        assert sorted(name for name, _, _ in client.list(image, "/dir")) == [".", "..", "a", "sub"]
+        assert sorted(path for path, _, _ in client.walk(image, "/dir")) == ["/dir/a", "/dir/sub", "/dir/sub/b"]
+        assert client.get_bytes(image, "/dir/sub/b") == content
+        assert client.get_bytes(image, "/dir/sub/b", 300000, 300010) == content[300000:300010]
+        # Paths are normalized, and images named by any path to them
+        relative = os.path.relpath(image)
+        assert client.get_bytes(relative, "/dir/../dir/a") == b"first"
+
+
+def test_errors(make_image, serve, tmp_path):
+    image = make_image(TREE)
+    with Client(serve(image)) as client:
+        with pytest.raises(OSError) as error:
+            client.stat(image, "/missing")
+        assert error.value.errno == errno.ENOENT
+        with pytest.raises(OSError) as error:
+            client.get_bytes(image, "/dir")
+        assert error.value.errno == errno.EISDIR
+        with pytest.raises(OSError) as error:
+            client.stat(str(tmp_path / "other.ext4"), "/")
+        assert error.value.errno == errno.ENOENT
+        # The connection is still usable
+        assert client.get_bytes(image, "/dir/a") == b"first"
+
+
+def test_malformed_request(make_image, serve, monkeypatch):
+    """Unexpected errors, even before the request is decoded, are answered"""
+    image = make_image(TREE)
+
+    def unpack_request(payload):
+        raise RuntimeError("malformed")
+
+    monkeypatch.setattr(protocol, "unpack_request", unpack_request)
+    with Client(serve(image)) as client:
+        with pytest.raises(OSError) as error:
+            client.stat(image, "/")
+        assert error.value.errno == errno.EIO and "malformed" in error.value.strerror
+
+
+def test_http_image(make_image, serve, monkeypatch, tmp_path):
+    monkeypatch.setattr(HttpImage, "cache_dir", str(tmp_path / "cache"))
+    image = make_image(TREE)
+    directory, name = os.path.split(image)
+    http_server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                  lambda *args: RangeRequestHandler(*args, directory=directory))
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{http_server.server_address[1]}/{name}"
+        with Client(serve(url)) as client:
+            assert client.get_bytes(url, "/dir/a") == b"first"
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
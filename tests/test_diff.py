@@ -0,0 +1,95 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Snapshot diff: the second snapshot is a copy of the first one, changed
+by debugfs"""
+
+import shutil
+
+from ext4 import Filesystem
+from ext4.diff import ChangeKind, DentryIndex
+from conftest import run_debugfs
+
+TREE = {"kept": b"same", "edited": b"old content", "chmoded": b"x", "moved/file": b"y", "gone": b"z",
+        "olddir/a": b"a", "olddir/b": b"b"}
+
+
+def _snapshots(make_image, tmp_path, *commands):
+    old = make_image(TREE)
+    new = str(tmp_path / "new.ext4")
+    shutil.copyfile(old, new)
+    run_debugfs(new, *commands, write=True)
+    return old, new
+
+
+def _changes(result):
+    return {(change.kind.name, tuple(change.old_paths), tuple(change.paths)): change.fields
+            for change in result.changes}
+
+
+def test_diff(make_image, tmp_path):
+    added = tmp_path / "added"
+    added.write_bytes(b"new file")
+    old, new = _snapshots(make_image, tmp_path,
+                          f"write {added} added",
+                          "mkdir newdir",
+                          "rm gone",
+                          "sif chmoded mode 0100600",
+                          "sif edited size 3",
+                          "sif edited mtime 20200101000000",
+                          "ln moved/file renamed", "unlink moved/file",
+                          # Times debugfs leaves alone, where the kernel updates them
+                          "sif renamed ctime 20200101000000",
+                          "sif moved mtime 20200101000000",
+                          "sif / mtime 20200101000000")
+    with Filesystem(old) as old_filesystem, Filesystem(new) as new_filesystem:
+        result = old_filesystem.diff(new_filesystem)
+        changes = _changes(result)
+        # The parent directories of changed entries changed as well
+        assert changes == {
+            ("ADDED", (), ("/added",)): frozenset(),
+            ("ADDED", (), ("/newdir",)): frozenset(),
+            ("DELETED", (), ("/gone",)): frozenset(),
+            ("MODIFIED", ("/chmoded",), ("/chmoded",)): {"metadata"},
+            ("MODIFIED", ("/edited",), ("/edited",)): {"content"},
+            ("MODIFIED", ("/moved/file",), ("/renamed",)): {"metadata"},
+            ("MODIFIED", ("/",), ("/",)): {"content", "metadata"},
+            ("MODIFIED", ("/moved",), ("/moved",)): {"content"},
+        }
+        # The updated index is the one of the new snapshot
+        assert result.index.entries == DentryIndex.build(new_filesystem).entries
+
+
+def test_reused_inode_of_another_type(make_image, tmp_path):
+    # debugfs reuses the inode of the deleted file, with the same generation
+    old, new = _snapshots(make_image, tmp_path, "rm gone", "mkdir newdir")
+    with Filesystem(old) as old_filesystem, Filesystem(new) as new_filesystem:
+        assert new_filesystem.get_file("/newdir").inode_no == old_filesystem.get_file("/gone").inode_no
+        changes = _changes(old_filesystem.diff(new_filesystem))
+        assert changes == {
+            ("DELETED", (), ("/gone",)): frozenset(),
+            ("ADDED", (), ("/newdir",)): frozenset(),
+            ("MODIFIED", ("/",), ("/",)): {"metadata"},
+        }
+
+
+def test_identical_snapshots(make_image, tmp_path):
+    old, new = _snapshots(make_image, tmp_path)
+    with Filesystem(old) as old_filesystem, Filesystem(new) as new_filesystem:
+        result = old_filesystem.diff(new_filesystem)
+        assert result.changes == [] and result.blocks_allocated == result.blocks_freed == 0
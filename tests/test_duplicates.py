@@ -0,0 +1,46 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Duplicate files, found by size, then samples, then full digests"""
+
+import os
+
+from ext4 import Filesystem
+
+BLOCK = 4096
+BIG = os.urandom(10 * BLOCK)
+# Same size, first and last blocks as BIG: only a full digest tells
+NEAR = BIG[:5 * BLOCK] + b"x" + BIG[5 * BLOCK + 1:]
+
+TREE = {"big1": BIG, "dir/big2": BIG, "dir/big3": BIG, "near": NEAR, "small1": b"same", "small2": b"same",
+        "other": b"diff", "empty1": b"", "empty2": b""}
+
+
+def _groups(groups):
+    return [(group.size, sorted(sorted(file.path for file in files) for files in group.copies))
+            for group in groups]
+
+
+def test_find_duplicates(make_image):
+    image = make_image(TREE)
+    with Filesystem(image) as filesystem:
+        groups = filesystem.find_duplicates(workers=2)
+        assert _groups(groups) == [(len(BIG), [["/big1"], ["/dir/big2"], ["/dir/big3"]]),
+                                   (4, [["/small1"], ["/small2"]])]
+        assert groups[0].wasted_bytes == 2 * len(BIG)
+        assert _groups(filesystem.find_duplicates("/dir", min_size=5)) == [(len(BIG), [["/dir/big2"], ["/dir/big3"]])]
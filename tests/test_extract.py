@@ -0,0 +1,84 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Extraction of subtrees to a local directory and to a tar stream"""
+
+import io
+import os
+import tarfile
+
+from ext4 import Filesystem
+from conftest import read_tree, run_debugfs
+
+MiB = 1024 * 1024
+
+
+def _sparse(path):
+    with open(path, "wb") as f:
+        f.write(b"head")
+        f.seek(2 * MiB)
+        f.write(b"tail")
+
+
+TREE = {"top": b"top", "d/f": b"file", "d/e/n0": b"n0", "d/e/sparse": _sparse, "d/empty": None}
+
+
+def test_extract_to_directory(make_image, tmp_path):
+    image = make_image(TREE)
+    run_debugfs(image, "symlink /d/link e/n0", "sif /d/e/n0 mode 0100640", "sif /d/e/n0 mtime 20200102030405",
+                write=True)
+    dst = tmp_path / "out"
+    with Filesystem(image) as filesystem:
+        filesystem.extract("/d", str(dst), workers=2)
+        expected = read_tree(image + ".src/d")
+        expected["link"] = b"n0"  # Followed by read_tree
+        assert read_tree(dst) == expected
+        assert os.path.isdir(dst / "empty")
+        assert os.readlink(dst / "link") == "e/n0"
+        stat = os.stat(dst / "e/n0")
+        assert stat.st_mode == 0o100640
+        assert stat.st_mtime_ns == filesystem.get_file("/d/e/n0").get_stat().st_mtime_ns
+        assert stat.st_mtime_ns // 10 ** 9 == 1577934245
+        # Holes are not written
+        sparse = os.stat(dst / "e/sparse")
+        assert sparse.st_size == 2 * MiB + 4 and sparse.st_blocks * 512 < MiB
+
+
+def test_extract_to_tar(make_image):
+    image = make_image(TREE)
+    stream = io.BytesIO()
+    with Filesystem(image) as filesystem:
+        filesystem.extract("/d", stream, tar=True, workers=2)
+    stream.seek(0)
+    with tarfile.open(fileobj=stream) as tar:
+        members = {member.name: member for member in tar.getmembers()}
+        assert sorted(members) == [".", "e", "e/n0", "e/sparse", "empty", "f"]
+        assert members["."].isdir() and members["e"].isdir()
+        assert tar.extractfile(members["e/n0"]).read() == b"n0"
+        assert tar.extractfile(members["e/sparse"]).read() == b"head" + bytes(2 * MiB - 4) + b"tail"
+
+
+def test_extract_file_to_tar(make_image):
+    image = make_image(TREE)
+    stream = io.BytesIO()
+    with Filesystem(image) as filesystem:
+        filesystem.extract("/d/f", stream, tar=True)
+    stream.seek(0)
+    with tarfile.open(fileobj=stream) as tar:
+        assert tar.getnames() == ["f"]
+        assert tar.extractfile("f").read() == b"file"
@@ -0,0 +1,152 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""File contents read back from images built by mkfs.ext4 (see conftest.py)"""
+
+import os
+import pathlib
+import random
+
+import pytest
+
+from ext4 import Filesystem
+from ext4.files import (DirectIndirectFileContent, ExtentTreeFileContent, InlineDirectory, InlineFileContent,
+                        RegularFile)
+from conftest import read_tree, run_debugfs
+
+MiB = 1024 * 1024
+
+
+def _random_bytes(n, seed):
+    return random.Random(seed).randbytes(n)
+
+
+def _sparse(*writes, size=None):
+    """A function writing a sparse file made of (offset, data) `writes`"""
+    def write(path):
+        with open(path, "wb") as f:
+            for offset, data in writes:
+                f.seek(offset)
+                f.write(data)
+            if size is not None:
+                f.truncate(size)
+    return write
+
+
+def _read_image_tree(filesystem):
+    """{relative path: content} of the regular files of the image"""
+    root = filesystem.get_root_dir()
+    return {file.path[1:]: file.content.get_bytes() for file in root.walk()
+            if isinstance(file, RegularFile) and not file.path.startswith("/lost+found")}
+
+
+TREE = {
+    "empty": b"",
+    "small.txt": b"hello\n",
+    "a/b/c/block.bin": _random_bytes(4096, 1),
+    "a/b/unaligned.bin": _random_bytes(3 * 4096 + 17, 2),
+    "a/big.bin": _random_bytes(MiB + 123, 3),
+    "holes/middle": _sparse((0, b"head"), (2 * MiB, b"tail")),
+    "holes/leading": _sparse((MiB + 5, b"data")),
+    "holes/trailing": _sparse((0, b"data"), size=3 * MiB),
+    "holes/only": _sparse(size=MiB),
+}
+
+
+@pytest.mark.parametrize("options", [(), ("-O", "^metadata_csum,64bit")], ids=["default", "64bit"])
+def test_contents(make_image, options):
+    image = make_image(TREE, *options)
+    with Filesystem(image) as filesystem:
+        assert _read_image_tree(filesystem) == read_tree(image + ".src")
+        assert isinstance(filesystem.get_file("/a/big.bin").content, ExtentTreeFileContent)
+
+
+def test_path_like_image(make_image):
+    image = make_image({"small.txt": b"hello\n"})
+    with Filesystem(pathlib.Path(image)) as filesystem:
+        assert filesystem.block_device == image
+        assert filesystem.get_file("/small.txt").content.get_bytes() == b"hello\n"
+    with Filesystem(os.fsencode(image)) as filesystem:
+        assert filesystem.get_file("/small.txt").content.get_bytes() == b"hello\n"
+
+
+def test_holes_are_not_read(make_image):
+    image = make_image(TREE)
+    with Filesystem(image) as filesystem:
+        content = filesystem.get_file("/holes/middle").content
+        assert list(content.iter_ranges()) == [(0, 4096, True), (4096, 2 * MiB - 4096, False),
+                                               (2 * MiB, 4, True)]
+        assert [offset for offset, _ in content.iter_data()] == [0, 2 * MiB]
+        assert content.seek_data(5) == 5 and content.seek_hole(5) == 4096
+        assert content.seek_data(4096) == 2 * MiB
+        only = filesystem.get_file("/holes/only").content
+        assert list(only.iter_data()) == [] and only.get_bytes() == bytes(MiB)
+
+
+def test_unwritten_extents(make_image):
+    image = make_image({"prealloc": b""})
+    # Preallocated blocks, never written: they read as zeros
+    run_debugfs(image, "fallocate /prealloc 0 9", "sif /prealloc size 40960", write=True)
+    with Filesystem(image) as filesystem:
+        content = filesystem.get_file("/prealloc").content
+        assert [initialized for _, _, _, initialized in content.get_extents()] == [False]
+        assert list(content.iter_ranges()) == [(0, 40960, False)]
+        assert content.get_bytes() == bytes(40960)
+
+
+def test_indirect_mapping(make_image):
+    tree = {
+        "direct": _random_bytes(12 * 1024, 4),
+        "single": _random_bytes(200 * 1024, 5),
+        "double": _random_bytes(400 * 1024, 6),  # Beyond 12 + 256 blocks of 1 KiB
+        "triple": _sparse((0, b"start"), (70 * MiB, b"end")),  # Beyond 12 + 256 + 256² blocks
+        "sparse": _sparse((300 * 1024, b"x" * 5000)),
+    }
+    image = make_image(tree, "-t", "ext3", block_size=1024, size="32M")
+    with Filesystem(image) as filesystem:
+        assert _read_image_tree(filesystem) == read_tree(image + ".src")
+        content = filesystem.get_file("/triple").content
+        assert isinstance(content, DirectIndirectFileContent)
+        assert [offset for offset, _ in content.iter_data()] == [0, 70 * MiB]
+        # Indirect blocks of the triple indirection: one per level
+        assert len(list(content.get_mapping_blocks_no())) == 3
+
+
+def test_inline_data(make_image):
+    tree = {"tiny": b"inline", "empty": b"", "not_inline": _random_bytes(5000, 7), "dir/a": b"1", "dir/b": b"22"}
+    image = make_image(tree, "-O", "inline_data")
+    with Filesystem(image) as filesystem:
+        assert _read_image_tree(filesystem) == read_tree(image + ".src")
+        assert isinstance(filesystem.get_file("/tiny").content, InlineFileContent)
+        directory = filesystem.get_file("/dir")
+        assert isinstance(directory, InlineDirectory)
+        assert sorted(file.filename for file in directory.get_files()) == [".", "..", "a", "b"]
+
+
+def test_generated_image(tmp_path):
+    """Hash-tree directories and a deep extent tree, from the benchmark generator"""
+    from benchmarks.image import expected_content, make_image
+    image = str(tmp_path / "generated.ext4")
+    make_image(image, files=2000, fanout=2, depth=1, file_size=(0, 6000), big_file_size=8 * MiB,
+               big_file_fragments=600, seed=3)
+    with Filesystem(image) as filesystem:
+        files = [file for file in filesystem.get_root_dir().walk() if isinstance(file, RegularFile)]
+        assert len(files) == 2001
+        for file in files:
+            assert file.content.get_bytes() == expected_content(file.inode_no, file.inode.get_size())
+        assert os.path.basename(files[0].path) == "big.bin"
@@ -0,0 +1,67 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Search of the file contents, in the process and by a pool of workers"""
+
+import re
+
+from ext4 import Filesystem
+from ext4.grep import grep
+from ext4.pool import CachePool
+from conftest import run_debugfs
+
+TREE = {"a": b"nothing here\nsecret: one", "b": b"secret: two", "dir/c": b"no\n" * 1000 + b"secret: three"}
+
+
+def _grep(image, workers, **kwargs):
+    with Filesystem(image, **kwargs) as filesystem:
+        return sorted(grep(filesystem, re.escape(b"secret: "), workers=workers))
+
+
+def test_workers(make_image):
+    image = make_image(TREE)
+    expected = [("/a", 13, b"secret: one"), ("/b", 0, b"secret: two"), ("/dir/c", 3000, b"secret: three")]
+    assert _grep(image, 1) == expected
+    assert _grep(image, 2) == expected
+    assert _grep(image, 2, pool=CachePool(1024 * 1024)) == expected
+
+
+def test_workers_follow_journal_replay(make_image, tmp_path):
+    """Workers replay the journal only if the parent does"""
+    image = make_image(TREE)
+    block_no = int(run_debugfs(image, "bmap /b 0").split()[-1])
+    replacement = tmp_path / "block"
+    replacement.write_bytes(b"secret: new\n".ljust(4096, b"\0"))
+    run_debugfs(image, "jo", f"jw -b {block_no} {replacement}", "jc", write=True)
+    replayed = [path for path, _, line in _grep(image, 2) if line == b"secret: new"]
+    in_place = [path for path, _, line in _grep(image, 2, replay_journal=False) if line == b"secret: two"]
+    assert replayed == ["/b"] and in_place == ["/b"]
+    assert _grep(image, 1, replay_journal=False) == _grep(image, 2, replay_journal=False)
+
+
+def test_offsets_are_the_ones_of_the_lines(make_image):
+    """As `grep -b`: the offset of the matching line, or of the returned
+    part of a long line"""
+    long_line = b"x" * 10000 + b"needle" + b"y" * 10000
+    image = make_image({"short": b"first line\nthe needle, mid-line\n", "long": b"head\n" + long_line})
+    with Filesystem(image) as filesystem:
+        found = {path: (offset, line) for path, offset, line in grep(filesystem, b"needle", workers=1)}
+    assert found["/short"] == (11, b"the needle, mid-line")
+    offset, line = found["/long"]
+    assert b"needle" in line and len(line) <= 256
+    assert (b"head\n" + long_line)[offset:offset + len(line)] == line
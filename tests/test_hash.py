@@ -0,0 +1,51 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Digests of subtrees, against the digests of their source tree"""
+
+import hashlib
+import os
+
+from ext4 import Filesystem
+from ext4.hash import manifest_line
+from conftest import read_tree
+
+
+def _hole(path):
+    with open(path, "wb") as f:
+        f.truncate(10 ** 6)
+
+
+TREE = {"a/one": os.urandom(3 * 1024 * 1024 + 5), "a/two": b"2", "b/sparse": _hole, "b/c/three": os.urandom(4096),
+        "back\\slash": b"escaped", "empty": b""}
+
+
+def test_hash_tree(make_image):
+    image = make_image(TREE)
+    expected = {path: hashlib.sha256(content).hexdigest() for path, content in read_tree(image + ".src").items()}
+    with Filesystem(image) as filesystem:
+        root = filesystem.get_file("/")
+        # Small chunks and budget: files are read ahead over several chunks
+        digests = {manifest_line(root, file, digest).split("  ", 1)[1]: digest
+                   for file, digest in filesystem.hash_tree(max_in_flight=256 * 1024)
+                   if not file.path.startswith("/lost+found")}
+        assert digests.pop("back\\\\slash") == expected.pop("back\\slash")
+        assert digests == expected
+        subtree = filesystem.get_file("/a")
+        assert [manifest_line(subtree, file, digest) for file, digest in filesystem.hash_tree("/a", "md5")] \
+            == [hashlib.md5(TREE["a/" + name]).hexdigest() + "  " + name for name in ("one", "two")]
@@ -0,0 +1,96 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Images read over HTTP, from the local server of the benchmarks"""
+
+import http.server
+import os
+import threading
+
+import pytest
+
+from ext4 import Filesystem
+from ext4.http_image import HttpImage
+from benchmarks.http_server import RangeRequestHandler
+
+TREE = {"dir/file": os.urandom(200000), "small": b"over http"}
+
+
+class _NoRangeHandler(RangeRequestHandler):
+    """Ignores the Range header: answers 200 with the whole file"""
+
+    def _serve(self, send_body):
+        del self.headers["Range"]
+        super()._serve(send_body)
+
+
+class _NoValidatorHandler(RangeRequestHandler):
+    def send_header(self, keyword, value):
+        if keyword != "ETag":
+            super().send_header(keyword, value)
+
+
+@pytest.fixture
+def serve(monkeypatch, tmp_path):
+    monkeypatch.setattr(HttpImage, "cache_dir", str(tmp_path / "cache"))
+    servers = []
+
+    def serve(path, handler_class=RangeRequestHandler):
+        directory, name = os.path.split(path)
+        handler_class.requests = 0
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                 lambda *args: handler_class(*args, directory=directory))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/{name}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _read_tree(filesystem):
+    return {path: filesystem.get_file("/" + path).content.get_bytes() for path in TREE}
+
+
+def test_read(make_image, serve, tmp_path):
+    url = serve(make_image(TREE))
+    with Filesystem(url) as filesystem:
+        assert _read_tree(filesystem) == TREE
+    requests = RangeRequestHandler.requests
+    # Chunks are then read from the on-disk cache
+    with Filesystem(url) as filesystem:
+        assert _read_tree(filesystem) == TREE
+    assert RangeRequestHandler.requests == requests + 1  # HEAD
+    assert os.listdir(tmp_path / "cache")
+
+
+def test_range_requests_required(make_image, serve):
+    url = serve(make_image(TREE), _NoRangeHandler)
+    with pytest.raises(OSError, match="range requests"):
+        with Filesystem(url):
+            pass
+
+
+def test_no_validator_no_cache(make_image, serve, tmp_path, caplog):
+    url = serve(make_image(TREE), _NoValidatorHandler)
+    with Filesystem(url) as filesystem:
+        assert _read_tree(filesystem) == TREE
+    assert "not cached" in caplog.text
+    assert not os.path.exists(tmp_path / "cache")
@@ -0,0 +1,68 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Bulk stat of inodes: the same fields as `File.get_stat()`"""
+
+import pytest
+
+from ext4 import Filesystem
+from ext4.tools import FSException
+from conftest import run_debugfs
+
+TREE = {"a": b"a", "dir/b": b"b" * 5000, "dir/sub/c": b"", "dir/empty": None}
+
+
+def _all_files(filesystem):
+    return [filesystem.get_root_dir()] + list(filesystem.get_root_dir().walk())
+
+
+@pytest.mark.parametrize("options", [(), ("-I", "128")], ids=["default", "small_inodes"])
+def test_stat_many(make_image, options):
+    image = make_image(TREE, *options)
+    run_debugfs(image, "sif /a mtime 20300102030405", "sif /dir/b uid 1234", write=True)
+    with Filesystem(image) as filesystem:
+        files = _all_files(filesystem)
+        # Not in disk order: the table keeps the order of the request
+        files.reverse()
+        table = filesystem.stat_many([file.inode_no for file in files])
+        assert len(table) == len(files)
+        for i, file in enumerate(files):
+            assert table.get_stat(i) == file.get_stat(), file.path
+            assert table.size[i] == file.inode.get_size()
+
+
+def test_stat_all(make_image):
+    image = make_image(TREE)
+    with Filesystem(image) as filesystem:
+        directory = filesystem.get_file("/dir")
+        table = directory.stat_all()
+        files = list(directory.get_files())
+        assert table.names == [file.filename for file in files]
+        assert [table.get_stat(i) for i in range(len(table))] == [file.get_stat() for file in files]
+
+
+def test_wrong_checksum(make_image):
+    image = make_image(TREE)
+    run_debugfs(image, "sif /a checksum 0x1234", write=True)
+    with Filesystem(image) as filesystem:
+        filesystem.fail_on_wrong_checksum = False
+        inode_no = filesystem.get_file("/a").inode_no
+        assert filesystem.stat_many([inode_no]).size[0] == 1
+        filesystem.fail_on_wrong_checksum = True
+        with pytest.raises(FSException):
+            filesystem.stat_many([inode_no])
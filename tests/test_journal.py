@@ -0,0 +1,133 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Journal replay: transactions are written by debugfs (`jo`/`jw`/`jc`),
+and the images are compared with a copy recovered by `e2fsck`"""
+
+import logging
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from ext4 import Filesystem
+from conftest import require_tool, run_debugfs
+
+TREE = {"a": b"untouched", "b": b"hello"}
+
+
+def _content(image, path, **kwargs):
+    with Filesystem(image, **kwargs) as filesystem:
+        return filesystem.get_file(path).content.get_bytes()
+
+
+def _data_block(image, path):
+    return int(run_debugfs(image, f"bmap {path} 0").split()[-1])
+
+
+def _write_block(tmp_path, data, name="block"):
+    path = tmp_path / name
+    path.write_bytes(data.ljust(4096, b"\0"))
+    return path
+
+
+def _recovered(image):
+    """Copy of `image` recovered by e2fsck"""
+    require_tool("e2fsck")
+    copy = image + ".recovered"
+    shutil.copyfile(image, copy)
+    subprocess.run(["e2fsck", "-fy", copy], capture_output=True)
+    return copy
+
+
+@pytest.mark.parametrize("open_command", ["jo", "jo -c -v 2", "jo -c -v 3"])
+def test_replay(make_image, tmp_path, open_command):
+    image = make_image(TREE)
+    block = _write_block(tmp_path, b"world")
+    run_debugfs(image, open_command, f"jw -b {_data_block(image, '/b')} {block}", "jc", write=True)
+    assert _content(image, "/b") == b"world" == _content(_recovered(image), "/b", replay_journal=False)
+    assert _content(image, "/a") == b"untouched"
+    assert _content(image, "/b", replay_journal=False) == b"hello"
+
+
+def test_last_transaction_wins(make_image, tmp_path):
+    image = make_image(TREE)
+    block_no = _data_block(image, "/b")
+    first, second = _write_block(tmp_path, b"first", "1"), _write_block(tmp_path, b"later", "2")
+    run_debugfs(image, "jo -c", f"jw -b {block_no} {first}", f"jw -b {block_no} {second}", "jc", write=True)
+    assert _content(image, "/b") == b"later" == _content(_recovered(image), "/b", replay_journal=False)
+
+
+def test_revoke_in_same_transaction(make_image, tmp_path):
+    image = make_image(TREE)
+    block_no = _data_block(image, "/b")
+    run_debugfs(image, "jo -c", f"jw -b {block_no} -r {block_no} {_write_block(tmp_path, b'world')}", "jc",
+                write=True)
+    assert _content(image, "/b") == b"hello" == _content(_recovered(image), "/b", replay_journal=False)
+
+
+def test_revoke_in_later_transaction(make_image, tmp_path):
+    image = make_image(TREE)
+    block_no = _data_block(image, "/b")
+    block = _write_block(tmp_path, b"world")
+    run_debugfs(image, "jo -c", f"jw -b {block_no} {block}", f"jw -r {block_no}", "jc", write=True)
+    assert _content(image, "/b") == b"hello" == _content(_recovered(image), "/b", replay_journal=False)
+
+
+def test_wrong_data_checksum(make_image, tmp_path, caplog):
+    """A logged block not matching its tag checksum is not replayed"""
+    image = make_image(TREE)
+    run_debugfs(image, "jo -c", f"jw -b {_data_block(image, '/b')} {_write_block(tmp_path, b'world')}", "jc",
+                write=True)
+    # Transaction 1 is the descriptor (journal block 1), the data (2) and the commit (3)
+    journal_block = int(run_debugfs(image, "bmap <8> 2").split()[-1])
+    with open(image, "r+b") as f:
+        f.seek(journal_block * 4096)
+        f.write(b"corrupted")
+    with caplog.at_level(logging.WARNING):
+        assert _content(image, "/b") == b"hello"
+    assert "Wrong checksum of block" in caplog.text
+
+
+def test_metadata(make_image, tmp_path):
+    """Inode tables replayed from the journal are read instead of the ones
+    in place"""
+    image = make_image(TREE, "-O", "^metadata_csum")
+    location = run_debugfs(image, "imap /b").split()
+    block_no, offset = int(location[-3].rstrip(",")), int(location[-1], 16)
+    with open(image, "rb") as f:
+        f.seek(block_no * 4096)
+        table = bytearray(f.read(4096))
+    struct.pack_into("<I", table, offset + 4, 4)  # i_size_lo
+    run_debugfs(image, "jo", f"jw -b {block_no} {_write_block(tmp_path, bytes(table))}", "jc", write=True)
+    assert _content(image, "/b") == b"hell" == _content(_recovered(image), "/b", replay_journal=False)
+    assert _content(image, "/b", replay_journal=False) == b"hello"
+
+
+def test_replay_keeps_other_caches(make_image, tmp_path):
+    """The replay drops the cached descriptors of its own file system only"""
+    other = make_image(TREE, name="other.ext4")
+    image = make_image(TREE)
+    run_debugfs(image, "jo", f"jw -b {_data_block(image, '/b')} {_write_block(tmp_path, b'world')}", "jc",
+                write=True)
+    with Filesystem(other) as other_filesystem:
+        descriptor = other_filesystem.get_block_group_desc(0)
+        with Filesystem(image) as filesystem:
+            assert filesystem.journal
+        assert other_filesystem.get_block_group_desc(0) is descriptor
@@ -0,0 +1,211 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Partition tables of whole disk images, built around mkfs.ext4 images"""
+
+import struct
+import uuid
+import zlib
+
+from ext4.partitions import find_ext4_partitions, list_partitions, open_partition
+
+SECTOR = 512
+MiB = 1024 * 1024
+LINUX_GUID = uuid.UUID("0FC63DAF-8483-4772-8E79-3D69D8477DE4")
+
+
+def _file_systems(make_image, n):
+    """`n` images of 4 MiB, with a different /name file each"""
+    images = []
+    for i in range(n):
+        path = make_image({"name": b"fs%d" % i}, size="4M", name=f"fs{i}.ext4")
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+def _mbr_entry(type_, first, count):
+    return struct.pack("<B3sB3sII", 0, bytes(3), type_, bytes(3), first, count)
+
+
+def _boot_record(*entries):
+    sector = bytearray(SECTOR)
+    for i, entry in enumerate(entries):
+        sector[0x1BE + i * 16:0x1CE + i * 16] = entry
+    sector[510:512] = b"\x55\xAA"
+    return bytes(sector)
+
+
+def _write_disk(path, size, *chunks):
+    """Write (offset, data) `chunks` to a sparse disk image of `size` bytes"""
+    with open(path, "wb") as f:
+        f.truncate(size)
+        for offset, data in chunks:
+            f.seek(offset)
+            f.write(data)
+
+
+def _check_names(disk, expected):
+    """Check each partition of `expected` ({name: /name content}) opens"""
+    for name, content in expected.items():
+        with open_partition(disk, name) as filesystem:
+            assert filesystem.get_file("/name").content.get_bytes() == content
+
+
+def test_mbr_with_logical_partition(make_image, tmp_path):
+    fs0, fs1 = _file_systems(make_image, 2)
+    sectors = len(fs0) // SECTOR
+    extended = 2048 + sectors
+    disk = str(tmp_path / "mbr.img")
+    _write_disk(disk, 16 * MiB,
+                (0, _boot_record(_mbr_entry(0x83, 2048, sectors), _mbr_entry(0x05, extended, 2048 + sectors))),
+                (2048 * SECTOR, fs0),
+                # EBR: its logical partition is relative to it
+                (extended * SECTOR, _boot_record(_mbr_entry(0x83, 2048, sectors))),
+                ((extended + 2048) * SECTOR, fs1))
+    partitions = list_partitions(disk)
+    assert [(p.name, p.offset, p.length, p.type) for p in partitions] == [
+        ("1", 2048 * SECTOR, len(fs0), "0x83"),
+        ("5", (extended + 2048) * SECTOR, len(fs1), "0x83")]
+    assert [p.name for p in find_ext4_partitions(disk)] == ["1", "5"]
+    _check_names(disk, {"1": b"fs0", "5": b"fs1"})
+
+
+def _gpt_header(lba, backup_lba, last_usable, entries_lba, entries):
+    fields = [b"EFI PART", 0x00010000, 92, 0, 0, lba, backup_lba, 34, last_usable, uuid.uuid4().bytes_le,
+              entries_lba, 128, 128, zlib.crc32(entries)]
+    header = struct.pack("<8sIIIIQQQQ16sQIII", *fields)
+    fields[3] = zlib.crc32(header)
+    return struct.pack("<8sIIIIQQQQ16sQIII", *fields)
+
+
+def test_gpt(make_image, tmp_path):
+    fs0, fs1 = _file_systems(make_image, 2)
+    sectors = len(fs0) // SECTOR
+    entries = bytearray(128 * 128)
+    for i, (first, label) in enumerate([(2048, "root"), (2048 + 2 * sectors, "home")]):
+        # Entry 1 is left unused: names follow the table slots
+        struct.pack_into("<16s16sQQQ72s", entries, 128 * 2 * i, LINUX_GUID.bytes_le, uuid.uuid4().bytes_le,
+                         first, first + sectors - 1, 0, label.encode('utf-16-le'))
+    entries = bytes(entries)
+    disk_sectors = 32 * MiB // SECTOR
+    mbr = _boot_record(_mbr_entry(0xEE, 1, disk_sectors - 1))
+    disk = str(tmp_path / "gpt.img")
+    _write_disk(disk, 32 * MiB, (0, mbr), (SECTOR, _gpt_header(1, disk_sectors - 1, disk_sectors - 34, 2, entries)),
+                (2 * SECTOR, entries), (2048 * SECTOR, fs0), ((2048 + 2 * sectors) * SECTOR, fs1))
+    partitions = list_partitions(disk)
+    assert [(p.name, p.type, p.label) for p in partitions] == [("1", "Linux filesystem", "root"),
+                                                               ("3", "Linux filesystem", "home")]
+    _check_names(disk, {"1": b"fs0", "3": b"fs1"})
+
+    # Corrupted primary header: the backup one (at the end) is used
+    with open(disk, "r+b") as f:
+        f.seek(SECTOR + 100)
+        f.write(b"\xff")
+        f.seek((disk_sectors - 33) * SECTOR)
+        f.write(entries)
+        f.seek((disk_sectors - 1) * SECTOR)
+        f.write(_gpt_header(disk_sectors - 1, 1, disk_sectors - 34, disk_sectors - 33, entries))
+    assert [p.label for p in list_partitions(disk)] == ["root", "home"]
+
+
+def _lvm_physical_volume(pv_uuid, pe_start, metadata):
+    """The first `pe_start` bytes of an LVM2 physical volume: label, and a
+    metadata area at 4 KiB holding `metadata`"""
+    mda_offset, mda_size = 4096, pe_start - 4096
+    label = bytearray(SECTOR)
+    struct.pack_into("<8sQII8s", label, 0, b"LABELONE", 1, 0, 32, b"LVM2 001")
+    # PV header: UUID, device size, data areas, then metadata areas (each list ended by a null location)
+    struct.pack_into("<32sQQQQQQQQQ", label, 32, pv_uuid.encode('ascii'), 0, pe_start, 0, 0, 0,
+                     mda_offset, mda_size, 0, 0)
+    text = metadata.encode('utf-8')
+    mda_header = bytearray(SECTOR)
+    struct.pack_into("<I16sIQQ", mda_header, 0, 0, b" LVM2 x[5A%r0N*>", 1, mda_offset, mda_size)
+    struct.pack_into("<QQII", mda_header, struct.calcsize("<I16sIQQ"), SECTOR, len(text), 0, 0)
+    area = bytearray(pe_start)
+    area[SECTOR:2 * SECTOR] = label
+    area[mda_offset:mda_offset + SECTOR] = mda_header
+    area[mda_offset + SECTOR:mda_offset + SECTOR + len(text)] = text
+    return bytes(area)
+
+
+def test_lvm(make_image, tmp_path):
+    fs0, fs1 = _file_systems(make_image, 2)
+    pv_uuid = "aBcDeF0123456789aBcDeF0123456789"
+    dashed = "-".join((pv_uuid[:6], pv_uuid[6:10], pv_uuid[10:14], pv_uuid[14:18], pv_uuid[18:22],
+                       pv_uuid[22:26], pv_uuid[26:]))
+    pe_start, extent_size = MiB, 4 * MiB
+    metadata = f"""# Generated by the tests
+vg0 {{
+    id = "vg-id"
+    seqno = 3
+    extent_size = {extent_size // SECTOR}
+    physical_volumes {{
+        pv0 {{
+            id = "{dashed}"
+            device = "/dev/sda2"
+            pe_start = {pe_start // SECTOR}
+            pe_count = 4
+        }}
+    }}
+    logical_volumes {{
+        home {{
+            id = "lv-home"
+            segment_count = 1
+            segment1 {{
+                start_extent = 0
+                extent_count = 1
+                type = "striped"
+                stripe_count = 1
+                stripes = [
+                    "pv0", 2
+                ]
+            }}
+        }}
+        root {{
+            id = "lv-root"
+            segment_count = 1
+            segment1 {{
+                start_extent = 0
+                extent_count = 1
+                type = "striped"
+                stripe_count = 1
+                stripes = ["pv0", 0]
+            }}
+        }}
+    }}
+}}
+"""
+    partition_start = 2048 * SECTOR
+    disk = str(tmp_path / "lvm.img")
+    _write_disk(disk, 32 * MiB,
+                (0, _boot_record(_mbr_entry(0x8E, 2048, (pe_start + 4 * extent_size) // SECTOR))),
+                (partition_start, _lvm_physical_volume(pv_uuid, pe_start, metadata)),
+                (partition_start + pe_start, fs0),
+                (partition_start + pe_start + 2 * extent_size, fs1))
+    partitions = list_partitions(disk)
+    assert [(p.name, p.offset, p.length) for p in partitions] == [
+        ("vg0/home", partition_start + pe_start + 2 * extent_size, extent_size),
+        ("vg0/root", partition_start + pe_start, extent_size)]
+    _check_names(disk, {"vg0/root": b"fs0", "vg0/home": b"fs1"})
+
+
+def test_whole_disk(make_image):
+    image = make_image({"name": b"alone"}, size="4M")
+    assert [(p.name, p.offset) for p in list_partitions(image)] == [("0", 0)]
+    _check_names(image, {"0": b"alone"})
@@ -0,0 +1,90 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Caches shared by several file systems"""
+
+import shutil
+import threading
+
+from ext4.pool import CachePool
+from ext4.stats import Stats
+
+
+def test_snapshots_share_parsed_inodes(make_image, tmp_path):
+    image = make_image({"dir/a": b"a", "dir/b": b"b"})
+    copy = str(tmp_path / "copy.ext4")
+    shutil.copyfile(image, copy)
+    pool = CachePool()
+    for path in (image, copy):
+        with pool.open(path) as filesystem:
+            filesystem.stats = Stats()
+            assert filesystem.get_file("/dir/b").content.get_bytes() == b"b"
+    # Same blocks in the copy: its inodes were parsed for the image
+    assert filesystem.stats.counters["pool.inode.hits"] == 3
+    assert "pool.inode.misses" not in filesystem.stats.counters
+
+
+def test_view_length_while_inserting():
+    pool = CachePool(max_bytes=64 * 1024)
+    view = pool.cache("test", lambda value: 8)
+    stop = threading.Event()
+
+    def insert():
+        i = 0
+        while not stop.is_set():
+            pool.put(("other", i), i, 8)  # Evicts as well
+            i += 1
+
+    thread = threading.Thread(target=insert)
+    thread.start()
+    try:
+        for i in range(2000):
+            view.put(i, i)
+            assert 0 <= len(view) <= i + 1
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_shared_inodes_are_bound_to_their_file_system(make_image, tmp_path):
+    image = make_image({"a": b"a"})
+    copy = str(tmp_path / "copy.ext4")
+    shutil.copyfile(image, copy)
+    pool = CachePool()
+    with pool.open(image) as first:
+        first.get_file("/a")
+    with pool.open(copy) as second:
+        second.stats = Stats()
+        inode = second.get_file("/a").inode
+        assert second.stats.counters["pool.inode.hits"] == 2
+        assert inode.filesystem is second
+        assert inode.get_size() == 1 and inode.no == 12
+
+
+def test_unverified_inodes_are_not_shared(make_image, tmp_path):
+    image = make_image({"a": b"a"})
+    copy = str(tmp_path / "copy.ext4")
+    shutil.copyfile(image, copy)
+    pool = CachePool()
+    with pool.open(image) as lenient:
+        lenient.fail_on_wrong_checksum = False
+        lenient.get_file("/a")
+    with pool.open(copy) as strict:
+        strict.stats = Stats()
+        strict.get_file("/a")
+        assert "pool.inode.hits" not in strict.stats.counters
@@ -0,0 +1,54 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Import cost of the reader, for short-lived CLI invocations (see
+`benchmarks.startup` for the full startup budget, with timings of cat.py)"""
+
+import subprocess
+import sys
+
+from benchmarks.startup import IMPORT_STATEMENT, LAZY_MODULES, _environment
+
+# Own import time of the modules of the package (without the standard
+# library modules they import), best of RUNS
+PACKAGE_IMPORT_BUDGET_US = 15000
+RUNS = 5
+
+
+def _import_times():
+    """{module: own import time in µs} of IMPORT_STATEMENT in a fresh interpreter"""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_STATEMENT], env=_environment(),
+                            capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            own, _, name = line[len("import time:"):].split("|")
+            if own.strip().isdigit():
+                times[name.strip()] = int(own)
+    return times
+
+
+def test_lazy_modules():
+    imported = set(_import_times()) & set(LAZY_MODULES)
+    assert not imported, f"{', '.join(sorted(imported))} should be imported lazily"
+
+
+def test_package_import_time():
+    best = min(sum(own for name, own in _import_times().items() if name.split(".")[0] == "ext4")
+               for _ in range(RUNS))
+    assert best <= PACKAGE_IMPORT_BUDGET_US
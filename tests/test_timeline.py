@@ -0,0 +1,79 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Timeline of the inode times, decoded a whole inode table at once"""
+
+import pytest
+
+from ext4 import Filesystem
+from ext4.files import Directory, RegularFile
+from ext4.timeline import ACCESSED, BORN, CHANGED, MODIFIED, InodeTimes, macb, timeline
+from conftest import run_debugfs
+
+TREE = {"a": b"a", "dir/b": b"b", "dir/sub/c": b"c", "empty": None}
+
+# Times beyond 2038 or before 1970 (epoch bits of the extra fields), and nanoseconds
+TIMES = ["sif /a mtime @-100", "sif /a atime 20400101000000", "sif /dir/b ctime_extra 0x7",
+         "sif /dir/b mtime_extra 0x12345678"]
+
+
+@pytest.mark.parametrize("options", [(), ("-I", "128")], ids=["default", "small_inodes"])
+def test_inode_times(make_image, options):
+    image = make_image(TREE, *options)
+    run_debugfs(image, *TIMES, write=True)
+    with Filesystem(image) as filesystem:
+        times = InodeTimes.read(filesystem)
+        files = [file for file in filesystem.get_root_dir().walk() if isinstance(file, (Directory, RegularFile))]
+        assert len(files) >= 6
+        for file in files:
+            i = times.find(file.inode_no)
+            inode = file.inode
+            assert (times.mode[i], times.uid[i], times.gid[i], times.size[i]) \
+                == (inode.i_mode, inode.i_uid, inode.i_gid, inode.get_size())
+            assert [getattr(times, f"{time}_sec")[i] * 10 ** 9 + getattr(times, f"{time}_nsec")[i]
+                    for time in ("mtime", "atime", "ctime")] \
+                == [inode.get_mtime_ns(), inode.get_atime_ns(), inode.get_ctime_ns()]
+            assert times.has_crtime[i] == (not options)
+        a = times.find(filesystem.get_file("/a").inode_no)
+        assert times.mtime_sec[a] == -100
+        if not options:  # Without extra fields, times wrap around in 2038
+            assert times.atime_sec[a] == 2208988800
+        # Unused inodes are skipped
+        with pytest.raises(KeyError):
+            times.find(filesystem.conf.s_inodes_count)
+
+
+def test_timeline(make_image, tmp_path):
+    image = make_image(TREE)
+    run_debugfs(image, *TIMES, "sif /dir/sub/c atime 20200101000000", "sif /dir/sub/c mtime 20200101000000",
+                write=True)
+    with Filesystem(image) as filesystem:
+        times = InodeTimes.read(filesystem)
+        events = list(timeline(filesystem, times))
+        # Spilled to sorted runs on disk, then merged
+        assert list(timeline(filesystem, times, sort_buffer=5, tmpdir=tmp_path)) == events
+        c = filesystem.get_file("/dir/sub/c").inode_no
+    assert events == sorted(events, key=lambda event: (event[0], event[1], event[3]))
+    # All the times of all the inodes, merged when equal
+    flags = {}
+    for seconds, nanoseconds, event_flags, inode_no in events:
+        assert not flags.get(inode_no, 0) & event_flags
+        flags[inode_no] = flags.get(inode_no, 0) | event_flags
+    assert set(flags.values()) == {MODIFIED | ACCESSED | CHANGED | BORN}
+    assert (1577836800, 0, MODIFIED | ACCESSED, c) in events
+    assert macb(MODIFIED | ACCESSED) == "ma.." and macb(CHANGED | BORN) == "..cb"
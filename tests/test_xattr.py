@@ -0,0 +1,63 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+"""Extended attributes, in the inode and in (shared) blocks"""
+
+from ext4 import Filesystem
+from ext4.data_structures import ExtendedAttributeHeader
+from conftest import run_debugfs
+
+
+def _file_acl(image, path):
+    for line in run_debugfs(image, f"stat {path}").splitlines():
+        if line.startswith("File ACL:"):
+            return int(line.split()[2])
+    raise AssertionError(f"No File ACL line for {path}")
+
+
+def test_shared_block(make_image, tmp_path):
+    # Without metadata_csum: the refcount is patched below, out of debugfs
+    image = make_image({"f1": b"1", "f2": b"2", "f3": b"3"}, "-O", "^metadata_csum")
+    big = tmp_path / "big"
+    big.write_bytes(b"v" * 600)  # Too large for the inode: in a block
+    run_debugfs(image, f"ea_set -f {big} /f1 user.big", "ea_set /f2 user.small s", write=True)
+    block_no = _file_acl(image, "/f1")
+    # f2 and f3 share the block of f1, as the kernel does for identical attributes
+    run_debugfs(image, f"sif /f2 file_acl {block_no}", f"sif /f3 file_acl {block_no}", write=True)
+    with open(image, "r+b") as f:
+        f.seek(block_no * 4096 + ExtendedAttributeHeader.h_refcount.offset)
+        f.write((3).to_bytes(4, 'little'))
+
+    with Filesystem(image) as filesystem:
+        cache = filesystem.xattr_block_cache
+        assert filesystem.get_file("/f1").get_xattrs() == {"user.big": b"v" * 600}
+        assert len(cache) == 1  # Kept for its two other users
+        assert filesystem.get_file("/f2").get_xattrs() == {"user.small": b"s", "user.big": b"v" * 600}
+        assert len(cache) == 1
+        assert filesystem.get_file("/f3").get_xattrs() == {"user.big": b"v" * 600}
+        assert len(cache) == 0  # Served to all its users
+
+
+def test_not_shared_block_is_not_cached(make_image, tmp_path):
+    image = make_image({"f1": b"1"})
+    big = tmp_path / "big"
+    big.write_bytes(bytes(range(256)) * 3)
+    run_debugfs(image, f"ea_set -f {big} /f1 user.big", write=True)
+    with Filesystem(image) as filesystem:
+        assert filesystem.get_file("/f1").get_xattrs() == {"user.big": bytes(range(256)) * 3}
+        assert len(filesystem.xattr_block_cache) == 0
@@ -0,0 +1,103 @@
+# Copyright 2020 Henry-Joseph Audéoud & Timothy Claeys
+#
+# This file is part of ext4-reader.
+#
+# ext4-reader is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ext4-reader is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ext4-reader.  If not, see
+# <https://www.gnu.org/licenses/>.
+
+import csv
+import datetime
+import logging
+import sys
+
+from ext4 import Filesystem
+from ext4.diff import DentryIndex
+from ext4.timeline import InodeTimes, macb, timeline
+from ext4.tools import human_readable_mode
+
+# File types of the bodyfile mode strings, by file type bits of the mode
+_BODYFILE_TYPES = {0x1: "p", 0x2: "c", 0x4: "d", 0x6: "b", 0x8: "r", 0xA: "l", 0xC: "h"}
+
+
+def _paths(index, inode_no):
+    return index.get_paths(inode_no) or [f"<inode {inode_no}>"]
+
+
+def _iso_time(seconds, nanoseconds):
+    time = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=seconds)
+    return f"{time:%Y-%m-%dT%H:%M:%S}.{nanoseconds:09d}Z"
+
+
+def csv_timeline(filesystem, times, index, sort_buffer, tmpdir):
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    writer.writerow(("time", "macb", "inode", "mode", "uid", "gid", "size", "path"))
+    for seconds, nanoseconds, flags, inode_no in timeline(filesystem, times, sort_buffer, tmpdir):
+        i = times.find(inode_no)
+        for path in _paths(index, inode_no):
+            writer.writerow((_iso_time(seconds, nanoseconds), macb(flags), inode_no, f"{times.mode[i]:o}",
+                             times.uid[i], times.gid[i], times.size[i], path))
+
+
+def bodyfile(times, index):
+    """Bodyfile of The Sleuth Kit (to be sorted by `mactime`), in inode order.
+    Times are in seconds."""
+    for i, inode_no in enumerate(times.ino):
+        mode = times.mode[i]
+        file_type = _BODYFILE_TYPES.get(mode >> 12, "-")
+        mode_string = f"{file_type}/{file_type}{human_readable_mode(mode)}"
+        crtime = times.crtime_sec[i] if times.has_crtime[i] else 0
+        for path in _paths(index, inode_no):
+            print(f"0|{path.replace('|', '%7C')}|{inode_no}|{mode_string}|{times.uid[i]}|{times.gid[i]}|"
+                  f"{times.size[i]}|{times.atime_sec[i]}|{times.mtime_sec[i]}|{times.ctime_sec[i]}|{crtime}")
+
+
+def main(block_device, format="csv", sort_buffer=1000000, tmpdir=None):
+    try:
+        with Filesystem(block_device) as filesystem:
+            times = InodeTimes.read(filesystem)
+            index = DentryIndex.build(filesystem)
+            if format == "bodyfile":
+                bodyfile(times, index)
+            else:
+                csv_timeline(filesystem, times, index, sort_buffer, tmpdir)
+    except PermissionError:
+        print(f"{block_device}: permission denied", file=sys.stderr)
+        sys.exit(1)
+
+
+def _args_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="timeline", description="print the access, modification, change and "
+                                                                  "creation times of all the inodes")
+    parser.add_argument("block_device",
+                        help="Path to the block device containing the ext4 file system")
+    parser.add_argument("-f", "--format", choices=("csv", "bodyfile"), default="csv",
+                        help="csv: sorted timeline, one line per time (times in UTC, to the nanosecond); "
+                             "bodyfile: input of mactime, one line per file (times in seconds)")
+    parser.add_argument("--sort-buffer", type=int, default=1000000, metavar="EVENTS",
+                        help="events sorted in memory; beyond, sorted runs are spilled to temporary files")
+    parser.add_argument("--tmpdir", metavar="DIR",
+                        help="directory of the temporary files (default: the system one)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Show debug information")
+    return parser
+
+
+if __name__ == '__main__':
+    _parser = _args_parser()
+    opts = _parser.parse_args()
+    if hasattr(opts, 'verbose'):
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+        del opts.verbose
+    main(**vars(opts))